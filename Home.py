@@ -1,5 +1,12 @@
+import os
+
 import streamlit as st
-import pandas as pd
+
+from analysis.append import refresh_cube, refresh_procedure_matrix
+from analysis.cube import build_cube
+from analysis.ingest import DURATION_COLUMNS, PROCEDURE_COLUMNS, WAITING_LIST_COLUMNS, input_file, read_input
+from analysis.procedures import build_procedure_matrix
+from components.tables import paged_table
 
 st.set_page_config(
     page_title='Admitted Demand and Capacity Analysis',
@@ -15,18 +22,52 @@ This application allows you to analyse procedure demand, capacity, and waiting l
 Use the navigation on the left to select different sections of the analysis.
 """)
 
-# Define file paths
-WAITING_LIST_FILE_PATH = "data/waiting_list.csv"
-PROCEDURE_DATA_FILE_PATH = "data/procedure_data.csv"
+
+@st.cache_data(show_spinner="Reading data files...")
+def load_input(path, modified, columns):
+    # Parsed input file (CSV or streamed .xlsx workbook), re-read only when the file changes
+    return read_input(path, columns)
+
+
+@st.cache_data
+def load_procedure_matrix(procedure_df):
+    # Procedure x month referral and duration matrices, rebuilt only when the procedure data changes
+    return build_procedure_matrix(procedure_df)
+
+
+@st.cache_data
+def load_waiting_list_cube(waiting_list_df):
+    # Trust x site x specialty x month totals at every level, rebuilt only when the waiting list data changes
+    return build_cube(waiting_list_df)
+
 
 try:
-    # Load data from file paths
-    waiting_list_df = pd.read_csv(WAITING_LIST_FILE_PATH)
-    procedure_df = pd.read_csv(PROCEDURE_DATA_FILE_PATH)
+    # Load data from file paths; each file can be a CSV or an .xlsx workbook
+    waiting_list_path = input_file('waiting_list')
+    procedure_data_path = input_file('procedure_data')
+    waiting_list_df = load_input(waiting_list_path, os.path.getmtime(waiting_list_path), WAITING_LIST_COLUMNS)
+    procedure_df = load_input(procedure_data_path, os.path.getmtime(procedure_data_path), PROCEDURE_COLUMNS)
+
+    # Case durations are optional; ingest writes them when built from the patient-level extracts
+    try:
+        durations_path = input_file('procedure_durations')
+        procedure_durations_df = load_input(durations_path, os.path.getmtime(durations_path), DURATION_COLUMNS)
+    except FileNotFoundError:
+        procedure_durations_df = None
 
     # Save data to session state
     st.session_state.waiting_list_df = waiting_list_df
     st.session_state.procedure_df = procedure_df
+    st.session_state.procedure_durations_df = procedure_durations_df
+    # A session that already holds the matrix and cube only aggregates months appended since
+    if st.session_state.get('procedure_matrix') is None:
+        st.session_state.procedure_matrix = load_procedure_matrix(procedure_df)
+    else:
+        st.session_state.procedure_matrix = refresh_procedure_matrix(st.session_state.procedure_matrix, procedure_df)
+    if st.session_state.get('waiting_list_cube') is None:
+        st.session_state.waiting_list_cube = load_waiting_list_cube(waiting_list_df)
+    else:
+        st.session_state.waiting_list_cube = refresh_cube(st.session_state.waiting_list_cube, waiting_list_df)
 
     # Initialize selected specialty if not already set
     if 'selected_specialty' not in st.session_state:
@@ -46,14 +87,16 @@ try:
 
     # Display previews of the datasets
     st.subheader("Waiting List Data Preview")
-    st.write("Here are the first few rows of the Waiting List Data:")
-    st.dataframe(waiting_list_df.head())
+    st.write("Browse the Waiting List Data a page at a time:")
+    paged_table(waiting_list_df, key='preview_waiting_list', page_size=10)
 
     st.subheader("Procedure Data Preview")
-    st.write("Here are the first few rows of the Procedure Data:")
-    st.dataframe(procedure_df.head())
+    st.write("Browse the Procedure Data a page at a time:")
+    paged_table(procedure_df, key='preview_procedure', page_size=10)
 
 except FileNotFoundError as e:
-    st.error(f"Error loading data: {e}. Please ensure the CSV files are located at the correct file paths.")
+    st.error(f"Error loading data: {e}. Please ensure the CSV or .xlsx files are located at the correct file paths.")
+except ValueError as e:
+    st.error(f"Error reading data: {e}")
 
 st.sidebar.header('Data Files Loaded Successfully')
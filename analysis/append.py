@@ -0,0 +1,213 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from analysis.cube import HIERARCHY, build_cube, link_children
+from analysis.data import to_month_end
+from analysis.ingest import (
+    MONTH_FORMAT, PROCEDURE_COLUMNS, WAITING_LIST_COLUMNS, append_to_workbook, input_file, is_workbook, read_input
+)
+from analysis.procedures import build_procedure_matrix, dense, store_matrices
+
+# Columns identifying one row of each input file within a month
+PROCEDURE_KEYS = ['specialty', 'procedure']
+
+
+def _extend_version(version, new_version):
+    # data_version of the combined rows; row hashes add up modulo 2**64
+    return str((int(version) + int(new_version)) % 2 ** 64)
+
+
+def _extend_values(values, n_rows, rows, new_values):
+    # (rows, months, ...) array padded with zero rows for new members and the new months' values placed at `rows`
+    extended = np.zeros((n_rows, values.shape[1] + new_values.shape[1]) + values.shape[2:])
+    extended[:len(values), :values.shape[1]] = values
+    extended[rows, values.shape[1]:] = new_values
+    return extended
+
+
+def _extend_prefix(prefix, n_rows, rows, new_values):
+    # Prefix sums over months carried forward into the new months, adding the new values at `rows`
+    extended = np.zeros((n_rows, prefix.shape[1] + new_values.shape[1]) + prefix.shape[2:])
+    extended[:len(prefix), :prefix.shape[1]] = prefix
+    extended[:, prefix.shape[1]:] = extended[:, prefix.shape[1] - 1:prefix.shape[1]]
+    extended[rows, prefix.shape[1]:] += np.cumsum(new_values, axis=1)
+    return extended
+
+
+def validate_month(new_df, dtypes, latest_month, keys):
+    """Check that new_df holds one month of rows following latest_month and match it to the existing data.
+
+    dtypes are the existing file's column types and keys the columns identifying a row within a
+    month. Raises ValueError on the first problem found; returns the rows with the existing
+    column order and types, which keeps data versions consistent with a reload of the appended file.
+    """
+    missing = [column for column in dtypes.index if column not in new_df.columns]
+    extra = [column for column in new_df.columns if column not in dtypes.index]
+    if missing or extra:
+        raise ValueError(f"New rows have missing columns {missing} and unexpected columns {extra}.")
+    if new_df.empty:
+        raise ValueError("There are no new rows to append.")
+
+    months = to_month_end(new_df['month']).unique()
+    expected = pd.Timestamp(latest_month) + pd.offsets.MonthEnd(1)
+    if len(months) != 1:
+        raise ValueError(f"New rows cover {len(months)} months; append one month at a time.")
+    if months[0] != expected:
+        raise ValueError(f"New rows are for {months[0]:%b %Y} but the next month is {expected:%b %Y}.")
+
+    duplicates = new_df[new_df.duplicated(keys, keep=False)]
+    if not duplicates.empty:
+        raise ValueError(f"New rows repeat {keys}: {duplicates[keys].drop_duplicates().values.tolist()}.")
+    numbers = new_df.select_dtypes('number')
+    negative = numbers.columns[(numbers < 0).any()].tolist()
+    if negative:
+        raise ValueError(f"New rows have negative values in {negative}.")
+
+    new_df = new_df.assign(month=to_month_end(new_df['month']).dt.strftime(MONTH_FORMAT).values)[list(dtypes.index)]
+    try:
+        return new_df.astype(dtypes.to_dict())
+    except (TypeError, ValueError) as error:
+        raise ValueError(f"New rows do not match the existing column types: {error}") from error
+
+
+def append_cube(cube, new_rows):
+    """Extend an aggregate cube with rows for months after its last month.
+
+    Only new_rows are aggregated: each level gains the new months' values (and zero-filled rows
+    for members first seen in them) and its prefix sums are carried forward, so the cost does not
+    grow with the history held. Returns a new cube; the one passed in is left unchanged.
+    """
+    update = build_cube(new_rows)
+    if update['dimensions'] != cube['dimensions'] or update['measures'] != cube['measures']:
+        raise ValueError("New rows must have the same columns as the data the cube was built from.")
+    if update['months'].min() <= cube['months'].max():
+        raise ValueError("New rows must be for months after the last month in the cube.")
+
+    levels, index = {}, {}
+    for level, data in cube['levels'].items():
+        added = update['levels'][level]
+        keys = data['keys'] + [key for key in added['keys'] if key not in cube['index']]
+        position = {key: row for row, key in enumerate(keys)}
+        rows = [position[key] for key in added['keys']]
+        levels[level] = {
+            'keys': keys,
+            'values': _extend_values(data['values'], len(keys), rows, added['values']),
+            'prefix': _extend_prefix(data['prefix'], len(keys), rows, added['values']),
+        }
+        index.update({key: (level, row) for row, key in enumerate(keys)})
+
+    return dict(
+        cube,
+        months=cube['months'].append(update['months']),
+        levels=levels,
+        index=index,
+        children=link_children(cube['dimensions'], levels),
+        version=_extend_version(cube['version'], update['version']),
+        month_versions=np.concatenate([cube['month_versions'], update['month_versions']]),
+        rows=cube['rows'] + update['rows'],
+    )
+
+
+def append_procedure_matrix(matrix, new_rows):
+    """Extend a procedure matrix with rows for months after its last month.
+
+    New procedures and specialties are added after the existing ones, so existing row positions
+    and specialty codes stay valid. Returns a new matrix; the one passed in is left unchanged.
+    """
+    update = build_procedure_matrix(new_rows)
+    if update['months'].min() <= matrix['months'].max():
+        raise ValueError("New rows must be for months after the last month in the procedure matrix.")
+
+    specialties = list(matrix['specialties']) + [s for s in update['specialties'] if s not in matrix['specialty_index']]
+    specialty_index = {specialty: code for code, specialty in enumerate(specialties)}
+    procedure_index = dict(matrix['procedure_index'])
+    for key in update['procedure_index']:
+        procedure_index.setdefault(key, len(procedure_index))
+    rows = [procedure_index[key] for key in update['procedure_index']]
+    n_rows = len(procedure_index)
+
+    referrals = dense(update['referrals'])
+    extended = dict(
+        matrix,
+        procedures=np.array([procedure for _, procedure in procedure_index]),
+        specialties=np.array(specialties),
+        procedure_index=procedure_index,
+        specialty_index=specialty_index,
+        specialty_codes=np.array([specialty_index[specialty] for specialty, _ in procedure_index]),
+        months=matrix['months'].append(update['months']),
+        prefix_referrals=_extend_prefix(matrix['prefix_referrals'], n_rows, rows, referrals),
+        prefix_minutes=_extend_prefix(matrix['prefix_minutes'], n_rows, rows, np.diff(update['prefix_minutes'], axis=1)),
+        version=_extend_version(matrix['version'], update['version']),
+        month_versions=np.concatenate([matrix['month_versions'], update['month_versions']]),
+        rows=matrix['rows'] + update['rows'],
+    )
+    store_matrices(
+        extended,
+        _extend_values(dense(matrix['referrals']), n_rows, rows, referrals),
+        _extend_values(dense(matrix['durations']), n_rows, rows, dense(update['durations']))
+    )
+    return extended
+
+
+def _refresh(source, df, build, append):
+    # Reuse source if df is the data it was built from, append if df only adds later months, else rebuild
+    if source is None:
+        return build(df)
+    hashes = pd.util.hash_pandas_object(df, index=False)
+    if len(df) < source['rows'] or str(hashes.iloc[:source['rows']].sum()) != source['version']:
+        return build(df)
+    if len(df) == source['rows']:
+        return source
+    new_rows = df.iloc[source['rows']:]
+    if to_month_end(new_rows['month']).min() <= source['months'].max():
+        return build(df)
+    return append(source, new_rows)
+
+
+def refresh_cube(cube, waiting_list_df):
+    """The aggregate cube for waiting_list_df, appending to cube when the data only gained later months."""
+    return _refresh(cube, waiting_list_df, build_cube, append_cube)
+
+
+def refresh_procedure_matrix(matrix, procedure_df):
+    """The procedure matrix for procedure_df, appending to matrix when the data only gained later months."""
+    return _refresh(matrix, procedure_df, build_procedure_matrix, append_procedure_matrix)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Append a new month of rows to the app's input files.")
+    parser.add_argument('--waiting-list', help="CSV or .xlsx with the new month's waiting list rows")
+    parser.add_argument('--procedures', help="CSV or .xlsx with the new month's procedure rows")
+    parser.add_argument('--waiting-list-file', help="Defaults to the newer of data/waiting_list.csv and .xlsx, as loaded by the app")
+    parser.add_argument('--procedure-file', help="Defaults to the newer of data/procedure_data.csv and .xlsx, as loaded by the app")
+    args = parser.parse_args(argv)
+    if args.waiting_list is None and args.procedures is None:
+        parser.error("Nothing to append; pass --waiting-list and/or --procedures.")
+
+    # Validate both files before appending either, so a bad month leaves the data untouched
+    targets = []
+    if args.waiting_list:
+        path = args.waiting_list_file or input_file('waiting_list')
+        existing = read_input(path, WAITING_LIST_COLUMNS)
+        keys = [dimension for dimension in HIERARCHY if dimension in existing.columns]
+        targets.append((path, validate_month(
+            read_input(args.waiting_list, WAITING_LIST_COLUMNS), existing.dtypes, to_month_end(existing['month']).max(), keys
+        )))
+    if args.procedures:
+        path = args.procedure_file or input_file('procedure_data')
+        existing = read_input(path, PROCEDURE_COLUMNS)
+        targets.append((path, validate_month(
+            read_input(args.procedures, PROCEDURE_COLUMNS), existing.dtypes, to_month_end(existing['month']).max(), PROCEDURE_KEYS
+        )))
+    for path, new_rows in targets:
+        if is_workbook(path):
+            append_to_workbook(path, new_rows)
+        else:
+            new_rows.to_csv(path, mode='a', header=False, index=False)
+        print(f"Appended {len(new_rows)} rows to {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+
+from analysis.data import to_month_end
+from analysis.durations import sample_from_tables
+
+SESSION_DURATION_HOURS = 4
+# Most rounds of chunked draws made when filling months with cases
+MAX_FILL_ROUNDS = 1000
+
+
+def session_cases(sessions_per_week, weeks_per_year, cancellation_rate, acpl):
+    # Cases delivered in a year by a session model; inputs broadcast against each other
+    sessions_run = np.asarray(sessions_per_week) * weeks_per_year * (1 - np.asarray(cancellation_rate))
+    return sessions_run * acpl
+
+
+def baseline_session_model(waiting_list_df, baseline_start, baseline_end, weeks_per_year=48):
+    """Session model implied by each specialty's baseline activity.
+
+    Returns a DataFrame indexed by specialty with sessions per week (including cancelled sessions),
+    cancellation rate, ACPL, utilisation, removals per case and additions per calendar week,
+    all scaled to a 12-month year.
+    """
+    df = waiting_list_df.assign(month=to_month_end(waiting_list_df['month']).values)
+    baseline_start = pd.to_datetime(baseline_start).to_period('M').to_timestamp('M')
+    baseline_end = pd.to_datetime(baseline_end).to_period('M').to_timestamp('M')
+    baseline_df = df[(df['month'] >= baseline_start) & (df['month'] <= baseline_end)]
+    num_baseline_months = max(baseline_df['month'].nunique(), 1)
+
+    totals = baseline_df.groupby('specialty')[
+        ['cases', 'sessions', 'cancelled sessions', 'minutes utilised', 'additions to waiting list', 'removals from waiting list']
+    ].sum()
+    scheduled = totals['sessions'] + totals['cancelled sessions']
+
+    model = pd.DataFrame(index=totals.index)
+    model['sessions_per_week'] = scheduled * 12 / num_baseline_months / weeks_per_year
+    model['weeks_per_year'] = weeks_per_year
+    model['cancellation_rate'] = (totals['cancelled sessions'] / scheduled).where(scheduled > 0, 0.0)
+    model['acpl'] = (totals['cases'] / totals['sessions']).where(totals['sessions'] > 0, 0.0)
+    model['utilisation'] = (
+        totals['minutes utilised'] / (totals['sessions'] * SESSION_DURATION_HOURS * 60)
+    ).where(totals['sessions'] > 0, 0.0)
+    model['removals_per_case'] = (
+        totals['removals from waiting list'] / totals['cases']
+    ).where(totals['cases'] > 0, 1.0)
+    model['additions_per_week'] = totals['additions to waiting list'] * 12 / num_baseline_months / 52
+    return model
+
+
+def scenario_grid(weeks_per_year, sessions_per_week, utilisation, cancellation_rate, acpl, reference_utilisation,
+                  session_duration_hours=SESSION_DURATION_HOURS, waiting_list_start=None, annual_demand=None):
+    """Evaluate the session model over a full grid of inputs in one broadcast computation.
+
+    Each input is a 1-D array of options; the outputs have shape
+    (weeks, sessions per week, utilisation, cancellation rate). ACPL cases scale with utilisation
+    relative to `reference_utilisation`, the utilisation at which `acpl` was observed.
+    """
+    weeks, sessions, util, cancel = np.meshgrid(
+        np.asarray(weeks_per_year, dtype=float),
+        np.asarray(sessions_per_week, dtype=float),
+        np.asarray(utilisation, dtype=float),
+        np.asarray(cancellation_rate, dtype=float),
+        indexing='ij',
+        sparse=True
+    )
+    sessions_run = weeks * sessions * (1 - cancel)
+    grid = {
+        'sessions_run': np.broadcast_to(sessions_run, np.broadcast_shapes(sessions_run.shape, util.shape)),
+        'session_minutes': sessions_run * session_duration_hours * 60 * util,
+        'acpl_cases': sessions_run * acpl * util / reference_utilisation,
+    }
+    if waiting_list_start is not None and annual_demand is not None:
+        grid['waiting_list_end'] = waiting_list_start + annual_demand - grid['acpl_cases']
+    return grid
+
+
+def simulate_cases_fitted(available_minutes, mix, durations, n_paths=200, rng=None, chunk=256, duration_tables=None):
+    """Monte Carlo count of cases that fit into each month's theatre minutes.
+
+    available_minutes has shape (months,), mix (months, procedures) with each row a probability
+    distribution over procedures, and durations (procedures,) or (months, procedures). Every month
+    on every path draws procedures from that month's mix until the next one no longer fits; draws
+    are made in chunks for all paths and months at once. When duration_tables (inverse-CDF tables
+    of shape (procedures, points), see analysis.durations) are given, each drawn case also draws
+    its own duration instead of taking the fixed one. Returns case counts of shape (n_paths, months).
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    available = np.asarray(available_minutes, dtype=float)
+    mix = np.atleast_2d(np.asarray(mix, dtype=float))
+    n_months, n_procedures = mix.shape
+    durations = np.broadcast_to(np.asarray(durations, dtype=float), mix.shape)
+    # Procedures without a positive duration would fit without end, so they are left out of the mix
+    mix = np.where(durations > 0, mix, 0.0)
+    cases = np.zeros((n_paths, n_months))
+    weight = mix.sum(axis=1)
+    if n_procedures == 0:
+        return cases
+
+    # Offset each month's CDF by its month index so one searchsorted serves every month
+    cdf = np.cumsum(mix, axis=1) / np.where(weight > 0, weight, 1.0)[:, None]
+    month_offsets = np.arange(n_months)
+    flat_cdf = (cdf + month_offsets[:, None]).ravel()
+    last_index = (month_offsets + 1) * n_procedures - 1
+    flat_durations = durations.ravel()
+
+    used = np.zeros((n_paths, n_months))
+    still_filling = np.broadcast_to((weight > 0) & (available > 0), (n_paths, n_months)).copy()
+    for _ in range(MAX_FILL_ROUNDS):
+        if not still_filling.any():
+            break
+        draws = rng.random((n_paths, n_months, chunk)) + month_offsets[None, :, None]
+        index = np.minimum(np.searchsorted(flat_cdf, draws, side='right'), last_index[None, :, None])
+        if duration_tables is None:
+            sampled = flat_durations[index]
+        else:
+            sampled = sample_from_tables(duration_tables, index % n_procedures, rng)
+        # A draw counts only if it and every earlier draw in the month fit
+        fits = np.cumprod(used[..., None] + np.cumsum(sampled, axis=-1) <= available[None, :, None], axis=-1)
+        cases += np.where(still_filling, fits.sum(axis=-1), 0)
+        used += np.where(still_filling, (sampled * fits).sum(axis=-1), 0)
+        still_filling &= fits[..., -1].astype(bool)
+    return cases
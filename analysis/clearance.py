@@ -0,0 +1,80 @@
+import numpy as np
+
+from analysis.cohort import project_cohorts
+from analysis.data import BACKLOG_THRESHOLDS
+
+# A backlog counts as cleared once fewer than this many patients remain in it
+CLEARED_BELOW = 0.5
+
+
+def earliest_clearance_month(projection, thresholds=BACKLOG_THRESHOLDS, prob=0.5):
+    """First projected month in which each backlog is cleared in at least `prob` of paths.
+
+    projection is the output of project_cohorts with simulation paths on the first axis.
+    Returns {'18+': months, ...} with 1-based month numbers and NaN where the backlog
+    is not cleared within the projection horizon.
+    """
+    earliest = {}
+    for weeks in thresholds:
+        cleared = (projection[f'{weeks}+'] < CLEARED_BELOW).mean(axis=0) >= prob
+        month = np.argmax(cleared, axis=-1).astype(float) + 1
+        month[~cleared.any(axis=-1)] = np.nan
+        earliest[f'{weeks}+'] = month
+    return earliest
+
+
+def min_sessions_to_clear(cohorts, additions, removals_per_session, target_month,
+                          thresholds=BACKLOG_THRESHOLDS, prob=0.9, rule='longest_wait',
+                          clinical_share=0.5, tolerance=0.05, iterations=25, max_doublings=8):
+    """Minimum sessions per week that clear each backlog in some month up to `target_month` (1-based).
+
+    cohorts has shape (specialties, weeks); additions and removals_per_session have shape
+    (paths, specialties, months), where removals_per_session is the number of patients removed
+    in a month per weekly session. Bisection runs over the same batch of simulated paths for
+    each threshold and stops once every bracket is narrower than `tolerance` sessions, or after
+    `iterations` steps. Returns {'18+': sessions_per_week, ...}, NaN where the backlog cannot be
+    cleared within the search range.
+    """
+    thresholds = tuple(thresholds)
+    n_thresholds, n_specialties = len(thresholds), cohorts.shape[0]
+    additions = additions[..., :target_month]
+    removals_per_session = removals_per_session[..., :target_month]
+
+    def cleared(sessions_per_week, active):
+        # sessions_per_week and active have shape (thresholds, specialties); only active entries are
+        # projected, and each threshold only totals its own backlog
+        result = np.zeros(active.shape, dtype=bool)
+        for i, weeks in enumerate(thresholds):
+            rows = np.flatnonzero(active[i])
+            if not rows.size:
+                continue
+            projection = project_cohorts(
+                cohorts[rows], additions[:, rows], sessions_per_week[i, rows, None] * removals_per_session[:, rows],
+                rule=rule, clinical_share=clinical_share, thresholds=(weeks,)
+            )
+            result[i, rows] = ((projection[f'{weeks}+'] < CLEARED_BELOW).mean(axis=0) >= prob).any(axis=-1)
+        return result
+
+    # Start from the sessions that would remove the whole list plus demand, then widen until feasible
+    mean_per_session = np.maximum(removals_per_session.mean(axis=(0, 2)), 1e-9)
+    monthly_need = (cohorts.sum(axis=-1) + additions.mean(axis=0).sum(axis=-1)) / target_month
+    high = np.broadcast_to(monthly_need / mean_per_session, (n_thresholds, n_specialties)).copy()
+    feasible = cleared(high, np.ones_like(high, dtype=bool))
+    for _ in range(max_doublings):
+        if feasible.all():
+            break
+        high = np.where(feasible, high, high * 2)
+        feasible |= cleared(high, ~feasible)
+
+    low = np.zeros_like(high)
+    for _ in range(iterations):
+        active = feasible & (high - low > tolerance)
+        if not active.any():
+            break
+        mid = (low + high) / 2
+        ok = cleared(mid, active)
+        high = np.where(active & ok, mid, high)
+        low = np.where(active & ~ok, mid, low)
+
+    high[~feasible] = np.nan
+    return {f'{weeks}+': high[i] for i, weeks in enumerate(thresholds)}
@@ -0,0 +1,117 @@
+import numpy as np
+
+from analysis.data import BACKLOG_THRESHOLDS
+
+# Weekly bins of time waited; the last bin collects everyone waiting MAX_WEEKS - 1 weeks or more
+MAX_WEEKS = 104
+# Width (in weeks) over which the reported 52+ count is spread when building the starting list
+TAIL_WEEKS = 26
+
+PRIORITY_RULES = ('longest_wait', 'clinical')
+
+
+def month_shifts(n_months):
+    # Whole weeks elapsed in each month, alternating 4 and 5 so that 12 months age the list by 52 weeks
+    edges = np.floor(np.arange(n_months + 1) * 52 / 12).astype(int)
+    return np.diff(edges)
+
+
+def initial_cohorts(total, over_18, over_40, over_52, max_weeks=MAX_WEEKS, tail_weeks=TAIL_WEEKS):
+    """Spread the reported waiting list bands evenly over weekly bins.
+
+    Inputs are scalars or arrays of the same shape; the result has a trailing axis of max_weeks bins.
+    """
+    total, over_18, over_40, over_52 = np.broadcast_arrays(
+        *(np.asarray(x, dtype=float) for x in (total, over_18, over_40, over_52))
+    )
+    bands = [
+        (0, 18, total - over_18),
+        (18, 40, over_18 - over_40),
+        (40, 52, over_40 - over_52),
+        (52, min(52 + tail_weeks, max_weeks), over_52),
+    ]
+    cohorts = np.zeros(total.shape + (max_weeks,))
+    for lower, upper, count in bands:
+        cohorts[..., lower:upper] = np.clip(count, 0, None)[..., None] / (upper - lower)
+    return cohorts
+
+
+def sample_monthly_flows(history, n_months, n_paths, rng=None):
+    """Resample historic monthly values to build simulated paths.
+
+    history has shape (specialties, months); NaNs are never drawn.
+    Returns an array of shape (n_paths, specialties, n_months).
+    """
+    rng = np.random.default_rng(rng)
+    history = np.atleast_2d(np.asarray(history, dtype=float))
+    # Move the valid months of each specialty to the front so a single integer draw can index them
+    valid = ~np.isnan(history)
+    order = np.argsort(~valid, axis=1, kind='stable')
+    packed = np.take_along_axis(history, order, axis=1)
+    n_valid = np.maximum(valid.sum(axis=1), 1)
+    idx = np.floor(rng.random((n_paths, history.shape[0], n_months)) * n_valid[None, :, None]).astype(int)
+    packed = np.broadcast_to(packed, (n_paths,) + packed.shape)
+    return np.nan_to_num(np.take_along_axis(packed, idx, axis=2))
+
+
+def _age(cohorts, shift):
+    aged = np.zeros_like(cohorts)
+    last = cohorts.shape[-1] - 1
+    aged[..., shift:last] = cohorts[..., :last - shift]
+    aged[..., last] = cohorts[..., last - shift:].sum(axis=-1)
+    return aged
+
+
+def _remove(cohorts, removals, rule, clinical_share):
+    waiting = cohorts.sum(axis=-1)
+    removals = np.minimum(np.clip(removals, 0, None), waiting)
+
+    if rule == 'clinical':
+        # A share of removals is made on clinical priority, regardless of time waited
+        clinical = removals * clinical_share
+        fraction = np.divide(clinical, waiting, out=np.zeros_like(waiting), where=waiting > 0)
+        cohorts = cohorts * (1 - fraction[..., None])
+        removals = removals - clinical
+
+    # The remainder is taken longest-wait-first
+    older = np.cumsum(cohorts[..., ::-1], axis=-1)[..., ::-1] - cohorts
+    taken = np.clip(removals[..., None] - older, 0, cohorts)
+    return cohorts - taken
+
+
+def project_cohorts(cohorts, additions, removals, rule='longest_wait', clinical_share=0.5,
+                    thresholds=BACKLOG_THRESHOLDS):
+    """Age the waiting list month by month.
+
+    cohorts has shape (..., weeks); additions and removals have shape (..., months) and
+    broadcast against cohorts.shape[:-1], so specialties and simulation paths can be
+    leading axes. Returns a dict with 'total' and one entry per threshold ('18+' etc.),
+    each of shape (..., months), plus the final 'cohorts'.
+    """
+    if rule not in PRIORITY_RULES:
+        raise ValueError(f"Unknown priority rule '{rule}'. Expected one of {PRIORITY_RULES}.")
+
+    additions = np.asarray(additions, dtype=float)
+    removals = np.asarray(removals, dtype=float)
+    n_months = np.broadcast_shapes(additions.shape, removals.shape)[-1]
+    shape = np.broadcast_shapes(cohorts.shape[:-1], additions.shape[:-1], removals.shape[:-1])
+    cohorts = np.broadcast_to(cohorts, shape + cohorts.shape[-1:]).copy()
+    additions = np.broadcast_to(additions, shape + (n_months,))
+    removals = np.broadcast_to(removals, shape + (n_months,))
+
+    results = {'total': np.empty(shape + (n_months,))}
+    for weeks in thresholds:
+        results[f'{weeks}+'] = np.empty(shape + (n_months,))
+
+    for month, shift in enumerate(month_shifts(n_months)):
+        cohorts = _age(cohorts, shift)
+        # New additions have waited between 0 and `shift` weeks by the end of the month
+        cohorts[..., :shift] += additions[..., month, None] / shift
+        cohorts = _remove(cohorts, removals[..., month], rule, clinical_share)
+
+        results['total'][..., month] = cohorts.sum(axis=-1)
+        for weeks in thresholds:
+            results[f'{weeks}+'][..., month] = cohorts[..., weeks:].sum(axis=-1)
+
+    results['cohorts'] = cohorts
+    return results
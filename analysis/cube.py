@@ -0,0 +1,126 @@
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+from analysis.data import to_month_end
+from analysis.procedures import data_version, month_versions
+
+# Optional organisational dimensions, from the top of the hierarchy down to specialty
+HIERARCHY = ('trust', 'site', 'specialty')
+# Additive waiting list columns held in the cube
+CUBE_MEASURES = [
+    'additions to waiting list', 'removals from waiting list', 'total waiting list', 'cases', 'sessions',
+    'planned procedures', 'minutes utilised', 'cancelled sessions', '18+', '40+', '52+'
+]
+
+
+def build_cube(waiting_list_df):
+    """Precompute waiting list totals for every combination of trust, site and specialty by month.
+
+    trust and site are optional columns; missing ones are treated as a single 'All' member. Every
+    grouping set of the dimensions (including the grand total) is stored as a dense
+    (members, months, measures) array with prefix sums over months, and every member is keyed by
+    a (trust, site, specialty) tuple with None for the rolled-up dimensions, so any slice or
+    drill-down is a dictionary lookup. Returns a dict with 'dimensions', 'months', 'measures',
+    'levels', 'index' ({key: (level, row)}), 'children' ({key: [child keys]}), 'version',
+    'month_versions' and 'rows' (the last three let a later month be appended without a rebuild).
+    """
+    df = waiting_list_df.assign(month=to_month_end(waiting_list_df['month']).values)
+    dimensions = tuple(dimension for dimension in HIERARCHY if dimension in df.columns)
+    for dimension in HIERARCHY:
+        if dimension not in df.columns:
+            df[dimension] = 'All'
+    measures = [measure for measure in CUBE_MEASURES if measure in df.columns]
+    months = pd.DatetimeIndex(np.sort(df['month'].unique()))
+
+    # One pass over the data: sum to the finest grain, then roll that small table up
+    finest = df.groupby(list(HIERARCHY) + ['month'])[measures].sum(min_count=1)
+    month_position = months.get_indexer(finest.index.get_level_values('month'))
+
+    levels, index = {}, {}
+    for size in range(len(dimensions) + 1):
+        for level in combinations(dimensions, size):
+            if level:
+                member_codes, members = pd.MultiIndex.from_arrays(
+                    [finest.index.get_level_values(dimension) for dimension in level]
+                ).factorize()
+                members = list(members)
+            else:
+                member_codes, members = np.zeros(len(finest), dtype=int), [()]
+            values = np.zeros((len(members), len(months), len(measures)))
+            np.add.at(values, (member_codes, month_position), np.nan_to_num(finest.to_numpy(dtype=float)))
+            keys = [tuple(member[level.index(d)] if d in level else None for d in HIERARCHY) for member in members]
+            levels[level] = {
+                'keys': keys,
+                'values': values,
+                'prefix': np.concatenate([np.zeros((len(keys), 1, len(measures))), np.cumsum(values, axis=1)], axis=1),
+            }
+            index.update({key: (level, row) for row, key in enumerate(keys)})
+
+    return {
+        'dimensions': dimensions,
+        'months': months,
+        'measures': measures,
+        'levels': levels,
+        'index': index,
+        'children': link_children(dimensions, levels),
+        'version': data_version(waiting_list_df),
+        'month_versions': month_versions(waiting_list_df, months),
+        'rows': len(waiting_list_df),
+    }
+
+
+def link_children(dimensions, levels):
+    # Drill-down follows the hierarchy: grand total -> trusts -> sites -> specialties
+    children = {}
+    for position, dimension in enumerate(dimensions):
+        level = dimensions[:position + 1]
+        for key in levels[level]['keys']:
+            parent = tuple(key[HIERARCHY.index(d)] if d in dimensions[:position] else None for d in HIERARCHY)
+            children.setdefault(parent, []).append(key)
+    return children
+
+
+def cube_key(trust=None, site=None, specialty=None):
+    # Cube key for a member; None rolls a dimension up
+    return (trust, site, specialty)
+
+
+def cube_slice(cube, trust=None, site=None, specialty=None):
+    # Monthly measures for one member, as a DataFrame indexed by month (None if the member does not exist)
+    located = cube['index'].get(cube_key(trust, site, specialty))
+    if located is None:
+        return None
+    level, row = located
+    return pd.DataFrame(cube['levels'][level]['values'][row], index=cube['months'].rename('month'), columns=cube['measures'])
+
+
+def cube_level(cube, by=('specialty',), start=None, end=None, trust=None, site=None):
+    """Measures summed over months start..end (inclusive) for every member of a level.
+
+    by names the dimensions to break down by; trust and site optionally fix the members of the
+    dimensions above. Totals come from the prefix sums, so any window costs one subtraction per
+    member. Returns a DataFrame indexed by the `by` dimensions.
+    """
+    fixed = {dimension: value for dimension, value in (('trust', trust), ('site', site)) if value is not None}
+    level = tuple(dimension for dimension in cube['dimensions'] if dimension in by or dimension in fixed)
+    data = cube['levels'][level]
+    months = cube['months']
+    first = 0 if start is None else months.searchsorted(pd.Timestamp(start).to_period('M').to_timestamp('M'), side='left')
+    last = len(months) if end is None else months.searchsorted(pd.Timestamp(end).to_period('M').to_timestamp('M'), side='right')
+    totals = data['prefix'][:, max(last, first)] - data['prefix'][:, first]
+
+    rows = [
+        row for row, key in enumerate(data['keys'])
+        if all(key[HIERARCHY.index(dimension)] == value for dimension, value in fixed.items())
+    ]
+    by = [dimension for dimension in by if dimension in cube['dimensions']]
+    labels = [tuple(data['keys'][row][HIERARCHY.index(dimension)] for dimension in by) for row in rows]
+    index = pd.MultiIndex.from_tuples(labels, names=by) if len(by) > 1 else pd.Index([label[0] for label in labels], name=by[0] if by else None)
+    return pd.DataFrame(totals[rows], index=index, columns=cube['measures'])
+
+
+def drill_down(cube, trust=None, site=None, specialty=None):
+    # Members one level below a member of the trust -> site -> specialty hierarchy
+    return cube['children'].get(cube_key(trust, site, specialty), [])
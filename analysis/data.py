@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+# Waiting-time bands reported in the waiting list data
+BACKLOG_THRESHOLDS = (18, 40, 52)
+BACKLOG_COLUMNS = ['18+', '40+', '52+']
+
+
+def to_month_end(months):
+    # Parse a 'month' column (dd/mm/yyyy strings or datetimes) and snap it to month end
+    months = pd.to_datetime(pd.Series(months), dayfirst=True)
+    return months.dt.to_period('M').dt.to_timestamp('M')
+
+
+def select_members(waiting_list_df, trust=None, site=None):
+    # Rows for one trust and/or site; None (or a column the data does not have) keeps every member
+    keep = np.ones(len(waiting_list_df), dtype=bool)
+    for column, value in (('trust', trust), ('site', site)):
+        if value is not None and column in waiting_list_df.columns:
+            keep &= (waiting_list_df[column] == value).to_numpy()
+    return waiting_list_df[keep]
+
+
+def latest_by_specialty(waiting_list_df, trust=None, site=None):
+    # Latest month's totals for every specialty, summed over trusts and sites (or within the given ones), indexed by specialty
+    df = select_members(waiting_list_df, trust, site)
+    df = df.assign(month=to_month_end(df['month']).values)
+    df = df[df['month'] == df.groupby('specialty')['month'].transform('max')]
+    latest = df.groupby('specialty')[df.select_dtypes('number').columns].sum(min_count=1)
+    latest.insert(0, 'month', df.groupby('specialty')['month'].first())
+    return latest
+
+
+def month_matrix(df, index, column, rows=None, months=None):
+    """Pivot a long monthly table into a (series x month) array.
+
+    Returns (row labels, months, values); months missing for a series are NaN.
+    """
+    df = df.assign(month=to_month_end(df['month']).values)
+    table = df.pivot_table(index=index, columns='month', values=column, aggfunc='sum')
+    if rows is not None:
+        table = table.reindex(index=list(rows))
+    if months is not None:
+        table = table.reindex(columns=pd.DatetimeIndex(months))
+    return np.asarray(table.index), pd.DatetimeIndex(table.columns), table.to_numpy(dtype=float)
+
+
+def specialty_month_matrix(df, column, specialties=None, months=None):
+    # (specialty x month) array of a waiting list or procedure column
+    return month_matrix(df, 'specialty', column, specialties, months)
@@ -0,0 +1,103 @@
+from statistics import NormalDist
+
+import numpy as np
+
+# Points in each procedure's inverse-CDF table
+TABLE_POINTS = 257
+# Default coefficient of variation (standard deviation / mean) of procedure durations
+DEFAULT_DURATION_CV = 0.3
+
+
+def _probability_grid(n_points):
+    # Evenly spaced probabilities from 0.5/n to 1 - 0.5/n, avoiding the infinite tails
+    return (np.arange(n_points) + 0.5) / n_points
+
+
+def lognormal_tables(means, dispersion=DEFAULT_DURATION_CV, n_points=TABLE_POINTS):
+    """Inverse-CDF tables of lognormal durations with the given means and coefficients of variation.
+
+    means and dispersion broadcast to shape (procedures,). A dispersion of zero gives a table
+    that always returns the mean. The grid stops short of the tails, so each row is rescaled to
+    make the mean of sample_from_tables draws equal its target. Returns an array of shape
+    (procedures, n_points).
+    """
+    means = np.atleast_1d(np.asarray(means, dtype=float))
+    cv = np.broadcast_to(np.asarray(dispersion, dtype=float), means.shape)
+    sigma = np.sqrt(np.log1p(cv ** 2))
+    mu = np.log(np.where(means > 0, means, 1.0)) - sigma ** 2 / 2
+    z = np.array([NormalDist().inv_cdf(p) for p in _probability_grid(n_points)])
+    tables = np.exp(mu[:, None] + sigma[:, None] * z[None, :])
+    return np.where(means[:, None] > 0, tables * (means / sampled_means(tables))[:, None], 0.0)
+
+
+def empirical_tables(durations, procedure_codes, n_procedures=None, n_points=TABLE_POINTS):
+    """Inverse-CDF tables from observed (patient-level) durations.
+
+    durations and procedure_codes are aligned 1-D arrays, with codes being row positions in the
+    procedure catalogue. Procedures with no observations get an all-NaN row so callers can fall
+    back to a fitted distribution. Returns an array of shape (n_procedures, n_points).
+    """
+    durations = np.asarray(durations, dtype=float)
+    procedure_codes = np.asarray(procedure_codes, dtype=int)
+    if n_procedures is None:
+        n_procedures = procedure_codes.max() + 1 if procedure_codes.size else 0
+    tables = np.full((n_procedures, n_points), np.nan)
+    if not durations.size:
+        return tables
+
+    # Sort by procedure then duration, so each procedure's observations are a contiguous sorted run
+    order = np.lexsort((durations, procedure_codes))
+    durations, procedure_codes = durations[order], procedure_codes[order]
+    starts = np.searchsorted(procedure_codes, np.arange(n_procedures), side='left')
+    counts = np.searchsorted(procedure_codes, np.arange(n_procedures), side='right') - starts
+
+    # Linear-interpolated quantiles within each run, for every procedure at once
+    observed = counts > 0
+    position = _probability_grid(n_points)[None, :] * (counts[observed, None] - 1)
+    lower = np.floor(position).astype(int)
+    upper = np.minimum(lower + 1, counts[observed, None] - 1)
+    weight = position - lower
+    base = starts[observed, None]
+    tables[observed] = durations[base + lower] * (1 - weight) + durations[base + upper] * weight
+    return tables
+
+
+def observed_tables(duration_df, keys, n_points=TABLE_POINTS):
+    """Empirical tables for the catalogue entries `keys`, (specialty, procedure) pairs.
+
+    duration_df holds case counts by specialty, procedure and minutes, as written to
+    procedure_durations.csv by analysis.ingest. Entries without recorded cases get an all-NaN
+    row for fill_tables. Returns an array of shape (len(keys), n_points).
+    """
+    position = {key: row for row, key in enumerate(keys)}
+    codes = np.array([position.get(key, -1) for key in zip(duration_df['specialty'], duration_df['procedure'])], dtype=int)
+    known = codes >= 0
+    cases = duration_df['cases'].to_numpy()[known].astype(int)
+    minutes = np.repeat(duration_df['minutes'].to_numpy(dtype=float)[known], cases)
+    return empirical_tables(minutes, np.repeat(codes[known], cases), len(keys), n_points)
+
+
+def fill_tables(tables, fallback):
+    # Replace procedures with no empirical observations by their fallback (e.g. lognormal) tables
+    return np.where(np.isnan(tables).any(axis=1, keepdims=True), fallback, tables)
+
+
+def sampled_means(tables):
+    # Mean of sample_from_tables draws: draws are uniform along the piecewise-linear table, so
+    # the end points carry half the weight of the interior ones
+    return (tables.sum(axis=1) - (tables[:, 0] + tables[:, -1]) / 2) / (tables.shape[1] - 1)
+
+
+def sample_from_tables(tables, procedure_index, rng=None):
+    """Draw one duration per entry of procedure_index from the procedures' inverse-CDF tables.
+
+    Draws interpolate linearly between table points, so the cost per draw is constant however
+    many procedures the catalogue holds. Returns an array shaped like procedure_index.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    n_points = tables.shape[1]
+    position = rng.random(np.shape(procedure_index)) * (n_points - 1)
+    lower = position.astype(int)
+    weight = position - lower
+    upper = np.minimum(lower + 1, n_points - 1)
+    return tables[procedure_index, lower] * (1 - weight) + tables[procedure_index, upper] * weight
@@ -0,0 +1,231 @@
+import argparse
+import os
+import shutil
+import tempfile
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from analysis.capacity import baseline_session_model, scenario_grid
+from analysis.cohort import initial_cohorts, project_cohorts, sample_monthly_flows
+from analysis.data import BACKLOG_COLUMNS, latest_by_specialty, specialty_month_matrix
+from analysis.forecast import FORECASTERS, bootstrap_forecast, forecast, holdout_residuals, run_tournament
+from analysis.ingest import WAITING_LIST_COLUMNS, read_input
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # openpyxl is optional; only needed for .xlsx exports
+    Workbook = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional; only needed for Parquet exports
+    pa = pq = None
+
+EXPORT_FORMATS = ('xlsx', 'parquet')
+# Percentile bands reported for every simulated quantity
+EXPORT_PERCENTILES = (5, 25, 50, 75, 95)
+# Change in sessions per week, relative to the baseline, covered by the capacity scenarios
+SCENARIO_SESSION_CHANGES = np.arange(-2, 4.5, 0.5)
+# Rows handed to the workbook writer at a time
+ROW_CHUNK = 10000
+
+
+def _bands(draws, axis=0):
+    # Percentile bands of simulated draws as a dict of arrays keyed 'p5', 'p25', ...
+    values = np.percentile(draws, EXPORT_PERCENTILES, axis=axis)
+    return {f'p{p}': band for p, band in zip(EXPORT_PERCENTILES, values)}
+
+
+def _long(specialties, months, **columns):
+    # Long (specialty, month) table from (specialties, months) arrays
+    return pd.DataFrame({
+        'specialty': np.repeat(np.asarray(specialties), len(months)),
+        'month': np.tile(pd.DatetimeIndex(months), len(specialties)),
+        **{name: np.asarray(values, dtype=float).ravel() for name, values in columns.items()},
+    })
+
+
+def _month_ends(*dates):
+    return (pd.to_datetime(date).to_period('M').to_timestamp('M') for date in dates)
+
+
+def demand_outlook(waiting_list_df, baseline_start, baseline_end, model_start, n_paths=500, rng=None):
+    """Tournament-winning 12-month demand forecast for every specialty, with bootstrapped draws.
+
+    Forecasters are scored on the 12 pre-baseline months against the baseline (as on the
+    Demand page) and the winner is refitted up to the baseline end. Returns a dict with
+    'specialties', 'history_months', 'history' (specialties, months), 'months', 'methods',
+    'forecast' (specialties, 12) and 'draws' (paths, specialties, 12).
+    """
+    rng = np.random.default_rng(rng)
+    baseline_start, baseline_end, model_start = _month_ends(baseline_start, baseline_end, model_start)
+    specialties, months, additions = specialty_month_matrix(waiting_list_df, 'additions to waiting list')
+    train = (months >= baseline_start - pd.DateOffset(months=12)) & (months < baseline_start)
+    holdout = (months >= baseline_start) & (months <= baseline_end)
+    _, winners = run_tournament(additions[:, train], additions[:, holdout])
+    residuals = holdout_residuals(additions[:, train], additions[:, holdout])
+    offset = max((model_start.to_period('M') - baseline_end.to_period('M')).n, 0)
+    history = additions[:, months <= baseline_end]
+    point = np.stack([forecast(history[[row]], method, 12, offset)[0] for row, method in enumerate(winners)])
+    draws = np.clip(np.stack([
+        bootstrap_forecast(point[[row]], residuals[method][[row]], n_paths, rng)[:, 0]
+        for row, method in enumerate(winners)
+    ], axis=1), 0, None)
+    return {
+        'specialties': list(specialties),
+        'history_months': months,
+        'history': additions,
+        'months': pd.date_range(model_start + pd.offsets.MonthEnd(1), periods=12, freq='M'),
+        'methods': [FORECASTERS[method] for method in winners],
+        'forecast': point,
+        'draws': draws,
+    }
+
+
+def waiting_list_outlook(waiting_list_df, baseline_start, baseline_end, model_start, n_paths=500, rng=None):
+    """Waiting list projections for every specialty from the latest month to a year after the modelling start.
+
+    Starts from the latest reported list and backlog bands and resamples the baseline months'
+    additions and removals. Returns a dict with 'specialties', 'months' and 'projection'
+    (project_cohorts output, each entry of shape (paths, specialties, months)).
+    """
+    rng = np.random.default_rng(rng)
+    baseline_start, baseline_end, model_start = _month_ends(baseline_start, baseline_end, model_start)
+    specialties, months, _ = specialty_month_matrix(waiting_list_df, 'additions to waiting list')
+    baseline = (months >= baseline_start) & (months <= baseline_end)
+    start = latest_by_specialty(waiting_list_df).loc[list(specialties)]
+    horizon = max((model_start.to_period('M') - start['month'].max().to_period('M')).n, 0) + 12
+    cohorts = initial_cohorts(*(start[column].to_numpy() for column in ['total waiting list'] + BACKLOG_COLUMNS))
+    flows = {
+        column: sample_monthly_flows(specialty_month_matrix(waiting_list_df, column, specialties)[2][:, baseline], horizon, n_paths, rng)
+        for column in ('additions to waiting list', 'removals from waiting list')
+    }
+    return {
+        'specialties': list(specialties),
+        'months': pd.date_range(start['month'].max() + pd.offsets.MonthEnd(1), periods=horizon, freq='M'),
+        'projection': project_cohorts(cohorts, flows['additions to waiting list'], flows['removals from waiting list']),
+    }
+
+
+def planning_tables(waiting_list_df, baseline_start, baseline_end, model_start, weeks_per_year=48, n_paths=500, rng=None):
+    """Yield the planning pack as (sheet name, DataFrame) pairs covering every specialty.
+
+    Tables are computed one at a time as the writer asks for them, so only one is held in
+    memory: the backlog summary, demand forecasts (tournament winner with bootstrapped bands),
+    capacity scenarios around each baseline session model, and waiting list projections with
+    percentile bands for the total and every backlog column.
+    """
+    rng = np.random.default_rng(rng)
+    latest = latest_by_specialty(waiting_list_df)
+    model = baseline_session_model(waiting_list_df, baseline_start, baseline_end, weeks_per_year)
+
+    yield 'Backlog', latest[['month', 'total waiting list'] + BACKLOG_COLUMNS].join(model).sort_index().reset_index()
+
+    demand = demand_outlook(waiting_list_df, baseline_start, baseline_end, model_start, n_paths, rng)
+    table = _long(demand['specialties'], demand['months'], forecast=demand['forecast'], **_bands(demand['draws']))
+    table.insert(2, 'method', np.repeat(demand['methods'], len(demand['months'])))
+    yield 'Demand Forecasts', table
+    del demand, table
+
+    scenarios = []
+    for specialty, row in model.iterrows():
+        sessions = np.clip(row['sessions_per_week'] + SCENARIO_SESSION_CHANGES, 0, None)
+        grid = scenario_grid(
+            [row['weeks_per_year']], sessions, [row['utilisation']], [row['cancellation_rate']], row['acpl'],
+            row['utilisation'] if row['utilisation'] > 0 else 1
+        )
+        scenarios.append(pd.DataFrame({
+            'specialty': specialty,
+            'sessions_per_week': sessions,
+            'change_in_sessions_per_week': sessions - row['sessions_per_week'],
+            **{name: values.reshape(len(sessions)) for name, values in grid.items()},
+        }))
+    yield 'Capacity Scenarios', pd.concat(scenarios, ignore_index=True)
+
+    outlook = waiting_list_outlook(waiting_list_df, baseline_start, baseline_end, model_start, n_paths, rng)
+    yield 'Projections', pd.concat([
+        _long(outlook['specialties'], outlook['months'], **_bands(outlook['projection'][key])).assign(measure=key)
+        for key in ['total'] + BACKLOG_COLUMNS
+    ], ignore_index=True)
+
+
+def _cell_rows(df):
+    # Rows as lists of plain Python values, with missing values left empty
+    for first in range(0, len(df), ROW_CHUNK):
+        chunk = df.iloc[first:first + ROW_CHUNK].astype(object)
+        yield from chunk.where(chunk.notna(), None).itertuples(index=False, name=None)
+
+
+def write_workbook(tables, target):
+    """Stream (sheet name, DataFrame) pairs into an .xlsx workbook, one sheet at a time.
+
+    Uses openpyxl's write-only mode, which spools each sheet's rows to disk as they are
+    appended, so memory holds one table rather than the whole workbook. target is a path or
+    a writable binary file.
+    """
+    if Workbook is None:
+        raise ImportError("openpyxl is required to export .xlsx workbooks.")
+    workbook = Workbook(write_only=True)
+    for name, df in tables:
+        sheet = workbook.create_sheet(title=name[:31])
+        sheet.append(list(df.columns))
+        for row in _cell_rows(df):
+            sheet.append(row)
+    workbook.save(target)
+
+
+def write_parquet_dataset(tables, root):
+    """Write each (name, DataFrame) pair to root/<name>/ as a Parquet dataset partitioned by specialty."""
+    if pq is None:
+        raise ImportError("pyarrow is required to export Parquet datasets.")
+    for name, df in tables:
+        pq.write_to_dataset(
+            pa.Table.from_pandas(df, preserve_index=False),
+            root_path=os.path.join(root, name.lower().replace(' ', '_')),
+            partition_cols=['specialty'] if 'specialty' in df.columns else None
+        )
+
+
+def write_pack(tables, target, fmt='xlsx'):
+    """Write the planning pack to target (a path or writable binary file) as .xlsx or zipped Parquet."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}'. Expected one of {EXPORT_FORMATS}.")
+    if fmt == 'xlsx':
+        write_workbook(tables, target)
+        return
+    root = tempfile.mkdtemp()
+    try:
+        write_parquet_dataset(tables, root)
+        with zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for folder, _, files in os.walk(root):
+                for file in files:
+                    archive.write(os.path.join(folder, file), os.path.relpath(os.path.join(folder, file), root))
+    finally:
+        shutil.rmtree(root)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the planning pack for every specialty.")
+    parser.add_argument('output', help="File to write (.xlsx workbook or .zip of a Parquet dataset)")
+    parser.add_argument('--waiting-list', default='data/waiting_list.csv')
+    parser.add_argument('--baseline-start', required=True)
+    parser.add_argument('--baseline-end', required=True)
+    parser.add_argument('--model-start', required=True)
+    parser.add_argument('--weeks-per-year', type=float, default=48)
+    parser.add_argument('--paths', type=int, default=500)
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default=None, help="Defaults to the output file's extension")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ('parquet' if args.output.endswith('.zip') else 'xlsx')
+    tables = planning_tables(
+        read_input(args.waiting_list, WAITING_LIST_COLUMNS), args.baseline_start, args.baseline_end, args.model_start,
+        args.weeks_per_year, args.paths
+    )
+    write_pack(tables, args.output, fmt)
+
+
+if __name__ == '__main__':
+    main()
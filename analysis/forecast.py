@@ -0,0 +1,184 @@
+import numpy as np
+
+from analysis.cohort import sample_monthly_flows
+from analysis.trends import fit_trends
+
+# Forecasters in the tournament, keyed by name, with their display labels
+FORECASTERS = {
+    'mean': 'Average (Baseline)',
+    'linear': 'Regression',
+    'seasonal_naive': 'Seasonal Naive',
+    'damped_trend': 'Damped Trend',
+    'exp_smoothing': 'Exponential Smoothing',
+    'holt_winters': 'Holt-Winters (Seasonal)',
+}
+
+SES_ALPHA = 0.3
+DAMPED_ALPHA, DAMPED_BETA, DAMPED_PHI = 0.5, 0.1, 0.9
+
+SEASON_LENGTH = 12
+# Holt-Winters smoothing parameters searched for every series at once
+HOLT_WINTERS_GRID = {
+    'alpha': np.array([0.1, 0.2, 0.3, 0.5, 0.7, 0.9]),
+    'beta': np.array([0.0, 0.05, 0.1, 0.2]),
+    'gamma': np.array([0.05, 0.1, 0.2, 0.3, 0.5]),
+}
+
+
+def _steps(horizon, offset):
+    # Steps ahead of the last observed month for each forecast month
+    return np.arange(offset + 1, offset + horizon + 1)
+
+
+def _smooth(history, alpha, beta=0.0, phi=1.0):
+    # Exponential smoothing level and trend for every series, skipping missing months
+    level = np.where(np.isnan(history[..., 0]), np.nanmean(history, axis=-1), history[..., 0])
+    trend = np.zeros_like(level)
+    for t in range(1, history.shape[-1]):
+        observed = history[..., t]
+        previous = level
+        new_level = alpha * observed + (1 - alpha) * (previous + phi * trend)
+        new_trend = beta * (new_level - previous) + (1 - beta) * phi * trend
+        missing = np.isnan(observed)
+        level = np.where(missing, previous + phi * trend, new_level)
+        trend = np.where(missing, phi * trend, new_trend)
+    return level, trend
+
+
+def _holt_winters_states(history, alpha, beta, gamma):
+    # Additive Holt-Winters recursion. alpha, beta and gamma have shape (grid,) and history
+    # (series, months); every parameter combination runs alongside every series.
+    # Returns the final level, trend and seasonal states and the one-step-ahead squared error.
+    n_months = history.shape[-1]
+    first_season = history[:, :SEASON_LENGTH]
+    first_mean = np.nanmean(first_season, axis=-1)
+    if n_months >= 2 * SEASON_LENGTH:
+        trend = (np.nanmean(history[:, SEASON_LENGTH:2 * SEASON_LENGTH], axis=-1) - first_mean) / SEASON_LENGTH
+    else:
+        trend = np.zeros_like(first_mean)
+    # Start from the detrended first season, with the level as at its last month
+    offsets = np.arange(SEASON_LENGTH) - (SEASON_LENGTH - 1) / 2
+    seasonal = np.nan_to_num(first_season - (first_mean[:, None] + trend[:, None] * offsets))
+    level = first_mean + trend * offsets[-1]
+
+    shape = (alpha.size,) + level.shape
+    level, trend = np.broadcast_to(level, shape).copy(), np.broadcast_to(trend, shape).copy()
+    seasonal = np.broadcast_to(seasonal, shape + (SEASON_LENGTH,)).copy()
+    alpha, beta, gamma = alpha[:, None], beta[:, None], gamma[:, None]
+    squared_error = np.zeros(shape)
+
+    for t in range(SEASON_LENGTH, n_months):
+        observed = history[:, t]
+        season = seasonal[..., t % SEASON_LENGTH]
+        predicted = level + trend + season
+        missing = np.isnan(observed)
+        observed = np.where(missing, predicted, observed)
+        squared_error += (observed - predicted) ** 2
+
+        new_level = alpha * (observed - season) + (1 - alpha) * (level + trend)
+        trend = beta * (new_level - level) + (1 - beta) * trend
+        seasonal[..., t % SEASON_LENGTH] = gamma * (observed - new_level) + (1 - gamma) * season
+        level = new_level
+    return level, trend, seasonal, squared_error
+
+
+def holt_winters(history, horizon=12, offset=0, grid=HOLT_WINTERS_GRID):
+    """Seasonal (additive Holt-Winters) forecast for every series, with per-series parameters.
+
+    The parameter grid is evaluated for all series in one pass and each series keeps the
+    combination with the lowest one-step-ahead error. Series shorter than one season fall back
+    to exponential smoothing. Returns (forecast, parameters) where forecast has shape
+    (series, horizon) and parameters maps 'alpha', 'beta' and 'gamma' to per-series arrays.
+    """
+    history = np.atleast_2d(np.asarray(history, dtype=float))
+    n_series, n_months = history.shape
+    if n_months < SEASON_LENGTH:
+        return forecast(history, 'exp_smoothing', horizon, offset), {
+            'alpha': np.full(n_series, SES_ALPHA), 'beta': np.zeros(n_series), 'gamma': np.zeros(n_series)
+        }
+
+    alpha, beta, gamma = (values.ravel() for values in np.meshgrid(grid['alpha'], grid['beta'], grid['gamma'], indexing='ij'))
+    level, trend, seasonal, squared_error = _holt_winters_states(history, alpha, beta, gamma)
+
+    best = np.argmin(squared_error, axis=0)
+    rows = np.arange(n_series)
+    steps = _steps(horizon, offset)
+    season_index = (n_months - 1 + steps) % SEASON_LENGTH
+    prediction = (
+        level[best, rows][:, None]
+        + trend[best, rows][:, None] * steps[None, :]
+        + seasonal[best, rows][:, season_index]
+    )
+    return prediction, {'alpha': alpha[best], 'beta': beta[best], 'gamma': gamma[best]}
+
+
+def forecast(history, method, horizon=12, offset=0):
+    """Forecast every series in history with one method.
+
+    history has shape (series, months) ending at the last observed month. The forecast covers
+    the `horizon` months starting `offset` months after it, shape (series, horizon).
+    """
+    history = np.atleast_2d(np.asarray(history, dtype=float))
+    steps = _steps(horizon, offset)
+    n_months = history.shape[-1]
+    mean = np.nanmean(history, axis=-1) if n_months else np.zeros(history.shape[0])
+
+    if method == 'mean':
+        return np.repeat(mean[:, None], horizon, axis=1)
+
+    if method == 'linear':
+        return fit_trends(history, np.arange(n_months), forecast_x=n_months - 1 + steps)['forecast']
+
+    if method == 'seasonal_naive':
+        # Same calendar month in the most recent observed year, falling back to the mean
+        index = n_months - 1 + steps - 12 * np.ceil(steps / 12).astype(int)
+        values = history[:, np.clip(index, 0, None)] if n_months else np.full((history.shape[0], horizon), np.nan)
+        values = np.where(index[None, :] >= 0, values, np.nan)
+        return np.where(np.isnan(values), mean[:, None], values)
+
+    if method == 'damped_trend':
+        level, trend = _smooth(history, DAMPED_ALPHA, DAMPED_BETA, DAMPED_PHI)
+        damping = np.cumsum(DAMPED_PHI ** np.arange(1, steps[-1] + 1))[steps - 1]
+        return level[:, None] + trend[:, None] * damping[None, :]
+
+    if method == 'exp_smoothing':
+        level, _ = _smooth(history, SES_ALPHA)
+        return np.repeat(level[:, None], horizon, axis=1)
+
+    if method == 'holt_winters':
+        return holt_winters(history, horizon, offset)[0]
+
+    raise ValueError(f"Unknown forecaster '{method}'. Expected one of {list(FORECASTERS)}.")
+
+
+def run_tournament(train, holdout, methods=None):
+    """Score each forecaster on a holdout that directly follows the training window.
+
+    train has shape (series, train months) and holdout (series, holdout months).
+    Returns (errors, winners): mean absolute errors of shape (series, methods) and the
+    winning method name per series.
+    """
+    methods = list(methods or FORECASTERS)
+    holdout = np.atleast_2d(np.asarray(holdout, dtype=float))
+    errors = np.stack([
+        np.nanmean(np.abs(forecast(train, method, holdout.shape[-1]) - holdout), axis=-1)
+        for method in methods
+    ], axis=-1)
+    winners = np.asarray(methods)[np.argmin(np.where(np.isnan(errors), np.inf, errors), axis=-1)]
+    return errors, winners
+
+
+def holdout_residuals(train, holdout, methods=None):
+    # Out-of-sample errors (actual - forecast) on the holdout, per method, each of shape (series, holdout months)
+    holdout = np.atleast_2d(np.asarray(holdout, dtype=float))
+    return {method: holdout - forecast(train, method, holdout.shape[-1]) for method in (methods or FORECASTERS)}
+
+
+def bootstrap_forecast(point_forecast, residuals, n_draws=1000, rng=None):
+    """Residual-bootstrap draws around a point forecast.
+
+    point_forecast has shape (series, horizon) and residuals (series, months); each forecast month
+    gets an independently resampled residual. Returns draws of shape (n_draws, series, horizon).
+    """
+    point_forecast = np.atleast_2d(np.asarray(point_forecast, dtype=float))
+    return point_forecast[None] + sample_monthly_flows(residuals, point_forecast.shape[-1], n_draws, rng)
@@ -0,0 +1,299 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from analysis.data import BACKLOG_COLUMNS, BACKLOG_THRESHOLDS, to_month_end
+
+try:
+    from openpyxl import load_workbook
+except ImportError:  # openpyxl is optional; only needed to read .xlsx workbooks
+    load_workbook = None
+
+# Patient-level referral extract: one row per decision to admit; removal date is blank while still waiting
+REFERRAL_COLUMNS = ['specialty', 'procedure', 'decision to admit date', 'removal date']
+# Theatre activity extract: one row per booked case, on a session that ran or was cancelled on the day
+ACTIVITY_COLUMNS = ['session date', 'session id', 'specialty', 'procedure', 'minutes', 'cancelled']
+# Optional activity column flagging planned (surveillance) procedures
+PLANNED_COLUMN = 'planned'
+# Rows read from an extract at a time
+CHUNK_ROWS = 200_000
+# Extensions read as Excel workbooks rather than CSV
+WORKBOOK_EXTENSIONS = ('.xlsx', '.xlsm')
+
+# Column order of the files the app loads
+WAITING_LIST_COLUMNS = [
+    'month', 'specialty', 'additions to waiting list', 'removals from waiting list', 'total waiting list', 'cases',
+    'sessions', 'planned procedures', 'minutes utilised', 'cancelled sessions'
+] + BACKLOG_COLUMNS
+PROCEDURE_COLUMNS = ['month', 'specialty', 'procedure', 'total referrals', 'average duration']
+DURATION_COLUMNS = ['specialty', 'procedure', 'minutes', 'cases']
+MONTH_FORMAT = '%d/%m/%Y'
+# Optional organisational columns kept when present in an input file
+ORGANISATION_COLUMNS = ['trust', 'site']
+# Input columns holding labels rather than numbers
+TEXT_COLUMNS = ['month', 'specialty', 'procedure'] + ORGANISATION_COLUMNS
+
+# Still on the list at the end of the extract
+NOT_REMOVED = np.iinfo(np.int64).max
+EPOCH = pd.Timestamp('1970-01-01')
+
+
+def is_workbook(path):
+    return str(path).lower().endswith(WORKBOOK_EXTENSIONS)
+
+
+def _header_name(value):
+    # Header cell as a column name, ignoring case and repeated or surrounding whitespace
+    return ' '.join(str(value).split()).lower() if value is not None else ''
+
+
+def _find_sheet(workbook, columns, sheet=None):
+    # The named sheet, or the first one whose header row has every column, with each name's position
+    for worksheet in [workbook[sheet]] if sheet is not None else workbook.worksheets:
+        header = next(worksheet.iter_rows(max_row=1, values_only=True), ())
+        positions = {}
+        for position, value in enumerate(header):
+            positions.setdefault(_header_name(value), position)
+        if all(column in positions for column in columns):
+            return worksheet, positions
+    raise ValueError(f"No sheet{'' if sheet is None else f' named {sheet}'} has the columns {columns}.")
+
+
+def read_workbook_chunks(path, columns, chunksize=CHUNK_ROWS, sheet=None, optional=()):
+    """Stream the rows of an .xlsx sheet as DataFrames of `columns` (and any `optional` ones present).
+
+    openpyxl's read-only mode parses the sheet XML as rows are iterated rather than building the
+    whole workbook in memory, and only the wanted cells of each row are kept, so memory is bounded
+    by chunksize. Header cells are matched ignoring case and whitespace; blank rows are skipped.
+    """
+    if load_workbook is None:
+        raise ImportError("openpyxl is required to read .xlsx workbooks.")
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        worksheet, positions = _find_sheet(workbook, columns, sheet)
+        names = list(columns) + [column for column in optional if column in positions and column not in columns]
+        picks = [positions[name] for name in names]
+        rows = []
+        for row in worksheet.iter_rows(min_row=2, max_col=max(picks) + 1, values_only=True):
+            values = tuple(row[pick] if pick < len(row) else None for pick in picks)
+            if any(value is not None for value in values):
+                rows.append(values)
+            if len(rows) == chunksize:
+                yield pd.DataFrame(rows, columns=names)
+                rows = []
+        if rows:
+            yield pd.DataFrame(rows, columns=names)
+    finally:
+        workbook.close()
+
+
+def input_file(stem, directory='data'):
+    # The most recently modified of <directory>/<stem>.csv and <directory>/<stem>.xlsx
+    paths = [path for path in (os.path.join(directory, f"{stem}.csv"), os.path.join(directory, f"{stem}.xlsx")) if os.path.exists(path)]
+    if not paths:
+        raise FileNotFoundError(f"No {stem}.csv or {stem}.xlsx in {directory}")
+    return max(paths, key=os.path.getmtime)
+
+
+def append_to_workbook(path, new_rows):
+    """Add rows under the header of the sheet read_input reads from an .xlsx workbook.
+
+    Unlike reading, this loads the whole workbook, which openpyxl needs in order to save it. Values
+    go under their matching header cells and months are written as dates.
+    """
+    if load_workbook is None:
+        raise ImportError("openpyxl is required to write .xlsx workbooks.")
+    workbook = load_workbook(path)
+    worksheet, positions = _find_sheet(workbook, list(new_rows.columns))
+    width = max(positions[column] for column in new_rows.columns) + 1
+    new_rows = new_rows.assign(month=pd.to_datetime(new_rows['month'], format=MONTH_FORMAT))
+    for row in new_rows.astype(object).where(new_rows.notna(), None).itertuples(index=False):
+        cells = [None] * width
+        for column, value in zip(new_rows.columns, row):
+            cells[positions[column]] = value.item() if isinstance(value, np.generic) else value
+        worksheet.append(cells)
+    workbook.save(path)
+
+
+def read_input(path, columns):
+    """Read one of the app's input files, a CSV or an .xlsx workbook holding `columns`.
+
+    Workbook sheets are streamed and reduced to the expected columns (plus trust and site when
+    present), with months written as dd/mm/yyyy month ends and numbers parsed as a CSV read would,
+    so either source gives the same frame.
+    """
+    if not is_workbook(path):
+        return pd.read_csv(path)
+    chunks = list(read_workbook_chunks(path, columns, optional=ORGANISATION_COLUMNS))
+    df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=columns)
+    df['month'] = to_month_end(df['month']).dt.strftime(MONTH_FORMAT).values
+    numbers = [column for column in df.columns if column not in TEXT_COLUMNS]
+    df[numbers] = df[numbers].apply(pd.to_numeric)
+    return df
+
+
+def read_chunks(path, columns, chunksize=CHUNK_ROWS):
+    # Stream an extract (CSV or .xlsx workbook) in chunks, reading only the columns that are aggregated
+    if is_workbook(path):
+        return read_workbook_chunks(path, columns, chunksize, optional=(PLANNED_COLUMN,))
+    header = pd.read_csv(path, nrows=0).columns
+    missing = [column for column in columns if column not in header]
+    if missing:
+        raise ValueError(f"{path} is missing columns {missing}.")
+    usecols = columns + [column for column in (PLANNED_COLUMN,) if column in header and column not in columns]
+    return pd.read_csv(path, usecols=usecols, chunksize=chunksize)
+
+
+def _accumulate(totals, chunk_totals):
+    # Add one chunk's grouped totals into the running totals
+    return chunk_totals if totals is None else totals.add(chunk_totals, fill_value=0)
+
+
+def aggregate_referrals(chunks):
+    """Incrementally aggregate referral chunks into monthly counts and a compact wait table.
+
+    Memory depends on the number of specialties, procedures and days covered, never on the
+    number of patients. Returns a dict of Series: 'referrals' by (month, specialty, procedure),
+    'additions' and 'removals' by (month, specialty), and 'waits', counts of patients by
+    (specialty, day added, month removed), from which month-end list sizes and backlog
+    bands are rebuilt.
+    """
+    totals = dict.fromkeys(('referrals', 'additions', 'removals', 'waits'))
+    for chunk in chunks:
+        added = pd.to_datetime(chunk['decision to admit date'], dayfirst=True)
+        removed = pd.to_datetime(chunk['removal date'], dayfirst=True)
+        added_month = added.dt.to_period('M').dt.to_timestamp('M')
+        removed_month = removed.dt.to_period('M').dt.to_timestamp('M')
+
+        totals['referrals'] = _accumulate(totals['referrals'], chunk.groupby([added_month.rename('month'), 'specialty', 'procedure']).size())
+        totals['additions'] = _accumulate(totals['additions'], chunk.groupby([added_month.rename('month'), 'specialty']).size())
+        totals['removals'] = _accumulate(
+            totals['removals'],
+            chunk[removed.notna()].groupby([removed_month[removed.notna()].rename('month'), 'specialty']).size()
+        )
+        waits = pd.DataFrame({
+            'specialty': chunk['specialty'],
+            'day added': (added - EPOCH).dt.days,
+            'month removed': removed_month.dt.to_period('M').map(lambda period: period.ordinal, na_action='ignore').fillna(NOT_REMOVED).astype(np.int64),
+        })
+        totals['waits'] = _accumulate(totals['waits'], waits.groupby(['specialty', 'day added', 'month removed']).size())
+    return totals
+
+
+def aggregate_activity(chunks):
+    """Incrementally aggregate theatre activity chunks by (month, specialty) and (month, specialty, procedure).
+
+    Sessions are counted once per session id, whether they ran or were cancelled on the day.
+    Returns a dict with 'activity' (cases, planned procedures, minutes utilised, sessions and
+    cancelled sessions by month and specialty), 'durations' (summed minutes and cases by
+    month, specialty and procedure) and 'case_durations' (cases by specialty, procedure and
+    minutes, the distribution of case lengths without keeping a row per case).
+    """
+    activity, durations, case_durations, sessions = None, None, None, None
+    for chunk in chunks:
+        chunk = chunk.assign(
+            month=pd.to_datetime(chunk['session date'], dayfirst=True).dt.to_period('M').dt.to_timestamp('M'),
+            cancelled=chunk['cancelled'].astype(str).str.strip().str.lower().isin(['1', 'true', 'yes', 'y'])
+        )
+        ran = chunk[~chunk['cancelled']]
+        cases = ran.assign(
+            cases=1,
+            planned=ran[PLANNED_COLUMN].astype(str).str.strip().str.lower().isin(['1', 'true', 'yes', 'y'])
+            if PLANNED_COLUMN in ran.columns else False
+        )
+        activity = _accumulate(activity, cases.groupby(['month', 'specialty']).agg(
+            cases=('cases', 'sum'), planned=('planned', 'sum'), minutes=('minutes', 'sum')
+        ))
+        durations = _accumulate(durations, cases.groupby(['month', 'specialty', 'procedure']).agg(
+            minutes=('minutes', 'sum'), cases=('cases', 'sum')
+        ))
+        case_durations = _accumulate(case_durations, cases.groupby(['specialty', 'procedure', 'minutes']).size())
+        # A session can span chunks, so keep one row per session and its outcome
+        chunk_sessions = chunk.groupby(['month', 'specialty', 'session id'])['cancelled'].all()
+        sessions = chunk_sessions if sessions is None else pd.concat([sessions, chunk_sessions]).groupby(level=[0, 1, 2]).all()
+
+    counts = sessions.groupby(level=[0, 1]).agg(sessions=lambda cancelled: (~cancelled).sum(), cancelled=lambda cancelled: cancelled.sum())
+    return {'activity': activity.join(counts, how='outer').fillna(0), 'durations': durations, 'case_durations': case_durations}
+
+
+def waiting_list_snapshots(waits, months):
+    # Month-end list size and backlog bands per specialty from the (specialty, day added, month removed) counts
+    waits = waits.reset_index(name='patients')
+    day_added = EPOCH + pd.to_timedelta(waits['day added'].to_numpy(), unit='D')
+    rows = []
+    for month in months:
+        on_list = (day_added <= month) & (waits['month removed'].to_numpy() > month.to_period('M').ordinal)
+        weeks_waited = (month - day_added).days // 7
+        snapshot = pd.DataFrame({'specialty': waits['specialty'], 'total waiting list': np.where(on_list, waits['patients'], 0)})
+        for column, threshold in zip(BACKLOG_COLUMNS, BACKLOG_THRESHOLDS):
+            snapshot[column] = np.where(on_list & (weeks_waited >= threshold), waits['patients'], 0)
+        rows.append(snapshot.groupby('specialty').sum().assign(month=month))
+    return pd.concat(rows).reset_index().set_index(['month', 'specialty'])
+
+
+def build_waiting_list(referrals, activity):
+    """waiting_list.csv rows (one per month and specialty) from the aggregated extracts."""
+    index = referrals['additions'].index.union(referrals['removals'].index).union(activity['activity'].index)
+    months = pd.DatetimeIndex(sorted(index.get_level_values(0).unique()))
+    index = pd.MultiIndex.from_product([months, sorted(index.get_level_values(1).unique())], names=['month', 'specialty'])
+    table = pd.DataFrame({
+        'additions to waiting list': referrals['additions'].reindex(index, fill_value=0),
+        'removals from waiting list': referrals['removals'].reindex(index, fill_value=0),
+        'cases': activity['activity']['cases'].reindex(index, fill_value=0),
+        'sessions': activity['activity']['sessions'].reindex(index, fill_value=0),
+        'planned procedures': activity['activity']['planned'].reindex(index, fill_value=0),
+        'minutes utilised': activity['activity']['minutes'].reindex(index, fill_value=0),
+        'cancelled sessions': activity['activity']['cancelled'].reindex(index, fill_value=0),
+    }, index=index).join(waiting_list_snapshots(referrals['waits'], months).reindex(index, fill_value=0))
+    table = table.reset_index()
+    table['month'] = table['month'].dt.strftime(MONTH_FORMAT)
+    return table[WAITING_LIST_COLUMNS].astype({column: int for column in WAITING_LIST_COLUMNS[2:]})
+
+
+def build_procedure_data(referrals, activity):
+    """procedure_data.csv rows from the aggregated extracts.
+
+    Average duration is the month's mean case length for the procedure, falling back to its mean
+    over the whole extract in months without cases (and to 0 for procedures never operated on).
+    """
+    table = referrals['referrals'].rename('total referrals').to_frame()
+    durations = activity['durations']
+    monthly = (durations['minutes'] / durations['cases']).reindex(table.index)
+    overall = durations.groupby(level=[1, 2]).sum()
+    overall = (overall['minutes'] / overall['cases']).reindex(table.index.droplevel(0)).to_numpy()
+    table['average duration'] = monthly.fillna(pd.Series(overall, index=table.index)).fillna(0).round().astype(int)
+    table = table.reset_index().sort_values(['month', 'specialty', 'procedure'])
+    table['month'] = table['month'].dt.strftime(MONTH_FORMAT)
+    return table[PROCEDURE_COLUMNS].astype({'total referrals': int})
+
+
+def build_duration_data(activity):
+    """procedure_durations.csv rows: cases by specialty, procedure and minutes, for empirical duration tables."""
+    table = activity['case_durations'].rename('cases').reset_index().sort_values(['specialty', 'procedure', 'minutes'])
+    return table[DURATION_COLUMNS].astype({'cases': int})
+
+
+def ingest(referral_path, activity_path, output_dir, chunksize=CHUNK_ROWS):
+    """Stream both patient-level extracts and write waiting_list.csv, procedure_data.csv and procedure_durations.csv to output_dir."""
+    referrals = aggregate_referrals(read_chunks(referral_path, REFERRAL_COLUMNS, chunksize))
+    activity = aggregate_activity(read_chunks(activity_path, ACTIVITY_COLUMNS, chunksize))
+    os.makedirs(output_dir, exist_ok=True)
+    build_waiting_list(referrals, activity).to_csv(os.path.join(output_dir, 'waiting_list.csv'), index=False)
+    build_procedure_data(referrals, activity).to_csv(os.path.join(output_dir, 'procedure_data.csv'), index=False)
+    build_duration_data(activity).to_csv(os.path.join(output_dir, 'procedure_durations.csv'), index=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregate patient-level extracts into the app's input files.")
+    parser.add_argument('referrals', help=f"Referral extract (CSV or .xlsx with columns {REFERRAL_COLUMNS})")
+    parser.add_argument('activity', help=f"Theatre activity extract (CSV or .xlsx with columns {ACTIVITY_COLUMNS})")
+    parser.add_argument('--output-dir', default='data')
+    parser.add_argument('--chunksize', type=int, default=CHUNK_ROWS)
+    args = parser.parse_args(argv)
+    ingest(args.referrals, args.activity, args.output_dir, args.chunksize)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+from analysis.capacity import session_cases
+from analysis.cohort import sample_monthly_flows
+
+
+def simulate_annual_factors(addition_history, removal_history, n_paths=2000, rng=None):
+    """Draw one year of demand and capacity variation per simulated path.
+
+    Monthly baseline values are resampled and expressed relative to their mean, so the
+    returned (demand_factor, capacity_factor) arrays of shape (n_paths,) scale an annual
+    point estimate. Draw these once and reuse them for every candidate configuration.
+    """
+    rng = np.random.default_rng(rng)
+    factors = []
+    for history in (addition_history, removal_history):
+        history = np.asarray(history, dtype=float)
+        ratios = history / np.nanmean(history) if np.nanmean(history) > 0 else np.ones_like(history)
+        factors.append(sample_monthly_flows(ratios, 12, n_paths, rng)[:, 0].mean(axis=-1))
+    return factors[0], factors[1]
+
+
+def required_capacity(waiting_list_start, annual_demand, target, demand_factor, capacity_factor, prob=0.9):
+    # Annual cases needed so the end-of-year waiting list is at or below target in `prob` of paths
+    per_path = (waiting_list_start + annual_demand * demand_factor - target) / capacity_factor
+    return max(np.quantile(per_path, prob), 0.0)
+
+
+def optimise_sessions(waiting_list_start, annual_demand, target, demand_factor, capacity_factor,
+                      acpl, cancellation_rate, reference_utilisation,
+                      weeks_options, sessions_options, utilisation_options, prob=0.9):
+    """Search weeks per year x sessions per week x utilisation for the cheapest feasible configuration.
+
+    Cases per session scale with utilisation relative to `reference_utilisation` (the utilisation at
+    which `acpl` was observed). A configuration is feasible if the simulated end-of-year waiting list
+    is at or below `target` with probability `prob`. Every candidate is scored against the same draws.
+    Returns a DataFrame of feasible configurations, cheapest (fewest scheduled sessions) first.
+    """
+    weeks, sessions, utilisation = np.meshgrid(
+        np.asarray(weeks_options, dtype=float),
+        np.asarray(sessions_options, dtype=float),
+        np.asarray(utilisation_options, dtype=float),
+        indexing='ij'
+    )
+    cases = session_cases(sessions, weeks, cancellation_rate, acpl * utilisation / reference_utilisation)
+
+    # Each path needs at least this many cases; a candidate's probability is the share of paths it covers
+    per_path = np.sort((waiting_list_start + annual_demand * demand_factor - target) / capacity_factor)
+    probability = np.searchsorted(per_path, cases, side='right') / per_path.size
+
+    candidates = pd.DataFrame({
+        'weeks_per_year': weeks.ravel(),
+        'sessions_per_week': sessions.ravel(),
+        'utilisation': utilisation.ravel(),
+        'total_sessions': (weeks * sessions).ravel(),
+        'cases': cases.ravel(),
+        'probability': probability.ravel()
+    })
+    candidates['waiting_list_end'] = waiting_list_start + annual_demand - candidates['cases']
+    feasible = candidates[candidates['probability'] >= prob]
+    return feasible.sort_values(['total_sessions', 'utilisation', 'weeks_per_year']).reset_index(drop=True)
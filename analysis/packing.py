@@ -0,0 +1,86 @@
+import numpy as np
+
+from analysis.durations import sample_from_tables
+
+PACKING_METHODS = {
+    'first_fit_decreasing': 'First Fit Decreasing',
+    'best_fit': 'Best Fit',
+}
+DEFAULT_TURNAROUND_MINUTES = 15
+
+
+def pack_lists(durations, n_lists, list_minutes, turnaround_minutes=0.0, method='first_fit_decreasing'):
+    """Pack candidate cases into theatre lists for many weeks at once.
+
+    durations has shape (weeks, candidates), NaN for no case. Each week has n_lists lists of
+    list_minutes; a case takes its duration plus turnaround, except that no turnaround is needed
+    after the last case of a list. 'first_fit_decreasing' places the longest cases first into the
+    first list with room; 'best_fit' takes cases in the order given and places each into the list
+    it leaves with the least spare time. Cases that fit nowhere stay unbooked.
+    Returns a dict with 'cases' and 'unused_minutes' of shape (weeks, n_lists) and 'booked'
+    (weeks, candidates) marking which candidates were placed.
+    """
+    durations = np.atleast_2d(np.asarray(durations, dtype=float))
+    n_weeks, n_candidates = durations.shape
+    if method == 'first_fit_decreasing':
+        order = np.argsort(-np.nan_to_num(durations, nan=-np.inf), axis=1, kind='stable')
+    elif method == 'best_fit':
+        order = np.broadcast_to(np.arange(n_candidates), durations.shape)
+    else:
+        raise ValueError(f"Unknown packing method '{method}'. Expected one of {list(PACKING_METHODS)}.")
+
+    # Give every list one extra turnaround so each case can be charged duration + turnaround
+    remaining = np.full((n_weeks, n_lists), list_minutes + turnaround_minutes, dtype=float)
+    cases = np.zeros((n_weeks, n_lists), dtype=int)
+    booked = np.zeros(durations.shape, dtype=bool)
+    weeks = np.arange(n_weeks)
+
+    for position in range(n_candidates):
+        candidate = order[:, position]
+        need = durations[weeks, candidate] + turnaround_minutes
+        spare = remaining - need[:, None]
+        fits = spare >= 0
+        if method == 'first_fit_decreasing':
+            chosen = np.argmax(fits, axis=1)
+        else:
+            chosen = np.argmin(np.where(fits, spare, np.inf), axis=1)
+        placed = fits[weeks, chosen] & ~np.isnan(need)
+        remaining[weeks[placed], chosen[placed]] -= need[placed]
+        cases[weeks[placed], chosen[placed]] += 1
+        booked[weeks[placed], candidate[placed]] = True
+
+    # The spare turnaround given to each list makes what is left exactly its unused time
+    return {'cases': cases, 'unused_minutes': np.where(cases > 0, remaining, list_minutes), 'booked': booked}
+
+
+def simulate_list_packing(probabilities, durations, n_lists, list_minutes, turnaround_minutes=DEFAULT_TURNAROUND_MINUTES,
+                          method='first_fit_decreasing', n_weeks=2000, duration_tables=None, rng=None):
+    """Simulate weeks of theatre lists filled from a procedure mix.
+
+    Each week draws the cases demanded from `probabilities` (with fixed `durations`, or durations
+    drawn from inverse-CDF `duration_tables`): as many as its lists hold on average, with no
+    oversupply, so the booked cases keep the procedure mix rather than favouring whichever cases
+    the packing method prefers. The draw is packed with pack_lists and cases that do not fit stay
+    unbooked. Returns the pack_lists dict plus 'cases_per_list' and
+    'unused_minutes_per_list' averages and 'utilisation' (booked case minutes / list minutes).
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    probabilities = np.asarray(probabilities, dtype=float)
+    durations = np.asarray(durations, dtype=float)
+    n_lists = max(int(np.ceil(n_lists)), 1)
+
+    mean_need = (probabilities * durations).sum() + turnaround_minutes
+    # Every case is charged duration + turnaround, with one turnaround refunded per list
+    n_candidates = max(int(round(n_lists * (list_minutes + turnaround_minutes) / max(mean_need, 1.0))), 1)
+    procedure = np.minimum(
+        np.searchsorted(np.cumsum(probabilities) / probabilities.sum(), rng.random((n_weeks, n_candidates)), side='right'),
+        len(probabilities) - 1
+    )
+    sampled = durations[procedure] if duration_tables is None else sample_from_tables(duration_tables, procedure, rng)
+
+    packed = pack_lists(sampled, n_lists, list_minutes, turnaround_minutes, method)
+    booked_minutes = np.where(packed['booked'], sampled, 0.0).sum()
+    packed['cases_per_list'] = packed['cases'].mean()
+    packed['unused_minutes_per_list'] = packed['unused_minutes'].mean()
+    packed['utilisation'] = booked_minutes / (n_weeks * n_lists * list_minutes)
+    return packed
@@ -0,0 +1,178 @@
+import numpy as np
+import pandas as pd
+
+from analysis.data import to_month_end
+from analysis.trends import fit_trends, month_number
+
+try:
+    from scipy import sparse
+except ImportError:  # scipy is optional; matrices stay dense without it
+    sparse = None
+
+# Store the referral and duration matrices sparse when fewer than this share of cells are filled
+SPARSE_DENSITY = 0.3
+
+
+def data_version(df):
+    # Cheap content hash used to key caches on a dataset
+    return str(pd.util.hash_pandas_object(df, index=False).sum())
+
+
+def month_versions(df, months):
+    # Content hash of each month's rows, aligned with the month-end `months`; row hashes add up
+    # (wrapping), so these sum to data_version(df) and appending a month only adds an entry
+    versions = np.zeros(len(months), dtype=np.uint64)
+    np.add.at(versions, months.get_indexer(to_month_end(df['month'])), pd.util.hash_pandas_object(df, index=False).to_numpy())
+    return versions
+
+
+def history_version(source, end=None):
+    # Version of a procedure matrix's or cube's data up to month `end` (inclusive), for keying caches
+    # whose results only depend on that history; later months leave it unchanged
+    _, last = window_bounds(source, None, end)
+    return str(source['month_versions'][:last].sum())
+
+
+def build_procedure_matrix(procedure_df):
+    """Pivot procedure_data into aligned (procedure x month) matrices.
+
+    Returns a dict with:
+      'procedures', 'specialties' - row labels and the specialty of each row
+      'procedure_index', 'specialty_index' - {(specialty, procedure): row} and {specialty: code}
+      'specialty_codes' - specialty code of each row
+      'months' - month-end DatetimeIndex of the columns
+      'referrals', 'durations' - referrals and average duration per cell (sparse when density is low)
+      'prefix_referrals', 'prefix_minutes' - cumulative sums over months with a leading zero column,
+        so totals over any window are one subtraction per procedure
+      'version', 'month_versions', 'rows' - content hash of the source data, of each month's rows,
+        and the number of rows, so a later month can be appended without a rebuild
+    """
+    df = procedure_df.assign(month=to_month_end(procedure_df['month']).values)
+    keys = df[['specialty', 'procedure']].drop_duplicates().sort_values(['specialty', 'procedure'])
+    months = pd.DatetimeIndex(np.sort(df['month'].unique()))
+    specialties = np.sort(keys['specialty'].unique())
+
+    procedure_index = {key: row for row, key in enumerate(zip(keys['specialty'], keys['procedure']))}
+    specialty_index = {specialty: code for code, specialty in enumerate(specialties)}
+    rows = np.fromiter((procedure_index[key] for key in zip(df['specialty'], df['procedure'])), dtype=int, count=len(df))
+    columns = months.get_indexer(df['month'])
+    shape = (len(procedure_index), len(months))
+
+    referrals = np.zeros(shape)
+    minutes = np.zeros(shape)
+    np.add.at(referrals, (rows, columns), df['total referrals'].to_numpy(dtype=float))
+    np.add.at(minutes, (rows, columns), (df['total referrals'] * df['average duration']).to_numpy(dtype=float))
+    durations = np.divide(minutes, referrals, out=np.zeros(shape), where=referrals > 0)
+    # Procedures recorded with no referrals still carry their duration
+    no_referrals = (referrals[rows, columns] == 0)
+    durations[rows[no_referrals], columns[no_referrals]] = df['average duration'].to_numpy(dtype=float)[no_referrals]
+
+    matrix = {
+        'procedures': keys['procedure'].to_numpy(),
+        'specialties': specialties,
+        'procedure_index': procedure_index,
+        'specialty_index': specialty_index,
+        'specialty_codes': keys['specialty'].map(specialty_index).to_numpy(),
+        'months': months,
+        'prefix_referrals': np.concatenate([np.zeros((shape[0], 1)), np.cumsum(referrals, axis=1)], axis=1),
+        'prefix_minutes': np.concatenate([np.zeros((shape[0], 1)), np.cumsum(minutes, axis=1)], axis=1),
+        'version': data_version(procedure_df),
+        'month_versions': month_versions(procedure_df, months),
+        'rows': len(procedure_df),
+    }
+    store_matrices(matrix, referrals, durations)
+    return matrix
+
+
+def store_matrices(matrix, referrals, durations):
+    # Keep the referral and duration matrices sparse when few cells are filled
+    density = matrix['rows'] / max(referrals.size, 1)
+    if sparse is not None and density < SPARSE_DENSITY:
+        matrix['referrals'] = sparse.csr_array(referrals)
+        matrix['durations'] = sparse.csr_array(durations)
+    else:
+        matrix['referrals'] = referrals
+        matrix['durations'] = durations
+
+
+def dense(values):
+    # Dense ndarray view of a matrix that may be stored sparse
+    return values.toarray() if hasattr(values, 'toarray') else np.asarray(values)
+
+
+def specialty_rows(matrix, specialty):
+    # Row positions of a specialty's procedures (empty for a specialty with no procedure data)
+    return np.flatnonzero(matrix['specialty_codes'] == matrix['specialty_index'].get(specialty, -1))
+
+
+def window_bounds(matrix, start=None, end=None):
+    # Prefix-sum column positions covering months start..end (inclusive)
+    months = matrix['months']
+    first = 0 if start is None else months.searchsorted(pd.Timestamp(start).to_period('M').to_timestamp('M'), side='left')
+    last = len(months) if end is None else months.searchsorted(pd.Timestamp(end).to_period('M').to_timestamp('M'), side='right')
+    return first, max(last, first)
+
+
+def window_totals(matrix, start=None, end=None, rows=None):
+    """Referrals and demand minutes per procedure over a window, from the prefix sums.
+
+    Returns (referrals, minutes, average_duration) arrays over the selected rows.
+    """
+    first, last = window_bounds(matrix, start, end)
+    rows = slice(None) if rows is None else rows
+    referrals = matrix['prefix_referrals'][rows, last] - matrix['prefix_referrals'][rows, first]
+    minutes = matrix['prefix_minutes'][rows, last] - matrix['prefix_minutes'][rows, first]
+    average_duration = np.divide(minutes, referrals, out=np.zeros_like(minutes), where=referrals > 0)
+    return referrals, minutes, average_duration
+
+
+def procedure_mix(matrix, specialty, start=None, end=None):
+    """Procedure-mix probabilities and average durations for a specialty over a window.
+
+    Returns (rows, probabilities, average_durations); procedures with no referrals in the window are dropped.
+    """
+    rows = specialty_rows(matrix, specialty)
+    referrals, _, average_duration = window_totals(matrix, start, end, rows)
+    keep = referrals > 0
+    total = referrals[keep].sum()
+    probabilities = referrals[keep] / total if total > 0 else referrals[keep]
+    return rows[keep], probabilities, average_duration[keep]
+
+
+def specialty_monthly(matrix, values=None):
+    # (specialty x month) totals of a procedure matrix (referrals by default)
+    values = matrix['referrals'] if values is None else values
+    codes = matrix['specialty_codes']
+    indicator = np.zeros((len(matrix['specialties']), len(codes)))
+    indicator[codes, np.arange(len(codes))] = 1
+    return dense(indicator @ values)
+
+
+def procedure_trends(matrix, end=None, horizon=None, offset=0, rows=None):
+    # Linear trends for every procedure (or the selected rows) up to `end`, with a forecast over
+    # the `horizon` months starting `offset` months after it when given
+    first, last = window_bounds(matrix, None, end)
+    x = month_number(matrix['months'][first:last])
+    referrals = matrix['referrals'] if rows is None else matrix['referrals'][rows]
+    return fit_trends(
+        dense(referrals)[:, first:last],
+        x,
+        forecast_x=None if horizon is None or not x.size else x[-1] + np.arange(offset + 1, offset + horizon + 1)
+    )
+
+
+def monthly_mix(matrix, specialty, start=None, end=None, horizon=12, offset=0, forecast=False):
+    """Month-by-month procedure mix for a specialty over the `horizon` months being modelled.
+
+    With forecast=False every month uses the start..end window mix. With forecast=True each month
+    is weighted by the procedures' referral trends fitted up to `end` and projected `offset` months
+    on; months where every trend has fallen to zero keep the window mix.
+    Returns (rows, mix, durations) with mix of shape (horizon, procedures) and window-average durations.
+    """
+    rows, probabilities, durations = procedure_mix(matrix, specialty, start, end)
+    mix = np.repeat(probabilities[None], horizon, axis=0)
+    if forecast and rows.size:
+        trend_forecast = np.clip(procedure_trends(matrix, end, horizon, offset, rows)['forecast'], 0, None).T
+        total = trend_forecast.sum(axis=1, keepdims=True)
+        mix = np.where(total > 0, trend_forecast / np.where(total > 0, total, 1.0), mix)
+    return rows, mix, durations
@@ -0,0 +1,78 @@
+import numpy as np
+
+from analysis.data import BACKLOG_COLUMNS, BACKLOG_THRESHOLDS
+
+# Waiting-time percentiles reported by default: the median and the 92% referral-to-treatment standard
+WAIT_PERCENTILES = (0.5, 0.92)
+
+
+def littles_law_waits(waiting_list, arrival_rate, service_rate, percentiles=WAIT_PERCENTILES):
+    """Mean wait implied by each list's size and throughput (Little's law), for all specialties at once.
+
+    Rates are patients per week and broadcast against the list sizes. A list served at
+    service_rate clears its current patients in waiting_list / service_rate weeks, which is the
+    mean wait of those patients when the flows are steady. Percentiles of the time waited so far
+    use the fluid first-come-first-served profile of transient_waits held at the current list
+    size: the list holds the most recent arrivals, so their waits spread evenly up to
+    waiting_list / arrival_rate weeks. Returns a dict with 'utilisation' (arrivals / removals),
+    'mean_wait' (weeks; infinite when nothing is removed) and 'percentiles' (weeks, with a
+    trailing percentile axis; infinite when nothing arrives).
+    """
+    waiting_list, arrival_rate, service_rate = np.broadcast_arrays(
+        np.asarray(waiting_list, dtype=float), np.asarray(arrival_rate, dtype=float), np.asarray(service_rate, dtype=float)
+    )
+    served = service_rate > 0
+    unfilled = np.where(waiting_list > 0, np.inf, 0.0)
+    oldest = np.divide(waiting_list, arrival_rate, out=unfilled.copy(), where=arrival_rate > 0)
+    return {
+        'utilisation': np.divide(arrival_rate, service_rate, out=np.full(arrival_rate.shape, np.inf), where=served),
+        'mean_wait': np.divide(waiting_list, service_rate, out=unfilled, where=served),
+        'percentiles': oldest[..., None] * np.asarray(percentiles, dtype=float),
+    }
+
+
+def transient_waits(cohorts, arrival_rate, service_rate, weeks, percentiles=WAIT_PERCENTILES, thresholds=BACKLOG_THRESHOLDS):
+    """Waits on the list over time from a fluid first-come-first-served approximation.
+
+    cohorts has shape (specialties, weekly bins) with the starting list by weeks waited (see
+    analysis.cohort.initial_cohorts); rates are patients per week per specialty and weeks the
+    integer horizons to report. The list grows or shrinks at (arrival - service) per week and,
+    being served longest wait first, always holds the most recent arrivals, so its age profile
+    follows from the cumulative arrivals by age. Everything is evaluated for all specialties and
+    horizons at once. Returns a dict with 'waiting_list' (specialties, horizons), 'percentiles'
+    (specialties, horizons, percentiles) and 'share_over' keyed like the backlog columns.
+    """
+    cohorts = np.atleast_2d(np.asarray(cohorts, dtype=float))
+    n_specialties, n_bins = cohorts.shape
+    arrival_rate = np.broadcast_to(np.asarray(arrival_rate, dtype=float), (n_specialties,))[:, None, None]
+    service_rate = np.broadcast_to(np.asarray(service_rate, dtype=float), (n_specialties,))[:, None, None]
+    weeks = np.atleast_1d(np.asarray(weeks, dtype=int))
+
+    # Patients waiting at most a weeks at horizon t: arrivals since the start plus the starting
+    # patients who had waited at most a - t weeks, on an integer grid of ages
+    ages = np.arange(weeks.max() + n_bins + 1)
+    starting_by_age = np.concatenate([np.zeros((n_specialties, 1)), np.cumsum(cohorts, axis=1)], axis=1)
+    older = np.clip(ages[None, :] - weeks[:, None], 0, n_bins)
+    arrived = arrival_rate * np.minimum(ages[None, :], weeks[:, None])[None] + starting_by_age[:, older]
+
+    waiting_list = np.clip(starting_by_age[:, -1][:, None] + (arrival_rate - service_rate)[..., 0] * weeks[None, :], 0, None)
+    listed = waiting_list[..., None]
+
+    # Invert the cumulative profile: the age below which a share p of the list has waited
+    target = listed * np.asarray(percentiles, dtype=float)
+    upper = np.minimum((arrived[..., None, :] < target[..., None]).sum(axis=-1), len(ages) - 1)
+    lower = np.maximum(upper - 1, 0)
+    at_upper = np.take_along_axis(arrived, upper, axis=-1)
+    at_lower = np.take_along_axis(arrived, lower, axis=-1)
+    step = at_upper - at_lower
+    fraction = np.divide(target - at_lower, step, out=np.zeros_like(step), where=step > 0)
+    wait_percentiles = np.where(listed > 0, lower + np.clip(fraction, 0, 1) * (upper > 0), 0.0)
+
+    share_over = {}
+    for column, threshold in zip(BACKLOG_COLUMNS, thresholds):
+        within = arrived[..., min(threshold, len(ages) - 1)]
+        share_over[column] = np.divide(
+            np.clip(waiting_list - within, 0, None), waiting_list,
+            out=np.zeros_like(waiting_list), where=waiting_list > 0
+        )
+    return {'waiting_list': waiting_list, 'percentiles': wait_percentiles, 'share_over': share_over}
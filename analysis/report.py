@@ -0,0 +1,250 @@
+import argparse
+import html
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from plotly.offline import get_plotlyjs
+
+from analysis.capacity import baseline_session_model
+from analysis.data import BACKLOG_COLUMNS, latest_by_specialty, specialty_month_matrix
+from analysis.export import demand_outlook, waiting_list_outlook
+from analysis.ingest import WAITING_LIST_COLUMNS, read_input
+from components.charts import band_trace, line_trace
+
+# Plotly is written once next to the reports and every page links to it
+PLOTLY_JS = 'plotly.min.js'
+REPORT_STYLE = """
+body { font-family: sans-serif; margin: 2em auto; max-width: 1100px; color: #222; }
+table { border-collapse: collapse; margin: 1em 0; }
+th, td { border: 1px solid #ccc; padding: 4px 10px; text-align: right; }
+th:first-child, td:first-child { text-align: left; }
+"""
+
+# Chart height in pixels (the report pages give charts no container height)
+CHART_HEIGHT = 500
+
+# Inputs shared by every report, set once per worker process
+_context = None
+
+
+def report_inputs(waiting_list_df, baseline_start, baseline_end, model_start, weeks_per_year=48, n_paths=500, rng=None):
+    """Compute everything the reports need for all specialties at once.
+
+    Uses the same demand, session model and waiting list projections as the planning pack, each
+    vectorised across specialties, and returns a dict of arrays and tables that report_html
+    slices per specialty.
+    """
+    rng = np.random.default_rng(rng)
+    specialties, months, totals = specialty_month_matrix(waiting_list_df, 'total waiting list')
+    return {
+        'history_months': months,
+        'history': dict(zip(specialties, totals)),
+        'latest': latest_by_specialty(waiting_list_df),
+        'model': baseline_session_model(waiting_list_df, baseline_start, baseline_end, weeks_per_year),
+        'demand': demand_outlook(waiting_list_df, baseline_start, baseline_end, model_start, n_paths, rng),
+        'outlook': waiting_list_outlook(waiting_list_df, baseline_start, baseline_end, model_start, n_paths, rng),
+        'model_start': pd.to_datetime(model_start).to_period('M').to_timestamp('M'),
+    }
+
+
+def report_file(specialty):
+    # File name for a specialty's report
+    return re.sub(r'[^A-Za-z0-9]+', '_', specialty).strip('_').lower() + '.html'
+
+
+def annual_flows(inputs):
+    # Predicted additions, capacity removals and start/end lists for the modelled year, by specialty
+    demand, model = inputs['demand'], inputs['model']
+    outlook = inputs['outlook']
+    # The list at the modelling start is the projected median, or the latest reported list if that is already past
+    before = np.flatnonzero(outlook['months'] <= inputs['model_start'])
+    if len(before):
+        start = pd.Series(np.median(outlook['projection']['total'][..., before[-1]], axis=0), index=outlook['specialties'])
+    else:
+        start = inputs['latest']['total waiting list'].reindex(outlook['specialties']).astype(float)
+    additions = pd.Series(demand['forecast'].sum(axis=1), index=demand['specialties'])
+    capacity = model['sessions_per_week'] * model['weeks_per_year'] * (1 - model['cancellation_rate']) * model['acpl']
+    flows = pd.DataFrame({
+        'Waiting List (Model Start)': start,
+        'Predicted Additions': additions,
+        'Capacity (Cases)': capacity,
+        'Capacity (Removals)': capacity * model['removals_per_case'],
+    })
+    flows['Waiting List (End of Year)'] = (
+        flows['Waiting List (Model Start)'] + flows['Predicted Additions'] - flows['Capacity (Removals)']
+    ).clip(lower=0)
+    return flows
+
+
+def backlog_table(inputs, specialty):
+    # Latest reported list and backlog bands next to the projected median a year after the modelling start
+    outlook = inputs['outlook']
+    row = outlook['specialties'].index(specialty)
+    keys = ['total'] + BACKLOG_COLUMNS
+    return pd.DataFrame({
+        'Latest': inputs['latest'].loc[specialty, ['total waiting list'] + BACKLOG_COLUMNS].to_numpy(dtype=float),
+        'Projected (Median)': [np.median(outlook['projection'][key][:, row, -1]) for key in keys],
+        'Projected (90% Range)': [
+            '{:.0f} to {:.0f}'.format(*np.percentile(outlook['projection'][key][:, row, -1], [5, 95])) for key in keys
+        ],
+    }, index=['Total Waiting List'] + BACKLOG_COLUMNS).round(0)
+
+
+def _figures(inputs, specialty):
+    # Historic fan chart, demand forecast, capacity comparison and waterfall for one specialty
+    demand, outlook = inputs['demand'], inputs['outlook']
+    flows = annual_flows(inputs).loc[specialty]
+    row = outlook['specialties'].index(specialty)
+
+    fan = np.percentile(outlook['projection']['total'][:, row, :], [5, 25, 50, 75, 95], axis=0)
+    historic = go.Figure([
+        line_trace(inputs['history_months'], inputs['history'][specialty], 'Actual', line=dict(color='#006cb5', width=3)),
+        band_trace(outlook['months'], fan[0], fan[4], '5th-95th Percentile', 'rgba(200, 200, 200, 0.3)'),
+        band_trace(outlook['months'], fan[1], fan[3], '25th-75th Percentile', 'rgba(160, 160, 160, 0.4)'),
+        line_trace(outlook['months'], fan[2], 'Predicted', line=dict(color='#f5136f', dash='dash', width=3)),
+    ])
+    historic.update_layout(title='Total Waiting List: History and Projection', xaxis_title='Month', yaxis_title='Patients')
+
+    row = demand['specialties'].index(specialty)
+    lower, upper = np.percentile(demand['draws'][:, row, :], [5, 95], axis=0)
+    forecast = go.Figure([
+        line_trace(demand['history_months'], demand['history'][row], 'Actual Demand', mode='lines+markers', line=dict(color='#f5136f')),
+        band_trace(demand['months'], lower, upper, '5th-95th Percentile (Bootstrap)', 'rgba(200, 200, 200, 0.3)'),
+        line_trace(demand['months'], demand['forecast'][row], f"Predicted Demand ({demand['methods'][row]})", mode='lines+markers'),
+    ])
+    forecast.update_layout(title='Monthly Demand with Predicted Trend for Next 12 Months', xaxis_title='Month', yaxis_title='Demand')
+
+    comparison = go.Figure(go.Bar(
+        x=['Predicted Additions', 'Capacity (Removals)'],
+        y=[flows['Predicted Additions'], flows['Capacity (Removals)']],
+        marker_color=['#f5136f', '#006cb5'],
+        text=[f"{flows['Predicted Additions']:.0f}", f"{flows['Capacity (Removals)']:.0f}"],
+        textposition='outside'
+    ))
+    comparison.update_layout(title='Demand vs Capacity over the Modelled Year', yaxis_title='Patients')
+
+    steps = [flows['Waiting List (Model Start)'], flows['Predicted Additions'], -flows['Capacity (Removals)'], flows['Waiting List (End of Year)']]
+    waterfall = go.Figure(go.Waterfall(
+        name="Waiting List",
+        orientation="v",
+        measure=["absolute", "relative", "relative", "total"],
+        x=["Start of Year Waiting List", "Additions", "Removals", "End of Year Waiting List"],
+        y=steps,
+        textposition="outside",
+        text=[f"{value:.0f}" for value in steps],
+        connector={"line": {"color": "rgb(63, 63, 63)"}},
+        decreasing={"marker": {"color": "green"}},
+        increasing={"marker": {"color": "red"}},
+        totals={"marker": {"color": "blue"}}
+    ))
+    waterfall.update_layout(title="Waiting List Dynamics Over the Year", showlegend=False)
+    return [historic, forecast, comparison, waterfall]
+
+
+def _page(title, body):
+    return (
+        f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{html.escape(title)}</title>'
+        f'<script src="{PLOTLY_JS}"></script><style>{REPORT_STYLE}</style></head>'
+        f'<body><h1>{html.escape(title)}</h1>{body}</body></html>\n'
+    )
+
+
+def report_html(inputs, specialty):
+    """Static HTML report for one specialty: charts, flows and backlog table, linking to a shared plotly.js."""
+    charts = ''.join(figure.to_html(full_html=False, include_plotlyjs=False, default_height=CHART_HEIGHT) for figure in _figures(inputs, specialty))
+    flows = annual_flows(inputs).loc[[specialty]].round(0)
+    return _page(specialty, (
+        '<p><a href="index.html">Trust summary</a></p>'
+        + charts
+        + '<h2>Modelled Year</h2>' + flows.to_html(index=False, float_format='{:,.0f}'.format)
+        + '<h2>Backlog</h2>' + backlog_table(inputs, specialty).to_html(float_format='{:,.0f}'.format)
+    ))
+
+
+def summary_html(inputs):
+    """Trust summary page: every specialty's modelled year and backlog, a trust-wide fan chart and report links."""
+    outlook = inputs['outlook']
+    flows = annual_flows(inputs)
+    latest = inputs['latest'].loc[flows.index, BACKLOG_COLUMNS].add_suffix(' (Latest)')
+    projected = pd.DataFrame(
+        {f'{key} (Projected)': np.median(outlook['projection'][key][..., -1], axis=0) for key in BACKLOG_COLUMNS},
+        index=outlook['specialties']
+    )
+    table = flows.join(latest).join(projected)
+    table.loc['Total'] = table.sum()
+    table.index = [
+        name if name == 'Total' else f'<a href="{report_file(name)}">{html.escape(name)}</a>' for name in table.index
+    ]
+
+    fan = np.percentile(outlook['projection']['total'].sum(axis=1), [5, 50, 95], axis=0)
+    trust = go.Figure([
+        line_trace(inputs['history_months'], np.nansum(list(inputs['history'].values()), axis=0), 'Actual', line=dict(color='#006cb5', width=3)),
+        band_trace(outlook['months'], fan[0], fan[2], '5th-95th Percentile', 'rgba(200, 200, 200, 0.3)'),
+        line_trace(outlook['months'], fan[1], 'Predicted', line=dict(color='#f5136f', dash='dash', width=3)),
+    ])
+    trust.update_layout(title='Trust Total Waiting List: History and Projection', xaxis_title='Month', yaxis_title='Patients')
+    return _page('Trust Summary', (
+        trust.to_html(full_html=False, include_plotlyjs=False, default_height=CHART_HEIGHT)
+        + table.to_html(escape=False, float_format='{:,.0f}'.format)
+    ))
+
+
+def _init_worker(inputs):
+    global _context
+    _context = inputs
+
+
+def _write_report(args):
+    specialty, output_dir = args
+    path = os.path.join(output_dir, report_file(specialty))
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(report_html(_context, specialty))
+    return path
+
+
+def write_reports(inputs, output_dir, workers=None):
+    """Write index.html, one report per specialty and plotly.min.js to output_dir.
+
+    Specialty reports are rendered in a pool of worker processes; the shared inputs are sent
+    to each worker once, when it starts, rather than with every report. Returns the paths written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, PLOTLY_JS), 'w', encoding='utf-8') as file:
+        file.write(get_plotlyjs())
+    with open(os.path.join(output_dir, 'index.html'), 'w', encoding='utf-8') as file:
+        file.write(summary_html(inputs))
+
+    tasks = [(specialty, output_dir) for specialty in inputs['outlook']['specialties']]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(inputs,)) as pool:
+        paths = list(pool.map(_write_report, tasks))
+    return [os.path.join(output_dir, 'index.html')] + paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a static HTML report per specialty plus a trust summary.")
+    parser.add_argument('output_dir')
+    parser.add_argument('--waiting-list', default='data/waiting_list.csv')
+    parser.add_argument('--baseline-start', required=True)
+    parser.add_argument('--baseline-end', required=True)
+    parser.add_argument('--model-start', required=True)
+    parser.add_argument('--weeks-per-year', type=float, default=48)
+    parser.add_argument('--paths', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (defaults to the number of CPUs)")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    inputs = report_inputs(
+        read_input(args.waiting_list, WAITING_LIST_COLUMNS), args.baseline_start, args.baseline_end, args.model_start,
+        args.weeks_per_year, args.paths
+    )
+    paths = write_reports(inputs, args.output_dir, args.workers)
+    print(f"Wrote {len(paths)} reports to {args.output_dir} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
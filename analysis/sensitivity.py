@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+
+from analysis.trends import fit_trends
+
+FORECAST_MODELS = ('Average (Baseline)', 'Regression')
+
+# Inputs perturbed by the sensitivity analysis, with their display labels
+SENSITIVITY_INPUTS = {
+    'window_months': 'Baseline Window Length',
+    'forecast_model': 'Forecast Model',
+    'percent_additions_to_cases': '% Additions Resulting in Cases',
+    'acpl': 'Average Cases Per List',
+    'utilisation': 'Utilisation',
+    'cancellation_rate': 'Cancellation Rate',
+    'weeks_per_year': 'Weeks per Year',
+    'waiting_list_start': 'Starting Waiting List',
+}
+
+
+def _referral_forecast(history, window_months, use_regression, forecast_offset):
+    # 12-month referral forecast from the last `window_months` of history, for every scenario at once.
+    # history has shape (specialties, months); window_months and use_regression have shape (scenarios, specialties).
+    n_months = history.shape[-1]
+    t = np.arange(n_months) - (n_months - 1)
+    in_window = t > -window_months[..., None]
+    fit = fit_trends(history[None], t, mask=in_window, forecast_x=np.arange(forecast_offset + 1, forecast_offset + 13))
+    mean = np.divide(
+        np.where(in_window, np.nan_to_num(history), 0.0).sum(axis=-1), fit['n'],
+        out=np.zeros(fit['n'].shape), where=fit['n'] > 0
+    )
+    return np.where(use_regression, fit['forecast'].sum(axis=-1), 12 * mean)
+
+
+def tornado(history, base, swing=0.1, forecast_offset=0, specialties=None):
+    """Perturb every input by +/- swing and report the change in outputs.
+
+    history is the monthly additions series, shape (specialties, months), ending at the baseline end.
+    base maps each key of SENSITIVITY_INPUTS plus 'sessions_per_week' and 'annual_demand_cases'
+    to a scalar or per-specialty array; forecast_model is one of FORECAST_MODELS and is swung
+    to the other model. Perturbed values are kept in range (the window between 2 months and the
+    history held, the cancellation rate between 0 and 1), and 'clipped' marks inputs whose low or
+    high value was moved to do so. All scenarios for all specialties are evaluated in one batched
+    pass. Returns a long DataFrame with one row per (specialty, input).
+    """
+    history = np.atleast_2d(np.asarray(history, dtype=float))
+    n_specialties, n_months = history.shape
+    inputs = list(SENSITIVITY_INPUTS)
+
+    values = {key: np.broadcast_to(np.asarray(base[key], dtype=float), (n_specialties,))
+              for key in inputs if key != 'forecast_model'}
+    values['forecast_model'] = np.broadcast_to(
+        np.asarray(base['forecast_model']) == FORECAST_MODELS[1], (n_specialties,)
+    ).astype(float)
+
+    # Scenario 0 is the base case, then a low and a high scenario per input
+    scenarios = {key: np.repeat(value[None], 1 + 2 * len(inputs), axis=0) for key, value in values.items()}
+    for i, key in enumerate(inputs):
+        low, high = 1 + 2 * i, 2 + 2 * i
+        if key == 'forecast_model':
+            scenarios[key][low], scenarios[key][high] = 0.0, 1.0
+        elif key == 'window_months':
+            scenarios[key][low] = np.round(values[key] * (1 - swing))
+            scenarios[key][high] = np.round(values[key] * (1 + swing))
+        else:
+            scenarios[key][low] = values[key] * (1 - swing)
+            scenarios[key][high] = values[key] * (1 + swing)
+    perturbed = {key: scenarios[key].copy() for key in ('window_months', 'cancellation_rate')}
+    scenarios['window_months'] = np.clip(scenarios['window_months'], min(2, n_months), n_months)
+    scenarios['cancellation_rate'] = np.clip(scenarios['cancellation_rate'], 0, 1)
+    clipped = {key: scenarios[key] != value for key, value in perturbed.items()}
+
+    # Demand: scale the base annual demand by the change in referral forecast and conversion rate
+    referrals = _referral_forecast(history, scenarios['window_months'], scenarios['forecast_model'] > 0.5, forecast_offset)
+    referral_ratio = np.divide(referrals, referrals[0], out=np.ones_like(referrals), where=referrals[0] != 0)
+    conversion_ratio = np.divide(
+        scenarios['percent_additions_to_cases'], values['percent_additions_to_cases'],
+        out=np.ones_like(referrals), where=values['percent_additions_to_cases'] != 0
+    )
+    demand = np.asarray(base['annual_demand_cases'], dtype=float) * referral_ratio * conversion_ratio
+
+    # Capacity: ACPL scales with utilisation relative to the base utilisation
+    cases_per_session = scenarios['acpl'] * np.divide(
+        scenarios['utilisation'], values['utilisation'],
+        out=np.ones_like(referrals), where=values['utilisation'] != 0
+    )
+    sessions_per_week = np.asarray(base['sessions_per_week'], dtype=float)
+    capacity = sessions_per_week * scenarios['weeks_per_year'] * (1 - scenarios['cancellation_rate']) * cases_per_session
+
+    waiting_list_end = scenarios['waiting_list_start'] + demand - capacity
+    required_sessions = np.divide(
+        demand, cases_per_session * scenarios['weeks_per_year'],
+        out=np.full_like(demand, np.nan), where=cases_per_session * scenarios['weeks_per_year'] > 0
+    )
+
+    if specialties is None:
+        specialties = np.arange(n_specialties)
+    rows = []
+    for i, key in enumerate(inputs):
+        low, high = 1 + 2 * i, 2 + 2 * i
+        for s, specialty in enumerate(specialties):
+            rows.append({
+                'specialty': specialty,
+                'input': SENSITIVITY_INPUTS[key],
+                'low_value': scenarios[key][low, s],
+                'high_value': scenarios[key][high, s],
+                'clipped': bool(key in clipped and (clipped[key][low, s] or clipped[key][high, s])),
+                'base_waiting_list_end': waiting_list_end[0, s],
+                'low_waiting_list_end': waiting_list_end[low, s],
+                'high_waiting_list_end': waiting_list_end[high, s],
+                'base_required_sessions': required_sessions[0, s],
+                'low_required_sessions': required_sessions[low, s],
+                'high_required_sessions': required_sessions[high, s],
+            })
+    result = pd.DataFrame(rows)
+    result['waiting_list_end_swing'] = (result['high_waiting_list_end'] - result['low_waiting_list_end']).abs()
+    result['required_sessions_swing'] = (result['high_required_sessions'] - result['low_required_sessions']).abs()
+    return result
@@ -0,0 +1,87 @@
+import heapq
+
+import numpy as np
+
+WEEKS_IN_YEAR = 52
+
+# Event types, in the order they run within a week. Events are encoded as a single integer,
+# week * len(EVENT_TYPES) + type, so the heap orders them by week and then by type.
+ARRIVALS, SESSIONS, SNAPSHOT = range(3)
+EVENT_TYPES = ('arrivals', 'sessions', 'snapshot')
+
+
+def operating_weeks(weeks_per_year, n_weeks=WEEKS_IN_YEAR):
+    # (specialties, weeks) mask spreading each specialty's operating weeks evenly through the year
+    weeks_per_year = np.atleast_1d(np.asarray(weeks_per_year, dtype=float))
+    week_of_year = np.arange(n_weeks) % WEEKS_IN_YEAR
+    share = weeks_per_year[:, None] / WEEKS_IN_YEAR
+    return np.floor((week_of_year + 1) * share) > np.floor(week_of_year * share)
+
+
+def simulate_weeks(waiting_list_start, weekly_additions, sessions_per_week, weeks_per_year, cancellation_rate, acpl,
+                   removals_per_case=1.0, n_weeks=WEEKS_IN_YEAR, n_replicates=1000, rng=None):
+    """Week-level discrete-event simulation of theatre sessions and the waiting list.
+
+    Every per-specialty input broadcasts to shape (specialties,). Each week patients arrive
+    (Poisson around weekly_additions), then in operating weeks sessions are scheduled (the
+    fractional part of sessions_per_week is run as a Bernoulli extra session), each scheduled
+    session is cancelled on the day with probability cancellation_rate, and the sessions that
+    run treat Poisson(acpl) cases each, removing removals_per_case patients per case from the
+    list. Events sit in a heap of integer keys and each handler schedules its successor, with
+    every event acting on all replicates and specialties at once.
+    Returns a dict of (replicates, specialties, weeks) arrays: 'waiting_list' (end of week),
+    'additions', 'sessions_scheduled', 'sessions_cancelled', 'cases' and 'removals'.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    waiting_list_start = np.atleast_1d(np.asarray(waiting_list_start, dtype=float))
+    shape = np.broadcast_shapes(
+        waiting_list_start.shape, np.shape(weekly_additions), np.shape(sessions_per_week),
+        np.shape(weeks_per_year), np.shape(cancellation_rate), np.shape(acpl), np.shape(removals_per_case)
+    )
+    n_specialties = shape[0]
+    weekly_additions, sessions_per_week, cancellation_rate, acpl, removals_per_case = (
+        np.broadcast_to(np.asarray(value, dtype=float), shape)
+        for value in (weekly_additions, sessions_per_week, cancellation_rate, acpl, removals_per_case)
+    )
+    operating = np.broadcast_to(operating_weeks(weeks_per_year, n_weeks), (n_specialties, n_weeks))
+    whole_sessions = np.floor(sessions_per_week).astype(np.int64)
+    extra_session = sessions_per_week - whole_sessions
+
+    results = {
+        key: np.zeros((n_replicates, n_specialties, n_weeks), dtype=np.int32)
+        for key in ('waiting_list', 'additions', 'sessions_scheduled', 'sessions_cancelled', 'cases', 'removals')
+    }
+    waiting_list = np.broadcast_to(np.round(waiting_list_start), (n_replicates, n_specialties)).astype(np.int64)
+
+    events = [ARRIVALS, SESSIONS, SNAPSHOT]
+    heapq.heapify(events)
+    while events:
+        week, event = divmod(heapq.heappop(events), len(EVENT_TYPES))
+
+        if event == ARRIVALS:
+            additions = rng.poisson(weekly_additions, (n_replicates, n_specialties))
+            waiting_list += additions
+            results['additions'][..., week] = additions
+
+        elif event == SESSIONS:
+            scheduled = np.where(
+                operating[:, week],
+                whole_sessions + (rng.random((n_replicates, n_specialties)) < extra_session),
+                0
+            )
+            cancelled = rng.binomial(scheduled, cancellation_rate)
+            cases = np.minimum(rng.poisson(acpl * (scheduled - cancelled)), waiting_list)
+            removals = np.minimum(np.round(cases * removals_per_case).astype(np.int64), waiting_list)
+            waiting_list -= removals
+            results['sessions_scheduled'][..., week] = scheduled
+            results['sessions_cancelled'][..., week] = cancelled
+            results['cases'][..., week] = cases
+            results['removals'][..., week] = removals
+
+        else:
+            results['waiting_list'][..., week] = waiting_list
+
+        # Every event recurs the following week until the horizon
+        if week + 1 < n_weeks:
+            heapq.heappush(events, (week + 1) * len(EVENT_TYPES) + event)
+    return results
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+CAPACITY_STATUSES = (
+    'Surplus capacity, waiting list will reduce',
+    'Sufficient capacity to meet demand',
+    'Insufficient capacity but more sessions would meet demand',
+    'Not meeting capacity, waiting list expected to grow',
+)
+BACKLOG_STATUSES = (
+    'Not enough cases to address baseline demand',
+    'Surplus enough to clear 18+ backlog',
+    'Surplus enough to clear 40+ backlog',
+    'Surplus enough to clear 52+ backlog',
+    'Not enough surplus to address backlog',
+)
+
+
+def _categorical(conditions, statuses, index=None):
+    # First matching rule wins; the last status is the default
+    values = np.select(conditions, statuses[:-1], default=statuses[-1])
+    return pd.Series(pd.Categorical(values, categories=statuses), index=index)
+
+
+def expected_change(deficit):
+    # Direction and size of the expected waiting list change, as a categorical label
+    deficit = pd.Series(deficit, dtype=float)
+    size = deficit.abs().round(0).astype('Int64').astype(str)
+    values = np.select(
+        [deficit > 0, deficit < 0],
+        ['⬆ Increase by ' + size, '⬇ Decrease by ' + size],
+        default='➡ No change'
+    )
+    return pd.Series(values, index=deficit.index, dtype='category')
+
+
+def capacity_status(additions, removals, scheduled_minutes, utilised_minutes):
+    """Capacity status for every row at once; inputs are aligned Series over the same period."""
+    return _categorical(
+        [removals > additions, removals == additions, scheduled_minutes >= utilised_minutes],
+        CAPACITY_STATUSES,
+        index=getattr(additions, 'index', None)
+    )
+
+
+def backlog_status(surplus_cases, over_18, over_40, over_52):
+    """Which backlog the surplus cases could clear, for every row at once."""
+    return _categorical(
+        [surplus_cases <= 0, surplus_cases >= over_18, surplus_cases >= over_40, surplus_cases >= over_52],
+        BACKLOG_STATUSES,
+        index=getattr(surplus_cases, 'index', None)
+    )
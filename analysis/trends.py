@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+
+
+def month_number(months):
+    # Whole months since year 0, so a unit slope means one extra referral per month
+    months = pd.DatetimeIndex(pd.to_datetime(months))
+    return np.asarray(months.year * 12 + months.month - 1, dtype=float)
+
+
+def fit_trends(values, x, mask=None, forecast_x=None):
+    """Least-squares linear trends for many series at once, from the closed-form normal equations.
+
+    values has shape (..., months) and may contain NaN; x has shape (months,). mask (broadcastable
+    to values) restricts which months each fit uses, so the leading axes can hold series and
+    scenarios. Returns a dict of arrays with shape values.shape[:-1]: 'slope', 'intercept'
+    (at x = 0), 'rmse' (residual error over the fitted months) and 'n'; plus 'forecast' with a
+    trailing axis over forecast_x when given.
+    """
+    values = np.asarray(values, dtype=float)
+    x = np.asarray(x, dtype=float)
+    used = ~np.isnan(values)
+    if mask is not None:
+        used = used & mask
+    y = np.where(used, values, 0.0)
+
+    # Centre x for numerical stability, then move the intercept back to x = 0
+    centre = x.mean() if x.size else 0.0
+    xc = np.where(used, x - centre, 0.0)
+
+    n = used.sum(axis=-1)
+    sum_x, sum_y = xc.sum(axis=-1), y.sum(axis=-1)
+    sum_xx, sum_xy = (xc * xc).sum(axis=-1), (xc * y).sum(axis=-1)
+    denominator = n * sum_xx - sum_x ** 2
+    slope = np.divide(n * sum_xy - sum_x * sum_y, denominator, out=np.zeros_like(sum_y), where=denominator > 0)
+    centred_intercept = np.divide(sum_y - slope * sum_x, n, out=np.zeros_like(sum_y), where=n > 0)
+
+    residuals = np.where(used, y - (centred_intercept[..., None] + slope[..., None] * (x - centre)), 0.0)
+    rmse = np.sqrt(np.divide((residuals ** 2).sum(axis=-1), n, out=np.zeros_like(sum_y), where=n > 0))
+
+    fit = {
+        'slope': slope,
+        'intercept': centred_intercept - slope * centre,
+        'rmse': rmse,
+        'n': n,
+    }
+    if forecast_x is not None:
+        fit['forecast'] = fit['intercept'][..., None] + slope[..., None] * np.asarray(forecast_x, dtype=float)
+    return fit
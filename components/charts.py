@@ -0,0 +1,108 @@
+import numpy as np
+import plotly.graph_objects as go
+
+# Series longer than this are drawn with WebGL traces rather than SVG
+WEBGL_THRESHOLD = 1000
+# Most points drawn per trace; longer series are downsampled
+MAX_POINTS = 2000
+# Individual simulated paths drawn by default when paths are shown
+SAMPLE_PATHS = 20
+
+
+def _as_numbers(x):
+    # Float positions for x values (datetimes as nanoseconds) so distances can be measured
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype('datetime64[ns]').astype(np.int64).astype(float)
+    return x.astype(float)
+
+
+def lttb(x, y, n_out=MAX_POINTS):
+    """Largest-Triangle-Three-Buckets downsampling.
+
+    Keeps the first and last points and, from each of n_out - 2 equal buckets in between,
+    the point forming the largest triangle with the previously kept point and the mean of
+    the next bucket, which preserves peaks and troughs. Returns the indices to keep.
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = _as_numbers(x)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    keep = np.empty(n_out, dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(n_out - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        following = slice(stop, edges[bucket + 2] if bucket + 2 < len(edges) else n)
+        next_x = x[following].mean()
+        next_y = np.nanmean(y[following]) if np.isfinite(y[following]).any() else 0.0
+        area = np.abs(
+            (x[previous] - next_x) * (y[start:stop] - y[previous])
+            - (x[previous] - x[start:stop]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(np.nan_to_num(area, nan=-1.0)))
+        keep[bucket + 1] = previous
+    return keep
+
+
+def envelope(x, lower, upper, n_buckets=MAX_POINTS):
+    # Min/max bucketing of a band: each bucket keeps its first x, lowest lower and highest upper
+    x, lower, upper = np.asarray(x), np.asarray(lower, dtype=float), np.asarray(upper, dtype=float)
+    if n_buckets >= len(x):
+        return x, lower, upper
+    starts = np.linspace(0, len(x), n_buckets + 1).astype(int)[:-1]
+    return x[starts], np.minimum.reduceat(lower, starts), np.maximum.reduceat(upper, starts)
+
+
+def _scatter(n_points):
+    # WebGL for long series, SVG otherwise
+    return go.Scattergl if n_points > WEBGL_THRESHOLD else go.Scatter
+
+
+def line_trace(x, y, name, mode='lines', max_points=MAX_POINTS, **kwargs):
+    """Line trace built from arrays, downsampled with LTTB above max_points and WebGL above WEBGL_THRESHOLD."""
+    x, y = np.asarray(x), np.asarray(y, dtype=float)
+    trace = _scatter(len(x))
+    if max_points is not None and len(x) > max_points:
+        keep = lttb(x, y, max_points)
+        x, y = x[keep], y[keep]
+    return trace(x=x, y=y, mode=mode, name=name, **kwargs)
+
+
+def band_trace(x, lower, upper, name, fillcolor, max_points=MAX_POINTS, **kwargs):
+    """Filled band between lower and upper as one closed polygon, min/max bucketed above max_points."""
+    x, lower, upper = envelope(x, lower, upper, max_points or len(x))
+    return _scatter(2 * len(x))(
+        name=name,
+        x=np.concatenate([x, x[::-1]]),
+        y=np.concatenate([upper, lower[::-1]]),
+        fill='toself',
+        fillcolor=fillcolor,
+        line=dict(color='rgba(255,255,255,0)'),
+        hoverinfo='skip',
+        showlegend=True,
+        **kwargs
+    )
+
+
+def path_trace(x, paths, name='Simulated Paths', n_paths=SAMPLE_PATHS, max_points=MAX_POINTS, rng=None, **kwargs):
+    """A random sample of simulated paths (rows of paths) drawn as one trace broken by gaps.
+
+    Every path is downsampled at the LTTB points of the median path, so the payload grows
+    with n_paths * max_points at most however long or numerous the simulations are.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    x, paths = np.asarray(x), np.atleast_2d(np.asarray(paths, dtype=float))
+    sample = paths[np.sort(rng.choice(len(paths), min(n_paths, len(paths)), replace=False))]
+    if max_points is not None and len(x) > max_points:
+        keep = lttb(x, np.median(paths, axis=0), max_points)
+        x, sample = x[keep], sample[:, keep]
+    # A NaN after each path breaks the line so every path is a separate segment
+    x = np.tile(np.append(x, x[-1]), len(sample))
+    y = np.column_stack([sample, np.full(len(sample), np.nan)]).ravel()
+    return _scatter(len(x))(
+        x=x, y=y, mode='lines', name=name, connectgaps=False, hoverinfo='skip',
+        line=kwargs.pop('line', dict(color='rgba(120, 120, 120, 0.25)', width=1)), **kwargs
+    )
@@ -0,0 +1,20 @@
+import streamlit as st
+
+# Most figures kept across all sessions; the oldest are evicted first
+FIGURE_CACHE_SIZE = 256
+
+
+@st.cache_resource(max_entries=FIGURE_CACHE_SIZE, show_spinner=False)
+def _cached_figure(chart_id, data_version, params, _build):
+    return _build()
+
+
+def cached_figure(chart_id, data_version, params, build):
+    """Build a Plotly figure once per (chart id, data version, parameters) and reuse it on reruns.
+
+    params is a dict of everything else the chart depends on (selections, dates, toggles) and
+    build a zero-argument function returning the figure. The cached figure object is shared
+    between reruns and sessions, so callers must treat it as read-only: anything drawn on the
+    chart belongs inside build and anything it depends on belongs in params.
+    """
+    return _cached_figure(chart_id, data_version, tuple(sorted(params.items())), build)
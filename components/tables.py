@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# Rows sent to the browser per page
+PAGE_SIZE = 25
+ORIGINAL_ORDER = '(original order)'
+
+
+def filter_rows(df, query=''):
+    # Row positions where any text column contains query (case-insensitive); all rows when query is empty
+    if not query:
+        return np.arange(len(df))
+    matches = np.zeros(len(df), dtype=bool)
+    for column in df.select_dtypes(exclude='number').columns:
+        matches |= df[column].astype(str).str.contains(query, case=False, regex=False).to_numpy()
+    return np.flatnonzero(matches)
+
+
+def sort_rows(df, positions, sort_by=None, ascending=True):
+    # Reorder row positions by one column (stable, missing values last); None keeps the given order
+    if sort_by is None:
+        return positions
+    values = df[sort_by].iloc[positions].reset_index(drop=True)
+    return positions[values.sort_values(ascending=ascending, kind='stable').index.to_numpy()]
+
+
+def paged_table(df, key, page_size=PAGE_SIZE, column_config=None, footer=None, hide_index=True):
+    """Render a DataFrame a page at a time with server-side sort, filter and paging controls.
+
+    footer is an optional DataFrame (e.g. a totals row) shown under every page and never
+    sorted or filtered. Widget keys are prefixed with key so several tables can share a page.
+    """
+    col1, col2, col3, col4 = st.columns([2, 1, 2, 1])
+    with col1:
+        sort_by = st.selectbox("Sort by", [ORIGINAL_ORDER] + list(df.columns), key=f'{key}_sort')
+    with col2:
+        descending = st.toggle("Descending", key=f'{key}_descending')
+    with col3:
+        query = st.text_input("Filter", key=f'{key}_filter', placeholder="Text to match")
+
+    positions = filter_rows(df, query)
+    n_pages = max(-(-len(positions) // page_size), 1)
+    with col4:
+        page = int(st.number_input("Page", min_value=1, max_value=n_pages, value=1, step=1, key=f'{key}_page'))
+
+    positions = sort_rows(df, positions, None if sort_by == ORIGINAL_ORDER else sort_by, not descending)
+    start = (min(page, n_pages) - 1) * page_size
+    rows = df.iloc[positions[start:start + page_size]]
+    if footer is not None:
+        rows = pd.concat([rows, footer], ignore_index=hide_index)
+    st.dataframe(rows, column_config=column_config, hide_index=hide_index)
+    st.caption(f"Rows {min(start + 1, len(positions))}–{min(start + page_size, len(positions))} of {len(positions)} (page {min(page, n_pages)} of {n_pages})")
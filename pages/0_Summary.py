@@ -2,6 +2,11 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 
+from analysis.append import refresh_cube
+from analysis.cube import cube_level, drill_down
+from analysis.summary import backlog_status, capacity_status, expected_change
+from components.tables import paged_table
+
 st.title("Specialty Summary Table")
 
 # Ensure waiting list data is available
@@ -11,14 +16,31 @@ if 'waiting_list_df' not in st.session_state or st.session_state.waiting_list_df
 
 waiting_list_df = st.session_state.waiting_list_df
 
-# Convert the 'month' column to datetime if not already
-if not pd.api.types.is_datetime64_any_dtype(waiting_list_df['month']):
-    waiting_list_df['month'] = pd.to_datetime(waiting_list_df['month'])
+# Aggregate cube built once per dataset on the Home page (and extended when a month is appended); every table below is sliced from it
+st.session_state.waiting_list_cube = refresh_cube(st.session_state.get('waiting_list_cube'), waiting_list_df)
+cube = st.session_state.waiting_list_cube
+
+# Drill down by trust and site when the data has them
+selected_trust = selected_site = None
+if 'trust' in cube['dimensions'] or 'site' in cube['dimensions']:
+    col1, col2, _, _ = st.columns(4)
+    if 'trust' in cube['dimensions']:
+        trusts = [key[0] for key in drill_down(cube)]
+        with col1:
+            selected_trust = st.selectbox("Trust", ['All'] + trusts, key='input_summary_trust')
+        selected_trust = None if selected_trust == 'All' else selected_trust
+    if 'site' in cube['dimensions']:
+        sites = cube_level(cube, by=('site',), trust=selected_trust).index.tolist()
+        with col2:
+            selected_site = st.selectbox("Site", ['All'] + sites, key='input_summary_site')
+        selected_site = None if selected_site == 'All' else selected_site
+st.session_state.selected_trust = selected_trust
+st.session_state.selected_site = selected_site
 
 # User input for baseline period
 st.subheader("Select Baseline Period")
-min_date = waiting_list_df['month'].min().date()
-max_date = waiting_list_df['month'].max().date()
+min_date = cube['months'].min().date()
+max_date = cube['months'].max().date()
 
 col1, col2, _, _ = st.columns(4)
 with col1:
@@ -31,53 +53,31 @@ if baseline_start > baseline_end:
     st.error("Baseline start date must be before or equal to the end date.")
     st.stop()
 
-# Filter waiting list data for the baseline period
 baseline_start = pd.to_datetime(baseline_start).to_period('M').to_timestamp('M')
 baseline_end = pd.to_datetime(baseline_end).to_period('M').to_timestamp('M')
 
-baseline_df = waiting_list_df[(waiting_list_df['month'] >= baseline_start) & (waiting_list_df['month'] <= baseline_end)]
-
 # Get the number of months in the baseline period
-num_baseline_months = baseline_df['month'].nunique()
+num_baseline_months = ((cube['months'] >= baseline_start) & (cube['months'] <= baseline_end)).sum()
 
 # Check if there is sufficient data
-if baseline_df.empty:
+if num_baseline_months == 0:
     st.error("No data available for the selected baseline period.")
     st.stop()
 
-# Get waiting list size for start and end months of the baseline period
-april_size = waiting_list_df[
-    (waiting_list_df['month'] == baseline_start)
-].groupby('specialty')['total waiting list'].sum()
-
-september_size = waiting_list_df[
-    (waiting_list_df['month'] == baseline_end)
-].groupby('specialty')['total waiting list'].sum()
-
-# Calculate change in waiting list size
-waiting_list_change = (september_size - april_size).reset_index()
-waiting_list_change.columns = ['specialty', 'Waiting List Change']
-
-# Group by specialty and calculate baseline metrics
-specialty_summary = baseline_df.groupby('specialty').agg({
-    'additions to waiting list': 'sum',
-    'removals from waiting list': 'sum',
-    'sessions': 'sum',
-    'cancelled sessions': 'sum',
-    'minutes utilised': 'sum',
-    'cases': 'sum'
+# Baseline totals and the waiting list size at the start and end of the baseline, by specialty
+filters = {'trust': selected_trust, 'site': selected_site}
+specialty_summary = cube_level(cube, ('specialty',), baseline_start, baseline_end, **filters)
+start_size = cube_level(cube, ('specialty',), baseline_start, baseline_start, **filters)['total waiting list']
+end_size = cube_level(cube, ('specialty',), baseline_end, baseline_end, **filters)['total waiting list']
+
+specialty_summary = specialty_summary[[
+    'additions to waiting list', 'removals from waiting list', 'sessions', 'cancelled sessions', 'minutes utilised', 'cases'
+]].assign(**{
+    'Waiting List Size (Start)': start_size,
+    'Waiting List Size (End)': end_size,
+    'Waiting List Change': end_size - start_size,
 }).reset_index()
 
-# Merge waiting list size data
-specialty_summary = specialty_summary.merge(april_size.reset_index(), on='specialty', how='left')
-specialty_summary = specialty_summary.merge(september_size.reset_index(), on='specialty', how='left')
-specialty_summary = specialty_summary.merge(waiting_list_change, on='specialty', how='left')
-
-specialty_summary.rename(columns={
-    'total waiting list_x': 'Waiting List Size (Start)',
-    'total waiting list_y': 'Waiting List Size (End)'
-}, inplace=True)
-
 # Calculate extrapolated values
 scaling_factor = 12 / num_baseline_months
 specialty_summary['Additions (12-Month)'] = specialty_summary['additions to waiting list'] * scaling_factor
@@ -87,31 +87,18 @@ specialty_summary['Cases (12-Month)'] = specialty_summary['cases'] * scaling_fac
 # Calculate deficit
 specialty_summary['Deficit (12-Month)'] = specialty_summary['additions to waiting list'] - specialty_summary['removals from waiting list']
 
-specialty_summary['Expected Change'] = specialty_summary.apply(
-    lambda row: (
-        f"⬆ Increase by {row['Deficit (12-Month)']:.0f}" if row['Deficit (12-Month)'] > 0 else
-        f"⬇ Decrease by {-row['Deficit (12-Month)']:.0f}" if row['Deficit (12-Month)'] < 0 else
-        "➡ No change"
-    ),
-    axis=1
-)
+specialty_summary['Expected Change'] = expected_change(specialty_summary['Deficit (12-Month)'])
 total_deficit = specialty_summary['Deficit (12-Month)'].sum()
 # Add a comparison between waiting list change and deficit
-specialty_summary['Change vs. Deficit'] = specialty_summary.apply(
-    lambda row: row['Waiting List Change'] - row['Deficit (12-Month)'],
-    axis=1
-)
+specialty_summary['Change vs. Deficit'] = specialty_summary['Waiting List Change'] - specialty_summary['Deficit (12-Month)']
 
 # Determine capacity status message
 session_duration_hours = 4
-specialty_summary['Capacity Status'] = specialty_summary.apply(
-    lambda row: (
-        "Surplus capacity, waiting list will reduce" if row['Removals (12-Month)'] > row['Additions (12-Month)'] else
-        "Sufficient capacity to meet demand" if row['Removals (12-Month)'] == row['Additions (12-Month)'] else
-        "Insufficient capacity but more sessions would meet demand" if (row['sessions'] + row['cancelled sessions']) * session_duration_hours * 60 >= row['minutes utilised'] * scaling_factor else
-        "Not meeting capacity, waiting list expected to grow"
-    ),
-    axis=1
+specialty_summary['Capacity Status'] = capacity_status(
+    specialty_summary['Additions (12-Month)'],
+    specialty_summary['Removals (12-Month)'],
+    (specialty_summary['sessions'] + specialty_summary['cancelled sessions']) * session_duration_hours * 60,
+    specialty_summary['minutes utilised'] * scaling_factor
 )
 
 specialty_summary['Cases (12M)'] = (
@@ -170,44 +157,27 @@ specialty_summary_display = specialty_summary[columns_to_display].rename(columns
 
 
 # Calculate the total row
-total_row = specialty_summary_display.sum(numeric_only=True)
+total_row = specialty_summary_display.sum(numeric_only=True).to_frame().T
 total_row['Specialty'] = 'Total'
-
-total_row['Expected WL Change'] = (
-    f"⬆ Increase by {total_deficit:.0f}" if total_deficit > 0 else
-    f"⬇ Decrease by {-total_deficit:.0f}" if total_deficit < 0 else
-    "➡ No change"
-)
-
-total_row = pd.DataFrame(total_row).T
+total_row['Expected WL Change'] = expected_change([total_deficit]).astype(str).values
 
 # Combine the total row with the original table
 specialty_summary_display_with_total = pd.concat([specialty_summary_display, total_row], ignore_index=True)
 
-# Format the numbers to zero decimal places
-def format_numbers(val):
-    if pd.isna(val):  # Check for NaN values
-        return "0"  # Replace NaN with '0'
-    if isinstance(val, (int, float)):
-        return f"{int(val):,}"  # Add commas for thousands separator
-    return val
-
-# Highlight the total row
-def highlight_total_row(row):
-    if row.name == len(specialty_summary_display):  # Check if it's the last row (total row)
-        return ['background-color: whitesmoke; font-weight: bold' for _ in row]
-    return ['' for _ in row]
-
-# Apply formatting and styling
-styled_table = (
-    specialty_summary_display_with_total.style
-    .apply(highlight_total_row, axis=1)
-    .format(format_numbers)
-)
 
-# Display the styled table
+def whole_number_columns(df):
+    # Show numeric columns as whole numbers with thousands separators, missing values as 0
+    numeric = df.select_dtypes('number').columns
+    df = df.copy()
+    df[numeric] = df[numeric].fillna(0).astype(float).apply(np.trunc)
+    config = {column: st.column_config.NumberColumn(format='localized') for column in numeric}
+    return df, config
+
+
+# Display the table, with number formatting set on the columns
+summary_table, summary_config = whole_number_columns(specialty_summary_display_with_total)
 st.subheader("Specialty Summary")
-st.write(styled_table)
+paged_table(summary_table.iloc[:-1], key='summary_specialty', column_config=summary_config, footer=summary_table.iloc[-1:])
 
 # Add a download button for the table
 st.download_button(
@@ -224,14 +194,11 @@ st.write("")
 st.subheader("Backlog Summary")
 
 # Get the latest month in the dataset
-latest_month = waiting_list_df['month'].max()
-
-# Filter rows for the latest month
-latest_month_data = waiting_list_df[waiting_list_df['month'] == latest_month]
+latest_month = cube['months'].max()
 
-# Select the required columns for the new table
-columns_to_extract = ['specialty', '18+', '40+', '52+']
-latest_month_summary = latest_month_data[columns_to_extract].copy()
+# Backlog for the latest month
+columns_to_extract = ['18+', '40+', '52+']
+latest_month_summary = cube_level(cube, ('specialty',), latest_month, latest_month, **filters)[columns_to_extract].reset_index()
 
 # Add the month to the column names for clarity
 latest_month_summary.rename(columns={
@@ -264,18 +231,12 @@ latest_month_summary.drop(columns=['Specialty'], inplace=True)
 #)
 
 # Add column for surplus cases addressing backlog
-def backlog_status(row):
-    if row['Difference (Cases vs. Needed)'] <= 0:
-        return "Not enough cases to address baseline demand"
-    if row['Difference (Cases vs. Needed)'] >= row[f'18+ ({latest_month.strftime("%B %Y")})']:
-        return "Surplus enough to clear 18+ backlog"
-    if row['Difference (Cases vs. Needed)'] >= row[f'40+ ({latest_month.strftime("%B %Y")})']:
-        return "Surplus enough to clear 40+ backlog"
-    if row['Difference (Cases vs. Needed)'] >= row[f'52+ ({latest_month.strftime("%B %Y")})']:
-        return "Surplus enough to clear 52+ backlog"
-    return "Not enough surplus to address backlog"
-
-latest_month_summary['Backlog Status'] = latest_month_summary.apply(backlog_status, axis=1)
+latest_month_summary['Backlog Status'] = backlog_status(
+    latest_month_summary['Difference (Cases vs. Needed)'],
+    latest_month_summary[f'18+ ({latest_month.strftime("%B %Y")})'],
+    latest_month_summary[f'40+ ({latest_month.strftime("%B %Y")})'],
+    latest_month_summary[f'52+ ({latest_month.strftime("%B %Y")})']
+)
 
 # Ensure all numbers are rounded to integers
 numeric_columns = [
@@ -293,23 +254,10 @@ totals['Specialty'] = 'Total'
 totals['Backlog Status'] = ''
 latest_month_summary = pd.concat([latest_month_summary, pd.DataFrame([totals])], ignore_index=True)
 
-# Highlight totals row in grey
-def highlight_totals_row(row):
-    if row.name == len(latest_month_summary) - 1:  # Totals row is the last row
-        return ['background-color: lightgrey; font-weight: bold' for _ in row]
-    return ['' for _ in row]
-
 #latest_month_summary.drop(columns=['Additions (12M)'], inplace=True)
-#st.dataframe(latest_month_summary)
-
-# Apply formatting and styling
-styled_table2 = (
-    latest_month_summary.style
-    .apply(highlight_total_row, axis=1)
-    .format(format_numbers)
-)
 
-st.write(styled_table2)
+backlog_table, backlog_config = whole_number_columns(latest_month_summary)
+paged_table(backlog_table.iloc[:-1], key='summary_backlog', column_config=backlog_config, footer=backlog_table.iloc[-1:])
 
 
 st.download_button(
@@ -1,8 +1,12 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
 
+from analysis.append import refresh_cube
+from analysis.cube import cube_slice
+from components.charts import band_trace, line_trace, path_trace
+from components.figures import cached_figure
+
 
 st.title("Historic Waiting List")
 
@@ -26,6 +30,56 @@ color_map = {
 }
 
 
+def additions_removals_figure(specialty_df, baseline_start=None, baseline_end=None):
+    # Additions and removals over time, with the baseline period shaded when one is given
+    fig = go.Figure([
+        line_trace(specialty_df['month'], specialty_df[column], column, line=dict(color=color_map[column], width=3))
+        for column in ['additions to waiting list', 'removals from waiting list']
+    ])
+    fig.update_layout(
+        title='Additions and Removals from Waiting List',
+        height=600,
+        xaxis_title='month',
+        yaxis_title='Number of Patients',
+        legend_title='Legend'
+    )
+    if baseline_start is not None and baseline_start != baseline_end:
+        fig.add_vrect(
+            x0=baseline_start,
+            x1=baseline_end,
+            fillcolor="LightGrey",
+            opacity=0.5,
+            layer="below",
+            line_width=0,
+        )
+        fig.add_trace(
+            go.Scatter(
+                x=[baseline_start, baseline_end],
+                y=[None, None],
+                mode='markers',
+                marker=dict(color='LightGrey'),
+                name='Baseline Period',
+                showlegend=True
+            )
+        )
+    return fig
+
+
+def waiting_list_figure(specialty_df):
+    # Total waiting list over time, without predictions
+    fig = go.Figure([
+        line_trace(specialty_df['month'], specialty_df['total waiting list'], 'Total Waiting List', line=dict(color='#006cb5', width=3))
+    ])
+    fig.update_layout(
+        title='Total Size of the Waiting List',
+        height=600,
+        xaxis_title='month',
+        yaxis_title='Total Waiting List',
+        showlegend=False
+    )
+    return fig
+
+
 # Check if data is available in session state
 if st.session_state.waiting_list_df is not None and st.session_state.procedure_df is not None:
     waiting_list_df = st.session_state.waiting_list_df
@@ -47,27 +101,23 @@ if st.session_state.waiting_list_df is not None and st.session_state.procedure_d
         # Save the selected specialty to session state
         st.session_state.selected_specialty = selected_specialty
 
-        # Filter data based on selected specialty
-        waiting_list_specialty_df = waiting_list_df[waiting_list_df['specialty'] == selected_specialty]
-        # Convert 'month' column to datetime and adjust to end of month
-        waiting_list_specialty_df['month'] = pd.to_datetime(waiting_list_specialty_df['month']).dt.to_period('M').dt.to_timestamp('M')
-        # Sort by month
-        waiting_list_specialty_df = waiting_list_specialty_df.sort_values('month')
+        # Monthly series for the selected specialty (within the trust and site chosen on the Summary page), sliced from the aggregate cube
+        st.session_state.waiting_list_cube = refresh_cube(st.session_state.get('waiting_list_cube'), waiting_list_df)
+        cube_member = {
+            'trust': st.session_state.get('selected_trust'),
+            'site': st.session_state.get('selected_site'),
+            'specialty': selected_specialty
+        }
+        waiting_list_specialty_df = cube_slice(st.session_state.waiting_list_cube, **cube_member).reset_index()
+        cube_version = st.session_state.waiting_list_cube['version']
 
         ### **1. Additions and Removals Plot (fig1)**
         st.subheader("Additions and Removals from Waiting List Over Time")
-        fig1 = px.line(
-            waiting_list_specialty_df,
-            x='month',
-            y=['additions to waiting list', 'removals from waiting list'],
-            labels={'value': 'Number of Patients', 'variable': 'Legend'},
-            title='Additions and Removals from Waiting List',
-            height=600,
-            color_discrete_map=color_map
+        fig1 = cached_figure(
+            'historic_additions_removals', cube_version, cube_member,
+            lambda: additions_removals_figure(waiting_list_specialty_df)
         )
 
-        fig1.update_traces(line=dict(width=3))
-
         # Display fig1 before the baseline date selections
         fig1_placeholder = st.empty()
         fig1_placeholder.plotly_chart(fig1, use_container_width=True)
@@ -109,23 +159,10 @@ if st.session_state.waiting_list_df is not None and st.session_state.procedure_d
         
         # Update fig1 to highlight the baseline period if dates are selected
         if baseline_start_date != baseline_end_date:
-            fig1.add_vrect(
-                x0=baseline_start_date,
-                x1=baseline_end_date,
-                fillcolor="LightGrey",
-                opacity=0.5,
-                layer="below",
-                line_width=0,
-            )
-            fig1.add_trace(
-                go.Scatter(
-                    x=[baseline_start_date, baseline_end_date],
-                    y=[None, None],
-                    mode='markers',
-                    marker=dict(color='LightGrey'),
-                    name='Baseline Period',
-                    showlegend=True
-                )
+            fig1 = cached_figure(
+                'historic_additions_removals', cube_version,
+                dict(cube_member, baseline_start=baseline_start_date, baseline_end=baseline_end_date),
+                lambda: additions_removals_figure(waiting_list_specialty_df, baseline_start_date, baseline_end_date)
             )
             # Re-display fig1 with the baseline highlight
             fig1_placeholder.plotly_chart(fig1, use_container_width=True)
@@ -134,16 +171,7 @@ if st.session_state.waiting_list_df is not None and st.session_state.procedure_d
         st.subheader("Total Size of the Waiting List Over Time")
 
         # Initialize fig2 without predictions
-        fig2 = px.line(
-            waiting_list_specialty_df,
-            x='month',
-            y='total waiting list',
-            labels={'total waiting list': 'Total Waiting List'},
-            title='Total Size of the Waiting List',
-            height=600,
-            color_discrete_map=color_map
-        )
-        fig2.update_traces(line=dict(width=3))
+        fig2 = cached_figure('historic_waiting_list', cube_version, cube_member, lambda: waiting_list_figure(waiting_list_specialty_df))
         
         # Display fig2
         fig2_placeholder = st.empty()
@@ -233,6 +261,9 @@ if st.session_state.waiting_list_df is not None and st.session_state.procedure_d
                         # Add the predicted totals to the DataFrame
                         simulation_results[f'simulation_{sim+1}'] = predicted_totals
                     
+                    # Keep the individual paths for the optional sample of simulated paths
+                    simulated_paths = simulation_results.filter(like='simulation_').to_numpy().T
+
                     # Calculate percentiles for the predictions
                     percentiles = [5, 25, 50, 75, 95]
                     percentile_values = simulation_results.filter(like='simulation_').quantile(q=[p/100 for p in percentiles], axis=1).T
@@ -241,63 +272,28 @@ if st.session_state.waiting_list_df is not None and st.session_state.procedure_d
                     # Merge percentiles with simulation_results
                     simulation_results = pd.concat([simulation_results[['month']], percentile_values], axis=1)
     
-                    # Use the 50th percentile (median) as the average prediction
-                    predictions_df = simulation_results[['month', 'percentile_50']].rename(columns={'percentile_50': 'total waiting list'})
-                    predictions_df['Data Type'] = 'Predicted'
-
-                    # Prepare combined data
-                    actual_data = waiting_list_specialty_df.copy()
-                    actual_data['Data Type'] = 'Actual'
-
-                    combined_df = pd.concat([actual_data, predictions_df], ignore_index=True)
-
-                    # Update fig2 with predictions
-                    fig2 = px.line(
-                        combined_df,
-                        x='month',
-                        y='total waiting list',
-                        color='Data Type',
-                        line_dash='Data Type',
-                        labels={'total waiting list': 'Total Waiting List', 'month': 'Month'},
-                        title='Total Size of the Waiting List with Predictions',
-                        height=600,
-                        color_discrete_map=color_map
-                    )
-                    fig2.update_traces(line=dict(width=3))
-                    
-                    # Add shaded areas for the percentiles
-                    fig2.add_traces([
-                        go.Scatter(
-                            name='5th-95th Percentile',
-                            x=simulation_results['month'].tolist() + simulation_results['month'][::-1].tolist(),
-                            y=simulation_results['percentile_95'].tolist() + simulation_results['percentile_5'][::-1].tolist(),
-                            fill='toself',
-                            fillcolor='rgba(200, 200, 200, 0.2)',
-                            line=dict(color='rgba(255,255,255,0)'),
-                            hoverinfo="skip",
-                            showlegend=True
+                    # Update fig2 with predictions (not cached: the simulations behind it are redrawn every run)
+                    fig2 = go.Figure([
+                        line_trace(
+                            waiting_list_specialty_df['month'], waiting_list_specialty_df['total waiting list'], 'Actual',
+                            line=dict(color=color_map['Actual'], width=3)
+                        ),
+                        line_trace(
+                            simulation_results['month'], simulation_results['percentile_50'], 'Predicted',
+                            line=dict(color=color_map['Predicted'], dash='dash', width=4)
                         ),
-                        go.Scatter(
-                            name='25th-75th Percentile',
-                            x=simulation_results['month'].tolist() + simulation_results['month'][::-1].tolist(),
-                            y=simulation_results['percentile_75'].tolist() + simulation_results['percentile_25'][::-1].tolist(),
-                            fill='toself',
-                            fillcolor='rgba(160, 160, 160, 0.3)',
-                            line=dict(color='rgba(255,255,255,0)'),
-                            hoverinfo="skip",
-                            showlegend=True
-                        )
+                        # Add shaded areas for the percentiles
+                        band_trace(simulation_results['month'], simulation_results['percentile_5'], simulation_results['percentile_95'], '5th-95th Percentile', 'rgba(200, 200, 200, 0.2)'),
+                        band_trace(simulation_results['month'], simulation_results['percentile_25'], simulation_results['percentile_75'], '25th-75th Percentile', 'rgba(160, 160, 160, 0.3)'),
                     ])
-                    
-                    # Customize line styles
-                    fig2.update_traces(
-                        line=dict(width=3),
-                        selector=dict(mode='lines')
-                    )
-
-                    fig2.update_traces(
-                        line=dict(dash='dash', width=4),
-                        selector=dict(name='Predicted')
+                    if st.checkbox("Show a sample of simulated paths", key='input_show_simulated_paths'):
+                        fig2.add_trace(path_trace(simulation_results['month'], simulated_paths))
+                    fig2.update_layout(
+                        title='Total Size of the Waiting List with Predictions',
+                        height=600,
+                        xaxis_title='Month',
+                        yaxis_title='Total Waiting List',
+                        legend_title='Data Type'
                     )
 
                     # Re-display fig2 with predictions
@@ -387,54 +383,27 @@ if st.session_state.waiting_list_df is not None and st.session_state.procedure_d
         
             # Plot all data and percentiles
             st.subheader("Comparison of Historic, Actual Baseline, and Predicted Baseline")
-            fig_validation = px.line(
-                comparison_df.melt(id_vars='month', var_name='Data Type', value_name='Total Waiting List'),
-                x='month',
-                y='Total Waiting List',
-                color='Data Type',
-                labels={'Total Waiting List': 'Total Waiting List', 'month': 'Month'},
+            fig_validation = go.Figure([
+                line_trace(comparison_df['month'], comparison_df[column], column, line=dict(color=color_map[column], width=3))
+                for column in ['Historic Total Waiting List', 'Actual Total Waiting List']
+            ] + [
+                # Add shaded areas for percentiles
+                band_trace(simulation_results['month'], simulation_results['percentile_5'], simulation_results['percentile_95'], '5th-95th Percentile', 'rgba(200, 200, 200, 0.2)'),
+                band_trace(simulation_results['month'], simulation_results['percentile_25'], simulation_results['percentile_75'], '25th-75th Percentile', 'rgba(160, 160, 160, 0.3)'),
+                # Add mean prediction line
+                line_trace(
+                    simulation_results['month'], simulation_results['percentile_50'], 'Mean Prediction',
+                    line=dict(color=color_map['Mean Prediction'], width=3, dash='dash')
+                ),
+            ])
+            fig_validation.update_layout(
                 title='Validation of Baseline Prediction Methodology',
                 height=600,
-                color_discrete_map=color_map
+                xaxis_title='Month',
+                yaxis_title='Total Waiting List',
+                legend_title='Data Type'
             )
 
-            fig_validation.update_traces(line=dict(width=3))
-        
-            # Add shaded areas for percentiles
-            fig_validation.add_traces([
-                go.Scatter(
-                    name='5th-95th Percentile',
-                    x=simulation_results['month'].tolist() + simulation_results['month'][::-1].tolist(),
-                    y=simulation_results['percentile_95'].tolist() + simulation_results['percentile_5'][::-1].tolist(),
-                    fill='toself',
-                    fillcolor='rgba(200, 200, 200, 0.2)',
-                    line=dict(color='rgba(255,255,255,0)'),
-                    hoverinfo="skip",
-                    showlegend=True
-                ),
-                go.Scatter(
-                    name='25th-75th Percentile',
-                    x=simulation_results['month'].tolist() + simulation_results['month'][::-1].tolist(),
-                    y=simulation_results['percentile_75'].tolist() + simulation_results['percentile_25'][::-1].tolist(),
-                    fill='toself',
-                    fillcolor='rgba(160, 160, 160, 0.3)',
-                    line=dict(color='rgba(255,255,255,0)'),
-                    hoverinfo="skip",
-                    showlegend=True
-                )
-            ])
-        
-            # Add mean prediction line
-            fig_validation.add_trace(
-                go.Scatter(
-                    name='Mean Prediction',
-                    x=simulation_results['month'],
-                    y=simulation_results['percentile_50'],
-                    mode='lines',
-                    line=dict(color='#f5136f', width=3, dash='dash')
-                )
-            )
-            
             st.plotly_chart(fig_validation, use_container_width=True)
         
             # Calculate evaluation metrics
@@ -4,11 +4,73 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from scipy.stats import linregress
 import numpy as np
 
+from analysis.append import refresh_cube, refresh_procedure_matrix
+from analysis.data import specialty_month_matrix, to_month_end
+from analysis.forecast import FORECASTERS, bootstrap_forecast, forecast, holdout_residuals, holt_winters, run_tournament
+from analysis.procedures import (
+    dense, history_version, procedure_trends, specialty_monthly, specialty_rows, window_bounds, window_totals
+)
+from analysis.trends import fit_trends, month_number
+from components.charts import band_trace, line_trace, path_trace
+from components.figures import cached_figure
+from components.tables import paged_table
+
 st.title("Demand")
 
+
+@st.cache_data
+def forecast_tournament(_waiting_list_df, history_version, baseline_start, baseline_end, model_start):
+    # Score every forecaster for every specialty on the pre-baseline -> baseline holdout, cached per window
+    # and per version of the history up to the baseline end, so appending a later month keeps the fits
+    waiting_list_df = _waiting_list_df[to_month_end(_waiting_list_df['month']).values <= baseline_end]
+    specialties, months, additions = specialty_month_matrix(waiting_list_df, 'additions to waiting list')
+    train = (months >= baseline_start - pd.DateOffset(months=12)) & (months < baseline_start)
+    holdout = (months >= baseline_start) & (months <= baseline_end)
+    errors, winners = run_tournament(additions[:, train], additions[:, holdout])
+
+    # Refit on the history up to the end of the baseline and forecast the 12 months after the modelling start
+    offset = max((model_start.to_period('M') - baseline_end.to_period('M')).n, 0)
+    history = additions[:, months <= baseline_end]
+    forecasts = {method: forecast(history, method, 12, offset) for method in FORECASTERS}
+    return list(specialties), errors, winners, forecasts
+
+
+@st.cache_data
+def forecast_error_draws(_waiting_list_df, history_version, baseline_start, baseline_end, n_draws=1000):
+    # Bootstrapped 12-month forecast errors for every specialty and forecaster, drawn once per window and history version
+    waiting_list_df = _waiting_list_df[to_month_end(_waiting_list_df['month']).values <= baseline_end]
+    specialties, months, additions = specialty_month_matrix(waiting_list_df, 'additions to waiting list')
+    train = (months >= baseline_start - pd.DateOffset(months=12)) & (months < baseline_start)
+    holdout = (months >= baseline_start) & (months <= baseline_end)
+    residuals = holdout_residuals(additions[:, train], additions[:, holdout])
+    rng = np.random.default_rng(0)
+    zero_forecast = np.zeros((len(specialties), 12))
+    return list(specialties), {method: bootstrap_forecast(zero_forecast, residuals[method], n_draws, rng) for method in FORECASTERS}
+
+
+@st.cache_data
+def procedure_forecasts(_procedure_matrix, history_version, n_procedures, baseline_end, model_start):
+    # Trend and Holt-Winters forecasts for every procedure, refitted once per window and version of the
+    # history up to the baseline end (and catalogue size, as an appended month can add procedures)
+    # Months with no row for a procedure had no referrals
+    first, last = window_bounds(_procedure_matrix, end=baseline_end)
+    history = dense(_procedure_matrix['referrals'])[:, first:last]
+    offset = max((model_start.to_period('M') - baseline_end.to_period('M')).n, 0)
+
+    trends = procedure_trends(_procedure_matrix, baseline_end, 12, offset)
+    seasonal_forecast, _ = holt_winters(history, 12, offset)
+    return pd.DataFrame({
+        'specialty': _procedure_matrix['specialties'][_procedure_matrix['specialty_codes']],
+        'Procedure': _procedure_matrix['procedures'],
+        'Trend (Referrals per Month)': trends['slope'],
+        'Residual Error': trends['rmse'],
+        'Trend Forecast (Next 12 Months)': np.clip(trends['forecast'], 0, None).sum(axis=1),
+        'Seasonal Forecast (Next 12 Months)': np.clip(seasonal_forecast, 0, None).sum(axis=1)
+    })
+
+
 # Check if data is available in session state
 if 'procedure_df' in st.session_state and st.session_state.procedure_df is not None:
     procedure_df = st.session_state.procedure_df
@@ -32,6 +94,11 @@ if 'procedure_df' in st.session_state and st.session_state.procedure_df is not N
         # Save the selected specialty to session state
         st.session_state.selected_specialty = selected_specialty
 
+        # Procedure x month matrices for every specialty, built once per data load and extended when a month is appended
+        st.session_state.procedure_matrix = refresh_procedure_matrix(st.session_state.get('procedure_matrix'), procedure_df)
+        procedure_matrix = st.session_state.procedure_matrix
+        procedure_rows = specialty_rows(procedure_matrix, selected_specialty)
+
         # Filter data based on selected specialty
         procedure_specialty_df = procedure_df[procedure_df['specialty'] == selected_specialty]
           
@@ -49,15 +116,11 @@ if 'procedure_df' in st.session_state and st.session_state.procedure_df is not N
         num_baseline_months = (baseline_end.to_period('M') - baseline_start.to_period('M')).n + 1
 
         
-        # Calculate total referrals during the baseline period from the procedure DataFrame
-        baseline_procedure_df = procedure_specialty_df[
-            (procedure_specialty_df['month'] >= baseline_start) &
-            (procedure_specialty_df['month'] <= baseline_end)
-        ]
-        total_referrals_baseline = baseline_procedure_df['total referrals'].sum()
+        # Total referrals during the baseline period, from the procedure prefix sums
+        baseline_referrals, _, _ = window_totals(procedure_matrix, baseline_start, baseline_end, procedure_rows)
+        total_referrals_baseline = baseline_referrals.sum()
         
 import plotly.graph_objects as go
-from scipy.stats import linregress
 import numpy as np
 
 st.subheader("Baseline Analysis")        
@@ -119,16 +182,18 @@ if ('waiting_list_df' in st.session_state and st.session_state.waiting_list_df i
             waiting_list_specialty_df = waiting_list_specialty_df.sort_values('month')
 
 
+            # Charts below are cached per waiting list and procedure data version, and forecast fits per
+            # version of the waiting list history up to the baseline end
+            st.session_state.waiting_list_cube = refresh_cube(st.session_state.get('waiting_list_cube'), waiting_list_df)
+            demand_version = f"{st.session_state.waiting_list_cube['version']}-{procedure_matrix['version']}"
+            waiting_list_history = history_version(st.session_state.waiting_list_cube, baseline_end)
+
             # --- Baseline Analysis ---
             st.write(f"**Baseline Period:** {baseline_start.strftime('%B %Y')} to {baseline_end.strftime('%B %Y')}")
             st.write(f"**Number of Months in Baseline:** {num_baseline_months} months")
             
-            # Calculate DTAs from procedure DataFrame
-            baseline_procedure_df = procedure_specialty_df[
-                (procedure_specialty_df['month'] >= baseline_start) & 
-                (procedure_specialty_df['month'] <= baseline_end)
-            ]
-            baseline_total_dtas = baseline_procedure_df['total referrals'].sum()
+            # DTAs over the baseline from the procedure matrix
+            baseline_total_dtas = total_referrals_baseline
             baseline_scaled_dtas = (baseline_total_dtas / num_baseline_months) * 12
             
             # Filter baseline data for waiting list additions and cases
@@ -166,6 +231,8 @@ if ('waiting_list_df' in st.session_state and st.session_state.waiting_list_df i
                 (waiting_list_specialty_df['month'] < baseline_start)
             ]
 
+            selected_model = "Average (Baseline)"
+
             # Ensure there are enough data points for regression
             if len(pre_baseline_df) < 2:
                 st.warning("Not enough data points in the 12 months before the baseline start date for regression analysis.")
@@ -173,16 +240,21 @@ if ('waiting_list_df' in st.session_state and st.session_state.waiting_list_df i
                 pre_months = pre_baseline_df['month']
                 pre_demand = pre_baseline_df['additions to waiting list']
 
-                # Convert months to ordinal for regression analysis
-                pre_months_ordinal = pre_months.map(pd.Timestamp.toordinal)
-                slope, intercept, r_value, p_value, std_err = linregress(pre_months_ordinal, pre_demand)
+                # Fit the pre-baseline trend for every specialty at once, on whole-month numbers
+                trend_specialties, trend_months, trend_additions = specialty_month_matrix(waiting_list_df, 'additions to waiting list')
+                pre_baseline_months = (trend_months >= start_12_months_prior) & (trend_months < baseline_start)
+                specialty_trends = fit_trends(trend_additions, month_number(trend_months), mask=pre_baseline_months)
+                specialty_row = list(trend_specialties).index(selected_specialty)
+                slope = specialty_trends['slope'][specialty_row]
+                intercept = specialty_trends['intercept'][specialty_row]
+                pre_months_ordinal = month_number(pre_months)
 
                 baseline_df = waiting_list_specialty_df[
                     (waiting_list_specialty_df['month'] >= baseline_start) &
                     (waiting_list_specialty_df['month'] <= baseline_end)
                 ]
 
-                baseline_months_ordinal = baseline_df['month'].map(pd.Timestamp.toordinal)
+                baseline_months_ordinal = month_number(baseline_df['month'])
                 predicted_baseline_demand = intercept + slope * baseline_months_ordinal
 
                 average_demand = pre_demand.mean()
@@ -203,75 +275,83 @@ if ('waiting_list_df' in st.session_state and st.session_state.waiting_list_df i
                 historic_months_ordinal = pre_months_ordinal
                 fitted_historic_demand = intercept + slope * historic_months_ordinal
                 
-                fig_baseline = go.Figure()
-                # Add the actual demand trace
-                fig_baseline.add_trace(go.Scatter(
-                    x=prediction_df['month'],
-                    y=prediction_df['actual_demand'],
-                    mode='lines+markers',
-                    name='Actual Demand',
-                    line=dict(color='#f5136f')
-                ))
-                # Add a trace for the average line in the historical data
-                fig_baseline.add_trace(go.Scatter(
-                    x=pre_months,
-                    y=[average_demand] * len(pre_months),
-                    mode='lines',
-                    name='Average Line (Historical)',
-                    line=dict(color='orange')
-                ))           
-                # Add the predicted demand trace for average in the baseline period
-                fig_baseline.add_trace(go.Scatter(
-                    x=baseline_df['month'],
-                    y=predicted_baseline_average,
-                    mode='lines',
-                    name='Predicted Demand (Average)',
-                    line=dict(dash='dash', color='orange')
-                ))                
-                fig_baseline.add_trace(go.Scatter(
-                    x=pre_months,
-                    y=fitted_historic_demand,
-                    mode='lines',
-                    name='Fitted Regression Line (Historical)',
-                    line=dict(color='blue')
-                ))
-
-                # Add the predicted demand trace for regression in the baseline period
-                fig_baseline.add_trace(go.Scatter(
-                    x=baseline_df['month'],
-                    y=predicted_baseline_demand,
-                    mode='lines',
-                    name='Predicted Demand (Regression)',
-                    line=dict(color='blue', dash='dash')
-                ))
-
-                # Highlight the baseline period
-                if baseline_start != baseline_end:
-                    fig_baseline.add_vrect(
-                        x0=baseline_start,
-                        x1=baseline_end,
-                        fillcolor="LightGrey",
-                        opacity=0.5,
-                        layer="below",
-                        line_width=0,
-                    )
-                    fig_baseline.add_trace(
-                        go.Scatter(
-                            x=[baseline_start, baseline_end],
-                            y=[None, None],
-                            mode='markers',
-                            marker=dict(color='LightGrey'),
-                            name='Baseline Period',
-                            showlegend=True
+                def baseline_figure():
+                    fig_baseline = go.Figure()
+                    # Add the actual demand trace
+                    fig_baseline.add_trace(line_trace(
+                        prediction_df['month'],
+                        prediction_df['actual_demand'],
+                        'Actual Demand',
+                        mode='lines+markers',
+                        line=dict(color='#f5136f')
+                    ))
+                    # Add a trace for the average line in the historical data
+                    fig_baseline.add_trace(line_trace(
+                        pre_months,
+                        [average_demand] * len(pre_months),
+                        'Average Line (Historical)',
+                        mode='lines',
+                        line=dict(color='orange')
+                    ))           
+                    # Add the predicted demand trace for average in the baseline period
+                    fig_baseline.add_trace(line_trace(
+                        baseline_df['month'],
+                        predicted_baseline_average,
+                        'Predicted Demand (Average)',
+                        mode='lines',
+                        line=dict(dash='dash', color='orange')
+                    ))                
+                    fig_baseline.add_trace(line_trace(
+                        pre_months,
+                        fitted_historic_demand,
+                        'Fitted Regression Line (Historical)',
+                        mode='lines',
+                        line=dict(color='blue')
+                    ))
+
+                    # Add the predicted demand trace for regression in the baseline period
+                    fig_baseline.add_trace(line_trace(
+                        baseline_df['month'],
+                        predicted_baseline_demand,
+                        'Predicted Demand (Regression)',
+                        mode='lines',
+                        line=dict(color='blue', dash='dash')
+                    ))
+
+                    # Highlight the baseline period
+                    if baseline_start != baseline_end:
+                        fig_baseline.add_vrect(
+                            x0=baseline_start,
+                            x1=baseline_end,
+                            fillcolor="LightGrey",
+                            opacity=0.5,
+                            layer="below",
+                            line_width=0,
+                        )
+                        fig_baseline.add_trace(
+                            go.Scatter(
+                                x=[baseline_start, baseline_end],
+                                y=[None, None],
+                                mode='markers',
+                                marker=dict(color='LightGrey'),
+                                name='Baseline Period',
+                                showlegend=True
+                            )
                         )
+
+                    # Update the layout with title and labels
+                    fig_baseline.update_layout(
+                        title='Predicted vs Actual Demand for Baseline Period',
+                        xaxis_title='Month',
+                        yaxis_title='Demand',
+                        legend_title='Legend'
                     )
+                    return fig_baseline
 
-                # Update the layout with title and labels
-                fig_baseline.update_layout(
-                    title='Predicted vs Actual Demand for Baseline Period',
-                    xaxis_title='Month',
-                    yaxis_title='Demand',
-                    legend_title='Legend'
+                fig_baseline = cached_figure(
+                    'demand_baseline_fit', demand_version,
+                    {'specialty': selected_specialty, 'baseline_start': baseline_start, 'baseline_end': baseline_end},
+                    baseline_figure
                 )
 
                 # Display the chart in Streamlit
@@ -285,11 +365,36 @@ if ('waiting_list_df' in st.session_state and st.session_state.waiting_list_df i
                 else:
                     st.write("**Conclusion:** The regression line predicts the baseline better so incorporating a trend may help predict future demand.")
 
+                # --- Forecast Model Tournament ---
+                st.subheader("Forecast Model Tournament")
+                st.write("""
+                Each forecaster is fitted to the 12 months before the baseline and scored on the baseline period for every specialty.
+                The model with the lowest mean absolute error is recommended.
+                """)
+                tournament_specialties, tournament_errors, tournament_winners, tournament_forecasts = forecast_tournament(
+                    waiting_list_df,
+                    waiting_list_history,
+                    pd.to_datetime(baseline_start).to_period('M').to_timestamp('M'),
+                    pd.to_datetime(baseline_end).to_period('M').to_timestamp('M'),
+                    pd.to_datetime(st.session_state.model_start_date).to_period('M').to_timestamp('M')
+                )
+                tournament_df = pd.DataFrame(tournament_errors, columns=list(FORECASTERS.values()))
+                tournament_df.insert(0, 'Specialty', tournament_specialties)
+                tournament_df['Recommended Model'] = [FORECASTERS[winner] for winner in tournament_winners]
+                st.dataframe(tournament_df.round(2), hide_index=True)
+
+                recommended_model = (
+                    FORECASTERS[tournament_winners[tournament_specialties.index(selected_specialty)]]
+                    if selected_specialty in tournament_specialties else "Average (Baseline)"
+                )
+                st.write(f"**Recommended Model for {selected_specialty}:** {recommended_model}")
+
                 st.subheader("Choose Prediction Model")
+                model_options = list(FORECASTERS.values())
                 selected_model = st.radio(
                     "Select the model to generate the predicted trend for the next 12 months:",
-                    options=["Average (Baseline)", "Regression"],
-                    index=0 if use_average_for_prediction else 1
+                    options=model_options,
+                    index=model_options.index(recommended_model)
                 )
 
             future_months = pd.date_range(
@@ -298,22 +403,32 @@ if ('waiting_list_df' in st.session_state and st.session_state.waiting_list_df i
                 freq='M'
             )
             
+            # Monthly referrals for the specialty, summed over its procedures
+            grouped_df = pd.DataFrame({
+                'month': procedure_matrix['months'],
+                'total referrals': specialty_monthly(procedure_matrix)[procedure_matrix['specialty_index'][selected_specialty]]
+            })
+
             # Use baseline data scaled to 12 months for prediction when using the average
             if selected_model == "Average (Baseline)":
                 # Calculate the average additions per month from the baseline and scale to 12 months
-                baseline_total_additions = baseline_procedure_df['total referrals'].sum()
+                baseline_total_additions = total_referrals_baseline
                 baseline_scaled_monthly_additions = baseline_total_additions / num_baseline_months
                 future_demand = [baseline_scaled_monthly_additions] * len(future_months)
                 ###################################################
-                grouped_df = procedure_specialty_df.groupby('month')['total referrals'].sum().reset_index()
-                st.dataframe(grouped_df)
+                paged_table(grouped_df, key='demand_monthly_referrals', page_size=12)
                 ###################################################
                 prediction_method = "Average (Baseline)"
-            else:
+            elif selected_model == "Regression":
                 # Use regression-based prediction if average is not chosen
-                future_months_ordinal = future_months.map(pd.Timestamp.toordinal)
+                future_months_ordinal = month_number(future_months)
                 future_demand = intercept + slope * future_months_ordinal
                 prediction_method = "Regression"
+            else:
+                # Use the cached tournament forecast for the other models
+                selected_method = {label: method for method, label in FORECASTERS.items()}[selected_model]
+                future_demand = tournament_forecasts[selected_method][tournament_specialties.index(selected_specialty)]
+                prediction_method = selected_model
             
             # Create a DataFrame for future predictions
             future_df = pd.DataFrame({
@@ -321,61 +436,99 @@ if ('waiting_list_df' in st.session_state and st.session_state.waiting_list_df i
                 'predicted_demand': future_demand
             })
 
-            # Plot the demand and predicted trend for the entire period, highlighting the baseline and future predictions
-            fig_demand = go.Figure()
-
-            # Add the actual demand trace for the entire available period
-            fig_demand.add_trace(go.Scatter(
-                x=waiting_list_specialty_df['month'],
-                y=waiting_list_specialty_df['additions to waiting list'],
-                mode='lines+markers',
-                name='Actual Demand',
-                line=dict(color='#f5136f')
-            ))
-            ############################################
-            fig_demand.add_trace(go.Scatter(
-                x=grouped_df['month'],
-                y=grouped_df['total referrals'],
-                mode='lines+markers',
-                name='procedure Demand',
-                line=dict(color='purple')
-            ))
-            ###############################################
-            # Add the predicted future demand trace
-            fig_demand.add_trace(go.Scatter(
-                x=future_df['month'],
-                y=future_df['predicted_demand'],
-                mode='lines+markers',
-                name=f'Predicted Demand ({prediction_method})'
-            ))
-
-            # Highlight the baseline period
-            if baseline_start != baseline_end:
-                fig_demand.add_vrect(
-                    x0=baseline_start,
-                    x1=baseline_end,
-                    fillcolor="LightGrey",
-                    opacity=0.5,
-                    layer="below",
-                    line_width=0,
+            # Bootstrapped prediction interval from the selected model's baseline holdout errors
+            error_specialties, error_draws = forecast_error_draws(
+                waiting_list_df,
+                waiting_list_history,
+                pd.to_datetime(baseline_start).to_period('M').to_timestamp('M'),
+                pd.to_datetime(baseline_end).to_period('M').to_timestamp('M')
+            )
+            demand_draws = None
+            if selected_specialty in error_specialties:
+                selected_method = {label: method for method, label in FORECASTERS.items()}[prediction_method]
+                demand_draws = np.clip(
+                    np.asarray(future_df['predicted_demand'], dtype=float)[None, :]
+                    + error_draws[selected_method][:, error_specialties.index(selected_specialty), :],
+                    0,
+                    None
                 )
-                fig_demand.add_trace(
-                    go.Scatter(
-                        x=[baseline_start, baseline_end],
-                        y=[None, None],
-                        mode='markers',
-                        marker=dict(color='LightGrey'),
-                        name='Baseline Period',
-                        showlegend=True
+                demand_lower, demand_upper = np.percentile(demand_draws, [5, 95], axis=0)
+            show_demand_paths = demand_draws is not None and st.checkbox("Show a sample of bootstrapped demand paths", key='input_show_demand_paths')
+
+            # Plot the demand and predicted trend for the entire period, highlighting the baseline and future predictions
+            def demand_figure():
+                fig_demand = go.Figure()
+
+                # Add the actual demand trace for the entire available period
+                fig_demand.add_trace(line_trace(
+                    waiting_list_specialty_df['month'],
+                    waiting_list_specialty_df['additions to waiting list'],
+                    'Actual Demand',
+                    mode='lines+markers',
+                    line=dict(color='#f5136f')
+                ))
+                ############################################
+                fig_demand.add_trace(line_trace(
+                    grouped_df['month'],
+                    grouped_df['total referrals'],
+                    'procedure Demand',
+                    mode='lines+markers',
+                    line=dict(color='purple')
+                ))
+                ###############################################
+                # Add the predicted future demand trace
+                fig_demand.add_trace(line_trace(
+                    future_df['month'],
+                    future_df['predicted_demand'],
+                    f'Predicted Demand ({prediction_method})',
+                    mode='lines+markers'
+                ))
+
+                if demand_draws is not None:
+                    fig_demand.add_trace(band_trace(
+                        future_df['month'], demand_lower, demand_upper, '5th-95th Percentile (Bootstrap)', 'rgba(200, 200, 200, 0.3)'
+                    ))
+                    if show_demand_paths:
+                        # Fixed seed so the cached chart shows the same sample every time
+                        fig_demand.add_trace(path_trace(future_df['month'], demand_draws, name='Bootstrapped Demand Paths', rng=np.random.default_rng(0)))
+
+                # Highlight the baseline period
+                if baseline_start != baseline_end:
+                    fig_demand.add_vrect(
+                        x0=baseline_start,
+                        x1=baseline_end,
+                        fillcolor="LightGrey",
+                        opacity=0.5,
+                        layer="below",
+                        line_width=0,
+                    )
+                    fig_demand.add_trace(
+                        go.Scatter(
+                            x=[baseline_start, baseline_end],
+                            y=[None, None],
+                            mode='markers',
+                            marker=dict(color='LightGrey'),
+                            name='Baseline Period',
+                            showlegend=True
+                        )
                     )
-                )
 
-            # Update the layout with title and labels
-            fig_demand.update_layout(
-                title='Monthly Demand with Predicted Trend for Next 12 Months',
-                xaxis_title='Month',
-                yaxis_title='Demand',
-                legend_title='Legend'
+                # Update the layout with title and labels
+                fig_demand.update_layout(
+                    title='Monthly Demand with Predicted Trend for Next 12 Months',
+                    xaxis_title='Month',
+                    yaxis_title='Demand',
+                    legend_title='Legend'
+                )
+                return fig_demand
+
+            fig_demand = cached_figure(
+                'demand_forecast', demand_version,
+                {
+                    'specialty': selected_specialty, 'baseline_start': baseline_start, 'baseline_end': baseline_end,
+                    'model_start': st.session_state.model_start_date, 'model': prediction_method, 'show_paths': show_demand_paths
+                },
+                demand_figure
             )
 
             # Display the chart in Streamlit
@@ -389,6 +542,32 @@ if ('waiting_list_df' in st.session_state and st.session_state.waiting_list_df i
             st.markdown(f"### Total Predicted Waiting List Theatre Case Demand over Next 12 Months: {total_predicted_cases:.0f}")
 
             st.session_state.total_predicted_cases = total_predicted_cases
+
+            # Annual demand as a distribution, for the capacity gap and waiting list projections
+            if demand_draws is not None:
+                total_predicted_cases_samples = demand_draws.sum(axis=1) * percent_additions_to_cases
+                cases_lower, cases_upper = np.percentile(total_predicted_cases_samples, [5, 95])
+                st.write(f"**Expected Range of Theatre Case Demand (90% probability):** {cases_lower:.0f} to {cases_upper:.0f}")
+                st.session_state.total_predicted_cases_samples = total_predicted_cases_samples
+            else:
+                st.session_state.pop('total_predicted_cases_samples', None)
+            st.session_state.percent_additions_to_cases = percent_additions_to_cases
+            st.session_state.prediction_method = prediction_method
+
+            # Procedure-level trend and seasonal forecasts, fitted for the whole procedure catalogue at once
+            st.subheader("Procedure Demand Forecasts")
+            procedure_forecast_df = procedure_forecasts(
+                procedure_matrix,
+                history_version(procedure_matrix, baseline_end),
+                len(procedure_matrix['procedures']),
+                pd.to_datetime(baseline_end).to_period('M').to_timestamp('M'),
+                pd.to_datetime(st.session_state.model_start_date).to_period('M').to_timestamp('M')
+            )
+            procedure_forecast_df = procedure_forecast_df[procedure_forecast_df['specialty'] == selected_specialty].drop(columns='specialty')
+            paged_table(
+                procedure_forecast_df.sort_values('Seasonal Forecast (Next 12 Months)', ascending=False).round(2),
+                key='demand_procedure_forecasts'
+            )
        
     else:
         st.error("Waiting list data does not contain the required columns.")
@@ -3,6 +3,15 @@ import pandas as pd
 import plotly.graph_objects as go
 import numpy as np
 
+from analysis.append import refresh_cube, refresh_procedure_matrix
+from analysis.capacity import baseline_session_model, scenario_grid, simulate_cases_fitted
+from analysis.cube import cube_level
+from analysis.data import latest_by_specialty, select_members
+from analysis.durations import DEFAULT_DURATION_CV, fill_tables, lognormal_tables, observed_tables
+from analysis.packing import DEFAULT_TURNAROUND_MINUTES, PACKING_METHODS, simulate_list_packing
+from analysis.procedures import monthly_mix
+from analysis.simulation import simulate_weeks
+
 st.title("Capacity")
 
 st.write("""
@@ -42,22 +51,25 @@ with col1:
 # Save the selected specialty to session state
 st.session_state.selected_specialty = selected_specialty
 
-# Filter data for the baseline period
-waiting_list_df['month'] = pd.to_datetime(waiting_list_df['month']) + pd.offsets.MonthEnd(0)
-baseline_df = waiting_list_df[(waiting_list_df['month'] >= baseline_start) & (waiting_list_df['month'] <= baseline_end) & (waiting_list_df['specialty'] == selected_specialty)] 
+# Baseline totals for the selected specialty (within the trust and site chosen on the Summary page), sliced from the aggregate cube
+st.session_state.waiting_list_cube = refresh_cube(st.session_state.get('waiting_list_cube'), waiting_list_df)
+baseline_totals = cube_level(
+    st.session_state.waiting_list_cube, ('specialty',), baseline_start, baseline_end,
+    trust=st.session_state.get('selected_trust'), site=st.session_state.get('selected_site')
+).reindex([selected_specialty], fill_value=0).iloc[0]
 
 # Calculate the number of months in the baseline period
 num_baseline_months = len(pd.date_range(start=baseline_start, end=baseline_end, freq='M'))
 
 # Calculate total cases, sessions, cancelled sessions, and minutes utilised in the baseline period
-total_cases_baseline = baseline_df['cases'].sum()
-total_sessions_baseline = baseline_df['sessions'].sum()  # Use sessions from waiting_list_df
-total_cancelled_sessions_baseline = baseline_df['cancelled sessions'].sum()
+total_cases_baseline = baseline_totals['cases']
+total_sessions_baseline = baseline_totals['sessions']  # Use sessions from waiting_list_df
+total_cancelled_sessions_baseline = baseline_totals['cancelled sessions']
 
 session_duration_hours = 4
 
 # Calculate minutes utilised
-total_minutes_utilised_baseline = baseline_df['minutes utilised'].sum() 
+total_minutes_utilised_baseline = baseline_totals['minutes utilised']
 
 # Calculate baseline utilisation
 total_minutes_possible_baseline = total_sessions_baseline * session_duration_hours * 60
@@ -267,95 +279,274 @@ with col2:
 st.session_state.total_sessions_last_year = total_sessions_last_year
 st.session_state.session_minutes_last_year = session_minutes_last_year
 
+# Scenario sweep over the whole session model input space
+st.header("Scenario Sweep")
+show_scenario_sweep = st.checkbox(
+    "Evaluate a grid of weeks per year, sessions per week, utilisation and cancellation rate",
+    key='input_show_scenario_sweep'
+)
+
+if show_scenario_sweep:
+    st.write("""
+    Every combination below is evaluated at once. Cases scale with utilisation relative to the baseline utilisation.
+    The heatmaps show one slice of the grid through the current inputs; the dashed contour marks no change in the waiting list.
+    """)
+    sweep_weeks = np.arange(30, 53)
+    sweep_sessions = np.round(np.linspace(0, max(2 * sessions_per_week_last_year, 1), 81), 2)
+    sweep_utilisation = np.round(np.arange(0.5, 1.001, 0.02), 2)
+    sweep_cancellation = np.round(np.arange(0, 0.301, 0.01), 2)
+
+    waiting_list_start = st.session_state.get('waiting_list_start')
+    annual_demand = st.session_state.get('total_predicted_cases')
+    grid = scenario_grid(
+        sweep_weeks,
+        sweep_sessions,
+        sweep_utilisation,
+        sweep_cancellation,
+        cases_per_session,
+        baseline_utilisation if baseline_utilisation > 0 else 1,
+        session_duration_hours,
+        waiting_list_start,
+        annual_demand
+    )
+    st.write(f"**Combinations Evaluated:** {grid['acpl_cases'].size:,}")
+
+    # Grid positions nearest the current inputs
+    weeks_index = np.abs(sweep_weeks - weeks_last_year).argmin()
+    sessions_index = np.abs(sweep_sessions - sessions_per_week_last_year).argmin()
+    utilisation_index = np.abs(sweep_utilisation - utilisation_last_year).argmin()
+    cancellation_index = np.abs(sweep_cancellation - cancellation_rate_last_year).argmin()
+
+    sweep_metric = 'waiting_list_end' if 'waiting_list_end' in grid else 'acpl_cases'
+    sweep_metric_label = 'End-of-Year Waiting List' if sweep_metric == 'waiting_list_end' else 'Cases (ACPL)'
+    if sweep_metric == 'acpl_cases':
+        st.info("Complete the Historic Waiting List and Demand pages to sweep the end-of-year waiting list. Showing cases instead.")
+
+    def sweep_contour(z, x, y, x_title, y_title, title):
+        fig = go.Figure(go.Contour(
+            z=z,
+            x=x,
+            y=y,
+            colorscale='RdYlGn_r' if sweep_metric == 'waiting_list_end' else 'Viridis',
+            contours=dict(coloring='heatmap', showlabels=True),
+            colorbar=dict(title=sweep_metric_label)
+        ))
+        if sweep_metric == 'waiting_list_end':
+            fig.add_trace(go.Contour(
+                z=z,
+                x=x,
+                y=y,
+                contours=dict(start=waiting_list_start, end=waiting_list_start, coloring='none'),
+                line=dict(color='black', dash='dash', width=2),
+                showscale=False,
+                hoverinfo='skip'
+            ))
+        fig.update_layout(title=title, xaxis_title=x_title, yaxis_title=y_title, height=500)
+        return fig
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.plotly_chart(sweep_contour(
+            grid[sweep_metric][:, :, utilisation_index, cancellation_index],
+            sweep_sessions,
+            sweep_weeks,
+            'Sessions per Week',
+            'Weeks per Year',
+            f'{sweep_metric_label} at {sweep_utilisation[utilisation_index]:.0%} Utilisation, {sweep_cancellation[cancellation_index]:.0%} Cancellations'
+        ), use_container_width=True)
+    with col2:
+        st.plotly_chart(sweep_contour(
+            grid[sweep_metric][weeks_index, sessions_index, :, :],
+            sweep_cancellation,
+            sweep_utilisation,
+            'Session Cancellation Rate',
+            'Utilisation Percentage',
+            f'{sweep_metric_label} at {sweep_weeks[weeks_index]} Weeks, {sweep_sessions[sessions_index]:.1f} Sessions per Week'
+        ), use_container_width=True)
+
+    fig_sweep_sessions = go.Figure(go.Heatmap(
+        z=grid['sessions_run'][:, :, utilisation_index, cancellation_index],
+        x=sweep_sessions,
+        y=sweep_weeks,
+        colorscale='Blues',
+        colorbar=dict(title='Sessions Run')
+    ))
+    fig_sweep_sessions.update_layout(title='Sessions Run', xaxis_title='Sessions per Week', yaxis_title='Weeks per Year', height=500)
+    fig_sweep_minutes = go.Figure(go.Heatmap(
+        z=grid['session_minutes'][weeks_index, sessions_index, :, :],
+        x=sweep_cancellation,
+        y=sweep_utilisation,
+        colorscale='Blues',
+        colorbar=dict(title='Session Minutes')
+    ))
+    fig_sweep_minutes.update_layout(title='Session Minutes (after Utilisation)', xaxis_title='Session Cancellation Rate', yaxis_title='Utilisation Percentage', height=500)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.plotly_chart(fig_sweep_sessions, use_container_width=True)
+    with col2:
+        st.plotly_chart(fig_sweep_minutes, use_container_width=True)
+
 # Check if data is available in session state
 if 'procedure_df' in st.session_state and st.session_state.procedure_df is not None:
     procedure_df = st.session_state.procedure_df
 
     procedure_df = procedure_df[procedure_df['specialty'] == selected_specialty]
 
+    st.session_state.procedure_matrix = refresh_procedure_matrix(st.session_state.get('procedure_matrix'), st.session_state.procedure_df)
+    procedure_matrix = st.session_state.procedure_matrix
+
 
 procedures_from_acpl = sessions_run_last_year * cases_per_session
 st.markdown(f"### Number of cases based on baseline ACPL: {procedures_from_acpl:.0f}")
 st.session_state.procedures_from_acpl = procedures_from_acpl
 
 
-# Probability distribution for procedures based on referrals
-procedure_df['probability'] = procedure_df['total referrals'] / procedure_df['total referrals'].sum()
-
+# Cases per session run in the new model, refined by the chosen calculation method below
+model_acpl = cases_per_session
 
 # Choose calculation method
 calculation_method = st.radio(
     "Select how to calculate cases in the new model:",
-    ('Average Cases Per Session', 'Utilisation'),
+    ('Average Cases Per Session', 'Utilisation', 'List Packing'),
     key='calculation_method'
 )
 
-if calculation_method == 'Utilisation':
-    utilisation_last_year = st.slider(
-        "Utilisation Percentage",
-        min_value=0.0,
-        max_value=1.0,
-        value=0.8,
-        step=0.01,
-        key='input_utilisation_last_year'
-    )
-    
-    total_sessions_new_model = weeks_last_year * sessions_per_week
+if calculation_method in ('Utilisation', 'List Packing'):
+    # The new model's session minutes already apply the utilisation set above
+    total_sessions_new_model = weeks_last_year * sessions_per_week_last_year
     total_cases_new_model = total_sessions_new_model * cases_per_session
 
-    # Set up Monte Carlo simulation
-    n_simulations = 50
-    available_minutes = total_minutes_12_months
-    procedure_durations = procedure_df['average duration'].values 
-    procedure_probs = procedure_df['probability'].values
-    
-    # Ensure validity
-    assert len(procedure_durations) == len(procedure_probs), "Durations and probabilities mismatch."
-    assert np.isclose(procedure_probs.sum(), 1), "Probabilities must sum to 1."
-    
-    # Monte Carlo sampling
-    total_procedures_fitted = []
-    
-    for _ in range(n_simulations):
-        minutes_used = 0
-        procedures_count = 0
-    
-        while True:
-            # Sample a procedure
-            sampled_procedure = np.random.choice(procedure_durations, p=procedure_probs)
-            
-            if minutes_used + sampled_procedure <= available_minutes:
-                minutes_used += sampled_procedure
-                procedures_count += 1
-            else:
-                break
-    
-        total_procedures_fitted.append(procedures_count)
-    
-    # Calculate average procedures that can fit in new model capacity
-    average_procedures_fitted = np.mean(total_procedures_fitted)
-    st.session_state.waiting_list_removals = average_procedures_fitted
-    
-    # Display Monte Carlo results
-    st.write(f"**Estimated Number of Procedures in New Model Capacity (Monte Carlo Average):** {average_procedures_fitted:.0f}")
-    
-    # Create a bar chart comparing baseline and new model procedures
-    fig_comparison = go.Figure()
-    fig_comparison.add_trace(go.Bar(
-        x=['Baseline (12-Month)', 'New Model (Monte Carlo)'],
-        y=[total_cases_12_months, average_procedures_fitted],
-        name='Number of Cases',
-        marker_color='mediumseagreen'
-    ))
-    
-    fig_comparison.update_layout(
-        title='Number of Cases: Baseline vs New Model (Monte Carlo)',
-        xaxis_title='Model',
-        yaxis_title='Number of Cases',
-        barmode='group'
+    procedure_mix_source = st.radio(
+        "Procedure Mix",
+        ('Baseline Window', 'Forecast Trend'),
+        horizontal=True,
+        key='input_procedure_mix_source'
     )
-    
-    st.plotly_chart(fig_comparison, use_container_width=True)
+
+    # Month-by-month procedure mix for the 12 modelled months, weighted from the baseline window
+    # or from each procedure's referral trend projected to the modelling year
+    if 'model_start_date' in st.session_state:
+        model_start = pd.to_datetime(st.session_state.model_start_date).to_period('M').to_timestamp('M')
+        mix_offset = max((model_start.to_period('M') - baseline_end.to_period('M')).n, 0)
+    else:
+        mix_offset = 0
+    procedure_rows, monthly_procedure_mix, procedure_durations = monthly_mix(
+        procedure_matrix, selected_specialty, baseline_start, baseline_end,
+        horizon=12, offset=mix_offset, forecast=procedure_mix_source == 'Forecast Trend'
+    )
+
+    if procedure_durations.size == 0:
+        st.warning(f"No procedure referrals recorded for {selected_specialty} in the baseline period.")
+    else:
+        # Observed case lengths are offered when ingest wrote procedure_durations alongside the input files
+        procedure_durations_df = st.session_state.get('procedure_durations_df')
+        duration_models = ('Fixed (Average Duration)', 'Lognormal') + (('Observed',) if procedure_durations_df is not None else ())
+        duration_model = st.radio(
+            "Procedure Durations",
+            duration_models,
+            horizontal=True,
+            key='input_duration_model'
+        )
+        duration_tables = None
+        if duration_model == 'Lognormal':
+            # Spread each procedure's duration around its average, keeping the mean
+            duration_cv = st.slider(
+                "Duration Coefficient of Variation",
+                min_value=0.0,
+                max_value=1.5,
+                value=DEFAULT_DURATION_CV,
+                step=0.05,
+                key='input_duration_cv'
+            )
+            duration_tables = lognormal_tables(procedure_durations, duration_cv)
+        elif duration_model == 'Observed':
+            # Each procedure's recorded case lengths, with a lognormal around its average where none were recorded
+            duration_keys = [(selected_specialty, procedure) for procedure in procedure_matrix['procedures'][procedure_rows]]
+            duration_tables = fill_tables(observed_tables(procedure_durations_df, duration_keys), lognormal_tables(procedure_durations))
+
+        if calculation_method == 'Utilisation':
+            # Set up Monte Carlo simulation, spreading the new model's minutes evenly over the months
+            n_simulations = 200
+            available_minutes = np.full(12, session_minutes_last_year / 12)
+            procedures_fitted = simulate_cases_fitted(
+                available_minutes, monthly_procedure_mix, procedure_durations, n_simulations, duration_tables=duration_tables
+            )
+
+            # Calculate average procedures that can fit in new model capacity
+            average_procedures_fitted = procedures_fitted.sum(axis=1).mean()
+            st.session_state.waiting_list_removals = average_procedures_fitted
+            if sessions_run_last_year > 0:
+                model_acpl = average_procedures_fitted / sessions_run_last_year
+
+            # Display Monte Carlo results
+            st.write(f"**Estimated Number of Procedures in New Model Capacity (Monte Carlo Average):** {average_procedures_fitted:.0f}")
+
+            # Create a bar chart comparing baseline and new model procedures
+            fig_comparison = go.Figure()
+            fig_comparison.add_trace(go.Bar(
+                x=['Baseline (12-Month)', 'New Model (Monte Carlo)'],
+                y=[total_cases_12_months, average_procedures_fitted],
+                name='Number of Cases',
+                marker_color='mediumseagreen'
+            ))
+
+            fig_comparison.update_layout(
+                title='Number of Cases: Baseline vs New Model (Monte Carlo)',
+                xaxis_title='Model',
+                yaxis_title='Number of Cases',
+                barmode='group'
+            )
+
+            st.plotly_chart(fig_comparison, use_container_width=True)
+
+        else:
+            col1, col2 = st.columns(2)
+            with col1:
+                packing_method = st.selectbox(
+                    "Packing Method",
+                    list(PACKING_METHODS),
+                    format_func=PACKING_METHODS.get,
+                    key='input_packing_method'
+                )
+            with col2:
+                turnaround_minutes = st.number_input(
+                    "Turnaround Minutes per Case",
+                    min_value=0,
+                    max_value=60,
+                    value=DEFAULT_TURNAROUND_MINUTES,
+                    step=5,
+                    key='input_turnaround_minutes'
+                )
+
+            # Pack simulated weeks of candidate cases into individual lists of the session length
+            packed = simulate_list_packing(
+                monthly_procedure_mix.mean(axis=0), procedure_durations, sessions_per_week_last_year,
+                session_duration_hours * 60, turnaround_minutes, packing_method,
+                n_weeks=2000, duration_tables=duration_tables, rng=np.random.default_rng(0)
+            )
+            total_cases_new_model = sessions_run_last_year * packed['cases_per_list']
+            model_acpl = packed['cases_per_list']
+            st.session_state.waiting_list_removals = total_cases_new_model
+
+            st.write(f"**Packed Cases per Session:** {packed['cases_per_list']:.2f} (baseline ACPL {cases_per_session:.2f})")
+            st.write(f"**Average Unused Minutes per List:** {packed['unused_minutes_per_list']:.0f}")
+            st.write(f"**Packed Utilisation (Case Minutes / List Minutes):** {packed['utilisation']:.2%}")
+
+            # Distribution of cases per list across the simulated weeks
+            cases_per_list_counts = np.bincount(packed['cases'].ravel())
+            fig_packing = go.Figure(go.Bar(
+                x=np.arange(len(cases_per_list_counts)),
+                y=cases_per_list_counts / cases_per_list_counts.sum(),
+                marker_color='mediumseagreen'
+            ))
+            fig_packing.update_layout(
+                title=f'Cases per List ({PACKING_METHODS[packing_method]}, {packed["cases"].shape[0]} Simulated Weeks)',
+                xaxis_title='Cases in List',
+                yaxis_title='Share of Lists',
+                yaxis_tickformat='.0%'
+            )
+            st.plotly_chart(fig_packing, use_container_width=True)
 
 
 else:  # Average Cases Per Session
@@ -370,6 +561,7 @@ else:  # Average Cases Per Session
 
     total_sessions_new_model = weeks_last_year * sessions_per_week_last_year
     total_cases_new_model = total_sessions_new_model * avg_cases_per_session
+    model_acpl = avg_cases_per_session
 
 # Display results
 st.write(f"**Total Sessions in New Model:** {total_sessions_new_model:.0f}")
@@ -398,3 +590,77 @@ with col1:
 with col2:
     st.plotly_chart(fig_cases, use_container_width=True)
 
+
+
+# --- Week-Level Simulation ---
+st.header("Week-Level Simulation")
+st.write("""
+Simulates the next year week by week for every specialty: patients join the waiting list, sessions are scheduled in
+operating weeks, each session can be cancelled on the day, and the sessions that run treat patients from the list.
+The selected specialty uses the session model above; other specialties use their baseline session model.
+""")
+
+col1, _ = st.columns(2)
+with col1:
+    n_replicates = st.number_input(
+        "Number of Simulated Years",
+        min_value=100,
+        max_value=5000,
+        value=1000,
+        step=100,
+        key='input_des_replicates'
+    )
+
+# Baseline session model and weekly additions for every specialty, within the trust and site chosen on the Summary page
+des_df = select_members(waiting_list_df, st.session_state.get('selected_trust'), st.session_state.get('selected_site'))
+des_model = baseline_session_model(des_df, baseline_start, baseline_end, weeks_last_year)
+des_specialties = des_model.index
+des_model.loc[selected_specialty, ['sessions_per_week', 'weeks_per_year', 'cancellation_rate', 'acpl']] = [
+    sessions_per_week_last_year, weeks_last_year, cancellation_rate_last_year, model_acpl
+]
+waiting_list_latest = latest_by_specialty(des_df)['total waiting list'].reindex(des_specialties, fill_value=0)
+
+des_results = simulate_weeks(
+    waiting_list_latest.values,
+    des_model['additions_per_week'].values,
+    des_model['sessions_per_week'].values,
+    des_model['weeks_per_year'].values,
+    des_model['cancellation_rate'].fillna(0).values,
+    des_model['acpl'].values,
+    des_model['removals_per_case'].values,
+    n_replicates=int(n_replicates),
+    rng=np.random.default_rng(0)
+)
+
+# Weekly waiting list for the selected specialty, with a 90% band across simulated years
+selected_index = list(des_specialties).index(selected_specialty)
+selected_waiting_list = des_results['waiting_list'][:, selected_index, :]
+des_weeks = np.arange(1, selected_waiting_list.shape[-1] + 1)
+lower, median, upper = np.percentile(selected_waiting_list, [5, 50, 95], axis=0)
+
+fig_des = go.Figure()
+fig_des.add_trace(go.Scatter(x=des_weeks, y=upper, mode='lines', line=dict(width=0), showlegend=False, hoverinfo='skip'))
+fig_des.add_trace(go.Scatter(
+    x=des_weeks, y=lower, mode='lines', line=dict(width=0), fill='tonexty',
+    fillcolor='rgba(245, 19, 111, 0.2)', name='90% Range'
+))
+fig_des.add_trace(go.Scatter(x=des_weeks, y=median, mode='lines', line=dict(color='#f5136f'), name='Median'))
+fig_des.update_layout(
+    title=f'Simulated Waiting List for {selected_specialty} ({int(n_replicates)} Simulated Years)',
+    xaxis_title='Week',
+    yaxis_title='Waiting List Size'
+)
+st.plotly_chart(fig_des, use_container_width=True)
+
+# Yearly totals per specialty across the simulated years
+des_summary = pd.DataFrame({
+    'Specialty': des_specialties,
+    'Waiting List (Latest)': waiting_list_latest.values,
+    'Sessions Scheduled': des_results['sessions_scheduled'].sum(axis=-1).mean(axis=0),
+    'Sessions Cancelled': des_results['sessions_cancelled'].sum(axis=-1).mean(axis=0),
+    'Cases': des_results['cases'].sum(axis=-1).mean(axis=0),
+    'Waiting List (Week 52, Median)': np.median(des_results['waiting_list'][..., -1], axis=0),
+    'Waiting List (Week 52, 5%)': np.percentile(des_results['waiting_list'][..., -1], 5, axis=0),
+    'Waiting List (Week 52, 95%)': np.percentile(des_results['waiting_list'][..., -1], 95, axis=0),
+})
+st.dataframe(des_summary.round(0), hide_index=True)
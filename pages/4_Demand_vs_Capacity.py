@@ -4,6 +4,13 @@ import plotly.graph_objects as go
 import numpy as np
 import plotly.express as px
 
+from analysis.capacity import baseline_session_model, session_cases
+from analysis.cohort import initial_cohorts, project_cohorts, sample_monthly_flows
+from analysis.data import BACKLOG_COLUMNS, latest_by_specialty, select_members, specialty_month_matrix
+from analysis.optimiser import simulate_annual_factors, required_capacity, optimise_sessions
+from analysis.queueing import littles_law_waits, transient_waits
+from analysis.sensitivity import tornado
+
 st.title("Demand vs Capacity")
 
 # Check if necessary data is available
@@ -72,6 +79,14 @@ if ('procedure_specialty_df' in st.session_state and st.session_state.procedure_
             f"Without addressing this, the waiting list is expected to grow."
         )
 
+    # Demand as a distribution from the bootstrapped forecast on the Demand page
+    demand_samples = st.session_state.get('total_predicted_cases_samples')
+    if demand_samples is not None:
+        capacity_gap_samples = total_capacity_cases - demand_samples
+        gap_lower, gap_median, gap_upper = np.percentile(capacity_gap_samples, [5, 50, 95])
+        st.write(f"**Capacity Gap (Capacity - Demand), 90% Range:** {gap_lower:.0f} to {gap_upper:.0f} cases (median {gap_median:.0f})")
+        st.write(f"**Probability Demand Exceeds Capacity:** {(capacity_gap_samples < 0).mean():.0%}")
+
     # Summary of Findings
     st.write("### Summary")
     st.write(f"- **Planned Capacity:** {total_capacity_cases:.0f} cases with {sessions_per_week_planned:.2f} sessions per week.")
@@ -82,5 +97,296 @@ if ('procedure_specialty_df' in st.session_state and st.session_state.procedure_
         st.write("The current capacity is insufficient to meet demand, leading to an expected increase in the waiting list.")
     else:
         st.write("The current capacity is sufficient to meet demand, which should stabilise or reduce the waiting list.")
+
+    # Minimum Sessions Optimiser
+    st.header("Minimum Sessions to Hit a Target Waiting List")
+    st.write("""
+    Search weeks per year, sessions per week and utilisation for the configuration with the fewest scheduled sessions
+    that keeps the end-of-year waiting list at or below a target with the chosen probability. Demand and capacity
+    variation is simulated once from the baseline months and reused for every candidate configuration.
+    """)
+
+    waiting_list_df = st.session_state.waiting_list_df
+    baseline_start = pd.to_datetime(st.session_state.baseline_start_date)
+    baseline_end = pd.to_datetime(st.session_state.baseline_end_date)
+    waiting_list_start = st.session_state.get('waiting_list_start', 0)
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        target_waiting_list = st.number_input(
+            "Target End-of-Year Waiting List",
+            min_value=0,
+            value=int(waiting_list_start),
+            step=10,
+            key='input_target_waiting_list'
+        )
+    with col2:
+        target_probability = st.slider(
+            "Probability of Meeting Target",
+            min_value=0.5,
+            max_value=0.99,
+            value=0.9,
+            step=0.01,
+            key='input_target_probability'
+        )
+    with col3:
+        max_sessions_per_week = st.number_input(
+            "Maximum Sessions per Week",
+            min_value=1.0,
+            value=float(max(2 * sessions_per_week_required, sessions_per_week_planned, 1)),
+            step=1.0,
+            key='input_max_sessions_per_week'
+        )
+    col1, col2 = st.columns(2)
+    with col1:
+        weeks_range = st.slider("Weeks per Year Range", min_value=30, max_value=52, value=(42, 52), key='input_weeks_range')
+    with col2:
+        utilisation_range = st.slider("Utilisation Range", min_value=0.5, max_value=1.0, value=(0.7, 0.95), step=0.05, key='input_utilisation_range')
+
+    # Baseline monthly variation for the selected specialty
+    _, months, additions_history = specialty_month_matrix(waiting_list_df, 'additions to waiting list', [selected_specialty])
+    _, _, removals_history = specialty_month_matrix(waiting_list_df, 'removals from waiting list', [selected_specialty])
+    in_baseline = (months >= baseline_start.to_period('M').to_timestamp('M')) & (months <= baseline_end.to_period('M').to_timestamp('M'))
+    demand_factor, capacity_factor = simulate_annual_factors(additions_history[0, in_baseline], removals_history[0, in_baseline])
+    if demand_samples is not None and total_demand_cases > 0:
+        # Use the bootstrapped forecast distribution for demand when it is available
+        demand_factor = np.random.default_rng(0).choice(demand_samples, demand_factor.size) / total_demand_cases
+
+    reference_utilisation = baseline_session_model(waiting_list_df, baseline_start, baseline_end).loc[selected_specialty, 'utilisation']
+    cancellation_rate = st.session_state.get('cancellation_rate_last_year', 0)
+
+    minimum_cases = required_capacity(waiting_list_start, total_demand_cases, target_waiting_list, demand_factor, capacity_factor, target_probability)
+    st.write(f"**Cases Needed to Meet Target with {target_probability:.0%} Probability:** {minimum_cases:.0f}")
+
+    feasible_configurations = optimise_sessions(
+        waiting_list_start,
+        total_demand_cases,
+        target_waiting_list,
+        demand_factor,
+        capacity_factor,
+        average_cases_per_list,
+        cancellation_rate,
+        reference_utilisation if reference_utilisation > 0 else 1,
+        weeks_options=np.arange(weeks_range[0], weeks_range[1] + 1),
+        sessions_options=np.arange(0, max_sessions_per_week + 0.05, 0.1),
+        utilisation_options=np.arange(utilisation_range[0], utilisation_range[1] + 0.001, 0.05),
+        prob=target_probability
+    )
+
+    if feasible_configurations.empty:
+        st.warning("No configuration in the search range meets the target. Try widening the ranges or raising the maximum sessions per week.")
+    else:
+        best = feasible_configurations.iloc[0]
+        st.success(
+            f"The cheapest configuration is **{best['sessions_per_week']:.1f} sessions per week** for **{best['weeks_per_year']:.0f} weeks** "
+            f"at **{best['utilisation']:.0%} utilisation** ({best['total_sessions']:.0f} sessions for the year), "
+            f"meeting the target in {best['probability']:.0%} of simulations."
+        )
+        st.dataframe(
+            feasible_configurations.head(10).rename(columns={
+                'weeks_per_year': 'Weeks per Year',
+                'sessions_per_week': 'Sessions per Week',
+                'utilisation': 'Utilisation',
+                'total_sessions': 'Total Sessions',
+                'cases': 'Cases',
+                'probability': 'Probability of Meeting Target',
+                'waiting_list_end': 'Expected End-of-Year Waiting List'
+            }).round(2),
+            hide_index=True
+        )
+
+    # Sensitivity Analysis
+    st.header("Sensitivity Analysis")
+    st.write("""
+    Each input is moved down and up by the chosen percentage (the forecast model is switched between average and regression)
+    and the resulting end-of-year waiting list and sessions per week required to meet demand are compared with the base case.
+    """)
+
+    col1, _, _ = st.columns(3)
+    with col1:
+        sensitivity_swing = st.slider(
+            "Perturbation (+/-)",
+            min_value=0.01,
+            max_value=0.5,
+            value=0.1,
+            step=0.01,
+            format="%.2f",
+            key='input_sensitivity_swing'
+        )
+
+    # Additions history up to the end of the baseline, and the gap to the start of the forecast
+    history_end = baseline_end.to_period('M').to_timestamp('M')
+    forecast_start = pd.to_datetime(st.session_state.get('model_start_date', history_end)).to_period('M').to_timestamp('M')
+    forecast_offset = max((forecast_start.year - history_end.year) * 12 + forecast_start.month - history_end.month, 0)
+    sensitivity_history = additions_history[:, months <= history_end]
+
+    sensitivity = tornado(
+        sensitivity_history,
+        {
+            'window_months': (baseline_end.to_period('M') - baseline_start.to_period('M')).n + 1,
+            'forecast_model': st.session_state.get('prediction_method', 'Average (Baseline)'),
+            'percent_additions_to_cases': st.session_state.get('percent_additions_to_cases', 1.0),
+            'acpl': average_cases_per_list,
+            'utilisation': st.session_state.get('utilisation_last_year', 0.8),
+            'cancellation_rate': cancellation_rate,
+            'weeks_per_year': weeks_in_year,
+            'waiting_list_start': waiting_list_start,
+            'sessions_per_week': sessions_per_week_planned,
+            'annual_demand_cases': total_demand_cases
+        },
+        swing=sensitivity_swing,
+        forecast_offset=forecast_offset,
+        specialties=[selected_specialty]
+    )
+
+    def tornado_chart(result, output, title, x_title):
+        result = result.sort_values(f'{output}_swing')
+        base_value = result[f'base_{output}'].iloc[0]
+        fig = go.Figure()
+        fig.add_trace(go.Bar(
+            y=result['input'],
+            x=result[f'low_{output}'] - base_value,
+            base=base_value,
+            orientation='h',
+            name='Input Decreased',
+            marker_color='#006cb5'
+        ))
+        fig.add_trace(go.Bar(
+            y=result['input'],
+            x=result[f'high_{output}'] - base_value,
+            base=base_value,
+            orientation='h',
+            name='Input Increased',
+            marker_color='#f5136f'
+        ))
+        fig.add_vline(x=base_value, line_dash='dash', line_color='grey')
+        fig.update_layout(title=title, xaxis_title=x_title, barmode='overlay', height=450, legend_title='Legend')
+        return fig
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.plotly_chart(tornado_chart(sensitivity, 'waiting_list_end', 'End-of-Year Waiting List', 'Waiting List'), use_container_width=True)
+    with col2:
+        st.plotly_chart(tornado_chart(sensitivity, 'required_sessions', 'Sessions per Week Required to Meet Demand', 'Sessions per Week'), use_container_width=True)
+
+    st.dataframe(
+        sensitivity[['input', 'low_value', 'high_value', 'clipped', 'low_waiting_list_end', 'high_waiting_list_end', 'low_required_sessions', 'high_required_sessions']].rename(columns={
+            'input': 'Input',
+            'low_value': 'Low Value',
+            'high_value': 'High Value',
+            'clipped': 'Perturbation Clipped',
+            'low_waiting_list_end': 'Waiting List End (Low)',
+            'high_waiting_list_end': 'Waiting List End (High)',
+            'low_required_sessions': 'Sessions per Week Required (Low)',
+            'high_required_sessions': 'Sessions per Week Required (High)'
+        }).round(2),
+        hide_index=True
+    )
+    if sensitivity['clipped'].any():
+        st.caption(
+            "Clipped inputs could not move the full perturbation: the baseline window is limited to the history available "
+            "and the cancellation rate to between 0 and 1, so their bars understate the swing."
+        )
+
+    # Waiting Times from a Queueing Approximation
+    st.header("Waiting Times (Queueing Approximation)")
+    st.write("""
+    Each specialty's list is treated as a queue: patients join at the forecast additions rate and leave at the rate the
+    session model removes them. The current mean wait is the list size over the removal rate (Little's law), and the
+    current median and 92nd percentile waits spread the list's patients evenly over the weeks it took them to arrive;
+    waits over the next year follow the current list as it is served longest wait first. Both are closed-form, so they cover every
+    specialty at once. The selected specialty uses the demand forecast and session model from the earlier
+    pages; other specialties use their baseline activity.
+    """)
+
+    # Weekly arrival and service rates for every specialty (within the trust and site chosen on the Summary page), in patients on the list
+    queue_df = select_members(waiting_list_df, st.session_state.get('selected_trust'), st.session_state.get('selected_site'))
+    queue_model = baseline_session_model(queue_df, baseline_start, baseline_end)
+    queue_specialties = queue_model.index
+    arrival_rate = queue_model['additions_per_week'].copy()
+    service_rate = session_cases(
+        queue_model['sessions_per_week'], queue_model['weeks_per_year'], queue_model['cancellation_rate'].fillna(0), queue_model['acpl']
+    ) * queue_model['removals_per_case'] / 52
+    percent_additions_to_cases = st.session_state.get('percent_additions_to_cases', 0)
+    if selected_specialty in queue_specialties:
+        if percent_additions_to_cases > 0:
+            arrival_rate[selected_specialty] = total_demand_cases / percent_additions_to_cases / 52
+        service_rate[selected_specialty] = total_capacity_cases * queue_model.loc[selected_specialty, 'removals_per_case'] / 52
+
+    latest_lists = latest_by_specialty(queue_df).reindex(queue_specialties)
+    queue_cohorts = initial_cohorts(
+        latest_lists['total waiting list'].fillna(0), latest_lists['18+'].fillna(0),
+        latest_lists['40+'].fillna(0), latest_lists['52+'].fillna(0)
+    )
+    steady = littles_law_waits(latest_lists['total waiting list'].fillna(0).values, arrival_rate.values, service_rate.values)
+    transient = transient_waits(queue_cohorts, arrival_rate.values, service_rate.values, np.arange(53))
+
+    queue_table = pd.DataFrame({
+        'Specialty': queue_specialties,
+        'Arrivals per Week': arrival_rate.values,
+        'Removals per Week': service_rate.values,
+        'Utilisation (Arrivals / Removals)': steady['utilisation'],
+        "Current Mean Wait, Little's Law (Weeks)": steady['mean_wait'],
+        'Current Median Wait, Steady State (Weeks)': steady['percentiles'][:, 0],
+        'Current 92nd Percentile Wait, Steady State (Weeks)': steady['percentiles'][:, 1],
+        'Waiting List (Week 52)': transient['waiting_list'][:, -1],
+        'Median Wait (Week 52)': transient['percentiles'][:, -1, 0],
+        '92nd Percentile Wait (Week 52)': transient['percentiles'][:, -1, 1],
+        **{f'Share Waiting {column} Weeks (Week 52)': transient['share_over'][column][:, -1] for column in BACKLOG_COLUMNS}
+    })
+    st.dataframe(queue_table.round(2), hide_index=True)
+
+    if selected_specialty in queue_specialties:
+        queue_index = list(queue_specialties).index(selected_specialty)
+        fig_queue = go.Figure()
+        for column, color in zip(BACKLOG_COLUMNS, ['#006cb5', 'orange', '#f5136f']):
+            fig_queue.add_trace(go.Scatter(
+                x=np.arange(53),
+                y=transient['share_over'][column][queue_index],
+                mode='lines',
+                name=f'{column} weeks',
+                line=dict(color=color)
+            ))
+        fig_queue.update_layout(
+            title=f'Share of the {selected_specialty} Waiting List by Weeks Waited (Queueing Approximation)',
+            xaxis_title='Week',
+            yaxis_title='Share of Waiting List',
+            yaxis_tickformat='.0%'
+        )
+        st.plotly_chart(fig_queue, use_container_width=True)
+
+    # The cohort simulation as a slower check on the approximation
+    if st.checkbox("Check Against Simulation", key='input_queue_simulation_check'):
+        _, queue_months, queue_additions = specialty_month_matrix(queue_df, 'additions to waiting list', queue_specialties)
+        _, _, queue_removals = specialty_month_matrix(queue_df, 'removals from waiting list', queue_specialties)
+        queue_baseline = (queue_months >= baseline_start.to_period('M').to_timestamp('M')) & \
+                         (queue_months <= baseline_end.to_period('M').to_timestamp('M'))
+        rng = np.random.default_rng(0)
+
+        # Baseline month-to-month variation around the same weekly rates
+        def monthly_flows(history, weekly_rate):
+            ratios = history[:, queue_baseline] / np.nanmean(history[:, queue_baseline], axis=1, keepdims=True)
+            return sample_monthly_flows(ratios, 12, 500, rng) * (np.asarray(weekly_rate) * 52 / 12)[None, :, None]
+
+        queue_projection = project_cohorts(
+            queue_cohorts, monthly_flows(queue_additions, arrival_rate), monthly_flows(queue_removals, service_rate)
+        )
+        simulated_total = np.median(queue_projection['total'][..., -1], axis=0)
+        st.dataframe(pd.DataFrame({
+            'Specialty': queue_specialties,
+            'Waiting List (Week 52, Approximation)': transient['waiting_list'][:, -1],
+            'Waiting List (Month 12, Simulation)': simulated_total,
+            **{
+                f'Share Waiting {column} Weeks ({source})': values
+                for column in BACKLOG_COLUMNS
+                for source, values in (
+                    ('Approximation', transient['share_over'][column][:, -1]),
+                    ('Simulation', np.divide(
+                        np.median(queue_projection[column][..., -1], axis=0), simulated_total,
+                        out=np.zeros_like(simulated_total), where=simulated_total > 0
+                    ))
+                )
+            }
+        }).round(2), hide_index=True)
 else:
     st.write("Please ensure you have completed the required sections and loaded all necessary data into session state.")
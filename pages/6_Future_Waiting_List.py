@@ -1,7 +1,26 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.graph_objects as go
 
+from analysis.append import refresh_cube
+from analysis.data import BACKLOG_COLUMNS, latest_by_specialty, select_members, specialty_month_matrix, to_month_end
+from analysis.cohort import initial_cohorts, month_shifts, project_cohorts, sample_monthly_flows
+from analysis.capacity import baseline_session_model, session_cases
+from analysis.clearance import earliest_clearance_month, min_sessions_to_clear
+from analysis.queueing import littles_law_waits, transient_waits
+
+
+@st.cache_data(show_spinner="Finding the sessions needed to clear each backlog...")
+def clearance_sessions(_cohorts, _additions, _removals_per_session, data_version, trust, site, baseline_start, baseline_end,
+                       session_inputs, target_month, prob, rule, clinical_share):
+    # Minimum sessions per week to clear each backlog, solved once per data version, trust and site, baseline
+    # window, session model and clearance setting rather than on every rerun of the page
+    return min_sessions_to_clear(
+        _cohorts, _additions, _removals_per_session, target_month, prob=prob, rule=rule, clinical_share=clinical_share
+    )
+
+
 st.title("Waiting List Dynamics")
 
 st.write("""
@@ -43,19 +62,28 @@ if 'procedure_specialty_df' in st.session_state and 'weeks_last_year' in st.sess
     waiting_list_end = waiting_list_start + waiting_list_additions - waiting_list_removals
     st.write(f"**Waiting List at End of Year:** {waiting_list_end:.0f}")
 
+    # Demand as a distribution from the bootstrapped forecast on the Demand page
+    demand_samples = st.session_state.get('total_predicted_cases_samples')
+    if demand_samples is not None:
+        waiting_list_end_lower, waiting_list_end_upper = np.percentile(waiting_list_start + demand_samples - waiting_list_removals, [5, 95])
+        st.write(f"**Expected Range at End of Year (90% probability):** {waiting_list_end_lower:.0f} to {waiting_list_end_upper:.0f}")
+
     # Add Backlog from Latest Month
     
 
     # Assume 'waiting_list_data' exists in session state
     if 'waiting_list_df' in st.session_state:
-        waiting_list_data = st.session_state.waiting_list_df
+        # Backlogs and flows within the trust and site chosen on the Summary page
+        selected_trust, selected_site = st.session_state.get('selected_trust'), st.session_state.get('selected_site')
+        waiting_list_data = select_members(st.session_state.waiting_list_df, selected_trust, selected_site)
 
         col1, col2, col3, col4 = st.columns(4)
         with col1:
             st.header("Backlog")
         
-            # Get latest month's backlog
-            latest_month_data = waiting_list_data.iloc[-1]
+            # Get latest month's backlog for the selected specialty
+            latest_by_specialty_df = latest_by_specialty(waiting_list_data)
+            latest_month_data = latest_by_specialty_df.loc[selected_specialty]
             backlog_18_plus = latest_month_data['18+']
             backlog_40_plus = latest_month_data['40+']
             backlog_52_plus = latest_month_data['52+']
@@ -143,6 +171,260 @@ if 'procedure_specialty_df' in st.session_state and 'weeks_last_year' in st.sess
         )
         st.plotly_chart(waterfall_fig, use_container_width=True)
 
+        ### Backlog Projection by Weeks Waited
+        st.header("Backlog Projection by Weeks Waited")
+        st.write("""
+        The waiting list is split into weekly cohorts by time waited, using the latest 18+, 40+ and 52+ counts.
+        Each month every cohort ages, the predicted additions join the list and the planned removals are taken
+        according to the selected priority rule. Monthly variation is resampled from the baseline period.
+        """)
+
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            priority_rule = st.radio(
+                "Removal Priority Rule",
+                options=["Longest Wait First", "Clinical Share"],
+                key='input_priority_rule'
+            )
+        with col2:
+            clinical_share = st.slider(
+                "Share of Removals Made on Clinical Priority",
+                min_value=0.0,
+                max_value=1.0,
+                value=0.7,
+                step=0.05,
+                disabled=priority_rule != "Clinical Share",
+                key='input_clinical_share'
+            )
+        with col3:
+            projection_months = st.number_input(
+                "Months to Project",
+                min_value=1,
+                max_value=36,
+                value=12,
+                step=1,
+                key='input_projection_months'
+            )
+
+        rule = 'clinical' if priority_rule == "Clinical Share" else 'longest_wait'
+        num_simulations = 1000
+        rng = np.random.default_rng(0)
+
+        # Baseline monthly additions and removals for every specialty
+        baseline_start = pd.to_datetime(st.session_state.get('baseline_start_date', waiting_list_data['month'].min()))
+        baseline_end = pd.to_datetime(st.session_state.get('baseline_end_date', waiting_list_data['month'].max()))
+        all_specialties = latest_by_specialty_df.index
+        _, history_months, history_additions = specialty_month_matrix(waiting_list_data, 'additions to waiting list', all_specialties)
+        _, _, history_removals = specialty_month_matrix(waiting_list_data, 'removals from waiting list', all_specialties)
+        in_baseline = (history_months >= baseline_start.to_period('M').to_timestamp('M')) & \
+                      (history_months <= baseline_end.to_period('M').to_timestamp('M'))
+        baseline_additions = history_additions[:, in_baseline]
+        baseline_removals = history_removals[:, in_baseline]
+
+        # Projection months follow the modelling start date
+        projection_start = to_month_end([st.session_state.get('model_start_date', latest_month_data['month'])]).iloc[0]
+        projection_index = pd.date_range(start=projection_start + pd.offsets.MonthEnd(1), periods=projection_months, freq=pd.offsets.MonthEnd())
+
+        # Selected specialty: planned additions and removals, with baseline month-to-month variation
+        specialty_row = list(all_specialties).index(selected_specialty)
+        addition_ratios = baseline_additions[specialty_row] / np.nanmean(baseline_additions[specialty_row])
+        removal_ratios = baseline_removals[specialty_row] / np.nanmean(baseline_removals[specialty_row])
+        annual_additions = rng.choice(demand_samples, num_simulations)[:, None] if demand_samples is not None else waiting_list_additions
+        simulated_additions = sample_monthly_flows(addition_ratios, projection_months, num_simulations, rng)[:, 0] * annual_additions / 12
+        simulated_removals = sample_monthly_flows(removal_ratios, projection_months, num_simulations, rng)[:, 0] * waiting_list_removals / 12
+
+        # Scale the latest band mix to the starting waiting list size
+        latest_total = latest_month_data['total waiting list']
+        start_scale = waiting_list_start / latest_total if latest_total > 0 else 0
+        starting_cohorts = initial_cohorts(
+            latest_total * start_scale,
+            backlog_18_plus * start_scale,
+            backlog_40_plus * start_scale,
+            backlog_52_plus * start_scale
+        )
+        projection = project_cohorts(starting_cohorts, simulated_additions, simulated_removals, rule=rule, clinical_share=clinical_share)
+
+        band_colors = {'18+': '#006cb5', '40+': 'orange', '52+': '#f5136f'}
+        fig_backlog = go.Figure()
+        for band, color in band_colors.items():
+            lower, median, upper = np.percentile(projection[band], [5, 50, 95], axis=0)
+            fig_backlog.add_trace(go.Scatter(
+                x=np.concatenate([projection_index, projection_index[::-1]]),
+                y=np.concatenate([upper, lower[::-1]]),
+                fill='toself',
+                fillcolor='rgba(200, 200, 200, 0.3)',
+                line=dict(color='rgba(255,255,255,0)'),
+                hoverinfo="skip",
+                showlegend=False
+            ))
+            fig_backlog.add_trace(go.Scatter(
+                x=projection_index,
+                y=median,
+                mode='lines+markers',
+                name=f'{band} weeks (median)',
+                line=dict(color=color, width=3)
+            ))
+        fig_backlog.update_layout(
+            title=f'Projected Backlog by Weeks Waited for {selected_specialty} (5th-95th Percentile Shaded)',
+            xaxis_title='Month',
+            yaxis_title='Patients',
+            legend_title='Legend'
+        )
+        st.plotly_chart(fig_backlog, use_container_width=True)
+
+        projection_table = pd.DataFrame({
+            'Month': projection_index.strftime('%b %Y'),
+            'Total Waiting List': np.median(projection['total'], axis=0),
+            '18+': np.median(projection['18+'], axis=0),
+            '40+': np.median(projection['40+'], axis=0),
+            '52+': np.median(projection['52+'], axis=0)
+        }).round(0)
+        st.dataframe(projection_table, hide_index=True)
+
+        # All specialties: baseline additions and removals, projected together
+        st.subheader("Backlog Projection for All Specialties (From the Latest List, Resampling Baseline Additions and Removals)")
+        latest_cohorts = initial_cohorts(
+            latest_by_specialty_df['total waiting list'],
+            latest_by_specialty_df['18+'],
+            latest_by_specialty_df['40+'],
+            latest_by_specialty_df['52+']
+        )
+        all_projection = project_cohorts(
+            latest_cohorts,
+            sample_monthly_flows(baseline_additions, projection_months, num_simulations, rng),
+            sample_monthly_flows(baseline_removals, projection_months, num_simulations, rng),
+            rule=rule,
+            clinical_share=clinical_share
+        )
+        all_projection_table = pd.DataFrame({
+            'Specialty': all_specialties,
+            'Total Waiting List (Latest)': latest_by_specialty_df['total waiting list'].values,
+            '18+ (Latest)': latest_by_specialty_df['18+'].values,
+            '40+ (Latest)': latest_by_specialty_df['40+'].values,
+            '52+ (Latest)': latest_by_specialty_df['52+'].values,
+            f'Total Waiting List (+{projection_months} Months)': np.median(all_projection['total'][..., -1], axis=0),
+            f'18+ (+{projection_months} Months)': np.median(all_projection['18+'][..., -1], axis=0),
+            f'40+ (+{projection_months} Months)': np.median(all_projection['40+'][..., -1], axis=0),
+            f'52+ (+{projection_months} Months)': np.median(all_projection['52+'][..., -1], axis=0)
+        }).round(0)
+        st.dataframe(all_projection_table, hide_index=True)
+
+        # Closed-form queueing approximation for the same flows, with the projection above as the check
+        st.subheader("Waiting Times for All Specialties (Queueing Approximation)")
+        st.write("""
+        Treats each list as a queue served longest wait first, with the mean baseline additions and removals as
+        arrival and service rates. Current waits use the latest list size (the mean by Little's law, the percentiles
+        from the weeks the list took to arrive). It updates instantly; the simulated projection above is the slower check.
+        The rule and clinical share are not applied, so it compares with the Longest Wait First projection.
+        """)
+        horizon_weeks = int(month_shifts(projection_months).sum())
+        queue_arrivals = np.nanmean(baseline_additions, axis=1) * 12 / 52
+        queue_removals = np.nanmean(baseline_removals, axis=1) * 12 / 52
+        steady = littles_law_waits(latest_cohorts.sum(axis=1), queue_arrivals, queue_removals)
+        transient = transient_waits(latest_cohorts, queue_arrivals, queue_removals, [horizon_weeks])
+        simulated_total = np.median(all_projection['total'][..., -1], axis=0)
+        st.dataframe(pd.DataFrame({
+            'Specialty': all_specialties,
+            'Utilisation (Additions / Removals)': steady['utilisation'],
+            "Current Mean Wait, Little's Law (Weeks)": steady['mean_wait'],
+            'Current Median Wait, Steady State (Weeks)': steady['percentiles'][:, 0],
+            'Current 92nd Percentile Wait, Steady State (Weeks)': steady['percentiles'][:, 1],
+            f'Median Wait (+{projection_months} Months)': transient['percentiles'][:, 0, 0],
+            f'92nd Percentile Wait (+{projection_months} Months)': transient['percentiles'][:, 0, 1],
+            f'Total Waiting List (+{projection_months} Months, Approximation)': transient['waiting_list'][:, 0],
+            **{
+                f'Share {column} ({source})': values
+                for column in BACKLOG_COLUMNS
+                for source, values in (
+                    ('Approximation', transient['share_over'][column][:, 0]),
+                    ('Simulation', np.divide(
+                        np.median(all_projection[column][..., -1], axis=0), simulated_total,
+                        out=np.zeros_like(simulated_total), where=simulated_total > 0
+                    ))
+                )
+            }
+        }).round(2), hide_index=True)
+
+        ### Backlog Clearance
+        st.header("Backlog Clearance")
+        st.write("""
+        For every specialty, the earliest month in which each backlog reaches zero under the current session model,
+        and the minimum sessions per week that would clear it by the target month. The selected specialty uses the
+        session model from the Capacity page; other specialties use their baseline sessions, cancellation rate and ACPL.
+        """)
+
+        col1, col2, _ = st.columns(3)
+        with col1:
+            target_month = st.number_input(
+                "Target Month to Clear Backlog (Months from Latest Data)",
+                min_value=1,
+                max_value=36,
+                value=12,
+                step=1,
+                key='input_clearance_target_month'
+            )
+        with col2:
+            clearance_probability = st.slider(
+                "Required Probability of Clearing",
+                min_value=0.5,
+                max_value=0.99,
+                value=0.9,
+                step=0.01,
+                key='input_clearance_probability'
+            )
+
+        # Session model per specialty, overriding the selected specialty with the Capacity page inputs
+        session_model = baseline_session_model(waiting_list_data, baseline_start, baseline_end, weeks_in_year).reindex(all_specialties)
+        session_model.loc[selected_specialty, ['sessions_per_week', 'cancellation_rate', 'acpl']] = [
+            sessions_planned,
+            st.session_state.get('cancellation_rate_last_year', session_model.loc[selected_specialty, 'cancellation_rate']),
+            average_cases_per_list
+        ]
+
+        # Patients removed per month by one weekly session, with baseline month-to-month variation
+        clearance_horizon = max(int(target_month), int(projection_months))
+        clearance_simulations = 200
+        removal_variation = baseline_removals / np.nanmean(baseline_removals, axis=1, keepdims=True)
+        removals_per_session = sample_monthly_flows(removal_variation, clearance_horizon, clearance_simulations, rng) * (
+            session_cases(1, session_model['weeks_per_year'], session_model['cancellation_rate'], session_model['acpl'])
+            * session_model['removals_per_case'] / 12
+        ).to_numpy()[None, :, None]
+        clearance_additions = sample_monthly_flows(baseline_additions, clearance_horizon, clearance_simulations, rng)
+
+        current_projection = project_cohorts(
+            latest_cohorts,
+            clearance_additions,
+            removals_per_session * session_model['sessions_per_week'].to_numpy()[None, :, None],
+            rule=rule,
+            clinical_share=clinical_share
+        )
+        earliest_months = earliest_clearance_month(current_projection, prob=clearance_probability)
+        st.session_state.waiting_list_cube = refresh_cube(st.session_state.get('waiting_list_cube'), st.session_state.waiting_list_df)
+        required_sessions = clearance_sessions(
+            latest_cohorts,
+            clearance_additions,
+            removals_per_session,
+            st.session_state.waiting_list_cube['version'],
+            selected_trust,
+            selected_site,
+            baseline_start,
+            baseline_end,
+            (selected_specialty, sessions_planned, weeks_in_year) + tuple(session_model.loc[selected_specialty, ['cancellation_rate', 'acpl']]),
+            int(target_month),
+            clearance_probability,
+            rule,
+            clinical_share if rule == 'clinical' else None
+        )
+
+        clearance_table = pd.DataFrame({'Specialty': all_specialties, 'Sessions per Week (Current)': session_model['sessions_per_week'].values})
+        for band in ['18+', '40+', '52+']:
+            clearance_table[f'Earliest Month {band} Cleared'] = pd.Series(earliest_months[band]).map(
+                lambda month: 'Not within horizon' if np.isnan(month) else f"Month {month:.0f}"
+            ).values
+        for band in ['18+', '40+', '52+']:
+            clearance_table[f'Sessions per Week to Clear {band} by Month {target_month}'] = required_sessions[band]
+        st.dataframe(clearance_table.round(1), hide_index=True)
+
     else:
         st.error("Waiting list backlog data is not available. Please ensure it is loaded into session state.")
 else:
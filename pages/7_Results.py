@@ -1,6 +1,20 @@
+import tempfile
+
 import streamlit as st
 import pandas as pd
 
+from analysis.export import EXPORT_FORMATS, planning_tables, write_pack
+
+
+@st.cache_data(show_spinner="Building the planning pack...")
+def planning_pack(waiting_list_df, baseline_start, baseline_end, model_start, weeks_per_year, fmt):
+    # Every specialty's tables streamed into a temporary file, built once per data version and settings
+    with tempfile.TemporaryFile() as target:
+        write_pack(planning_tables(waiting_list_df, baseline_start, baseline_end, model_start, weeks_per_year, rng=0), target, fmt)
+        target.seek(0)
+        return target.read()
+
+
 st.title("Results")
 
 st.write("""
@@ -92,3 +106,33 @@ st.download_button(
 )
 
 st.dataframe(results_df)
+
+# Full planning pack for every specialty
+st.header("Download Planning Pack (All Specialties)")
+st.write("""
+One file with the backlog summary, demand forecasts, capacity scenarios and waiting list projections (with percentile bands) for every specialty.
+""")
+pack_format = st.radio(
+    "Format",
+    EXPORT_FORMATS,
+    format_func={'xlsx': 'Excel workbook (one sheet per table)', 'parquet': 'Parquet dataset partitioned by specialty (zip)'}.get,
+    horizontal=True,
+    key='input_pack_format'
+)
+if st.button("Prepare Planning Pack", key='input_prepare_pack'):
+    st.session_state.planning_pack = (pack_format, planning_pack(
+        st.session_state.waiting_list_df,
+        pd.to_datetime(st.session_state.baseline_start_date),
+        pd.to_datetime(st.session_state.baseline_end_date),
+        pd.to_datetime(st.session_state.model_start_date),
+        st.session_state.get('weeks_last_year', 48),
+        pack_format
+    ))
+if st.session_state.get('planning_pack') is not None:
+    prepared_format, pack = st.session_state.planning_pack
+    st.download_button(
+        label="Download Planning Pack",
+        data=pack,
+        file_name="planning_pack.xlsx" if prepared_format == 'xlsx' else "planning_pack_parquet.zip",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet" if prepared_format == 'xlsx' else "application/zip"
+    )